@@ -0,0 +1,180 @@
+import torch
+import convs2s.module as md
+
+
+def pad_to(x, dim, size, value=0):
+
+    # Pads dimension dim of x at the end up to size
+    if x.shape[dim] >= size:
+        return x
+
+    shape = list(x.shape)
+    shape[dim] = size - x.shape[dim]
+
+    return torch.cat((x, torch.full(shape, value, dtype=x.dtype, device=x.device)), dim=dim)
+
+
+class DecodeBatch:
+
+    # Live batch of segments for continuous (step-level) raw-attention decoding. Segments join
+    # at any decode step and leave as soon as they are finished. Every row holds the encoder
+    # keys and values, conv states, frame counter and output/attention history of one segment,
+    # padded to the longest source and target in the batch.
+    def __init__(self, model, decoder_step, num_mels, rf, device, pos_weight=1.0, end_detection='dtw', end_margin=3,
+                 end_tail=2, end_threshold=0.5, end_patience=3):
+
+        # decoder_step: DecoderStep of the model for the target speaker, compiled, exported or eager
+        self.model = model
+        self.decoder_step = decoder_step
+
+        self.D = num_mels*rf
+        self.rf = rf
+        self.device = device
+        self.pos_scale = pos_weight/self.D**0.5
+
+        self.end_detection = end_detection
+        self.end_margin = end_margin
+        self.end_tail = end_tail
+        self.end_threshold = end_threshold
+        self.end_patience = end_patience
+
+        # Caller-defined tag of every row, returned with its converted segment
+        self.tags = list()
+
+
+    @property
+    def size(self):
+        return len(self.tags)
+
+
+    def admit(self, K, V, key_mask, N_b, tags, c_t=None):
+
+        # K.shape, V.shape: B x d x N, key_mask.shape: B x N x 1, as returned by ConvS2S.encode
+        # c_t: target speaker of every segment, for a model whose decode step takes them
+        B, d, N = K.shape
+        T_b = [round(n*2.0) for n in N_b]
+        T = max(T_b)
+
+        rows = dict(
+            K=K,
+            V=V,
+            key_mask=key_mask,
+            N_b=torch.tensor(N_b, device=self.device),
+            t=torch.zeros((B,), device=self.device, dtype=torch.int64),
+            y=torch.zeros((B,self.D,1), device=self.device),
+            y_history=torch.zeros((B,self.D,T), device=self.device),
+            A_history=torch.zeros((B,N,T), device=self.device)
+        )
+
+        if self.model.mixed_targets:
+            rows['c_t'] = torch.tensor(c_t, device=self.device, dtype=torch.int64)
+
+        states = self.model.init_decoder_states(B, self.device)
+        end_detector = md.AttentionEndDetector(
+            N_b, T_b, self.device, margin=self.end_margin, tail=self.end_tail, threshold=self.end_threshold, patience=self.end_patience)
+
+        if self.size == 0:
+            self.rows = rows
+            self.states = states
+            self.end_detector = end_detector
+        else:
+            N = max(N, self.rows['K'].shape[2])
+            T = max(T, self.rows['y_history'].shape[2])
+
+            for name, x in rows.items():
+                self.rows[name] = torch.cat((self.__pad(name, self.rows[name], N, T), self.__pad(name, x, N, T)), dim=0)
+
+            self.states = [torch.cat((state, new_state), dim=0) for state, new_state in zip(self.states, states)]
+            self.end_detector.extend(end_detector)
+
+        self.tags += list(tags)
+
+        self.pos = self.model.consts.position_encoding(T, self.D, self.device) * self.pos_scale
+
+
+    def clear(self):
+
+        # Drops every row, returns their tags
+        tags, self.tags = self.tags, list()
+
+        return tags
+
+
+    def step(self):
+
+        # Decodes one frame of every row, returns (tag, converted melspec) of the rows that finished
+        rows = self.rows
+        index = torch.arange(self.size, device=self.device)
+
+        t = rows['t']
+        in_t = rows['y'] + self.pos[0][:, t].permute(1,0).unsqueeze(2)
+
+        targets = (rows['c_t'],) if self.model.mixed_targets else ()
+
+        with torch.no_grad():
+            y, A, *self.states = self.decoder_step(in_t, rows['K'], rows['V'], rows['key_mask'], t, *targets, *self.states)
+
+        # Under autocast the step outputs bfloat16 frames, the rows are kept in fp32
+        y = y.float()
+
+        rows['y_history'][index, :, t] = y[:,:,0]
+        rows['A_history'][index, :, t] = A[:,:,0]
+
+        if self.end_detection == 'online':
+            self.end_detector.update(A, t)
+            finished = self.end_detector.finished(t)
+        else:
+            finished = self.end_detector.T_b <= t + 1
+
+        rows['t'] = t + 1
+        rows['y'] = y
+
+        if not bool(finished.any()):
+            return list()
+
+        return self.__retire(finished)
+
+
+    def __retire(self, finished):
+
+        rows = self.rows
+        results = list()
+
+        end_of_frame = self.end_detector.end_of_frame.tolist() if self.end_detection == 'online' else [-1]*self.size
+
+        for b in torch.nonzero(finished)[:,0].tolist():
+
+            if end_of_frame[b] < 0:
+                n_b, t_b = int(rows['N_b'][b]), int(self.end_detector.T_b[b])
+                end_of_frame[b] = self.model.alignment_end(rows['A_history'][b,0:n_b,0:t_b])
+
+            melspec_conv = self.model.expand(rows['y_history'][b:b+1,:,0:end_of_frame[b]], self.rf).cpu().numpy()
+            results.append((self.tags[b], melspec_conv[0,:,:]))
+
+        keep = torch.nonzero(~finished)[:,0]
+
+        for name in rows:
+            rows[name] = rows[name][keep]
+
+        self.states = [state[keep] for state in self.states]
+        self.end_detector.select(keep)
+
+        self.tags = [self.tags[b] for b in keep.tolist()]
+
+        return results
+
+
+    @staticmethod
+    def __pad(name, x, N, T):
+
+        # Source frames are padded as masked keys, target frames with zeros
+        if name in ('K', 'V'):
+            return pad_to(x, 2, N)
+        if name == 'key_mask':
+            return pad_to(x, 1, N, True)
+        if name == 'y_history':
+            return pad_to(x, 2, T)
+        if name == 'A_history':
+            return pad_to(pad_to(x, 1, N), 2, T)
+
+        return x
@@ -0,0 +1,104 @@
+# Banded DTW on a distance matrix, used to find the end of the decoded utterance
+# from the attention matrix of ConvS2S
+
+import numpy as np
+
+
+def banded_dtw(D0, w=np.inf, p=0.0):
+
+    # Cells of an anti-diagonal i+j=k only depend on the two previous anti-diagonals,
+    # so every anti-diagonal of the band is filled with one set of array operations.
+    # Visits the same cells with the same tie-breaking as banded_dtw_loop.
+
+    r, c = D0.shape
+    AccDis = np.full(D0.shape, np.inf)
+    AccDis[0,0] = D0[0,0]
+    pointer = np.full(D0.shape, 0)
+
+    for i in range(1,min(r,1+w+1)):
+        AccDis[i,0] = AccDis[i-1,0] + p + D0[i,0]
+        pointer[i,0] = 1 #means "came from down"
+
+    for j in range(1,min(c,1+w+1)):
+        AccDis[0,j] = AccDis[0,j-1] + p + D0[0,j]
+        pointer[0,j] = 2 #means "came from left"
+
+    # |i-j| <= w, in integers
+    w = int(min(w, r+c))
+
+    for k in range(2, r+c-1):
+
+        i_start = max(1, k-c+1, (k-w+1)//2)
+        i_end = min(r-1, k-1, (k+w)//2)
+
+        if i_start > i_end:
+            continue
+
+        i = np.arange(i_start, i_end+1)
+        j = k - i
+
+        candidates = np.stack((AccDis[i-1,j-1], AccDis[i-1,j]+p, AccDis[i,j-1]+p))
+        came_from = np.argmin(candidates, axis=0)
+
+        AccDis[i,j] = candidates[came_from, np.arange(len(i))] + D0[i,j]
+        pointer[i,j] = came_from
+
+    return _trace_back(AccDis, pointer)
+
+
+def banded_dtw_loop(D0, w=np.inf, p=0.0):
+
+    # Reference cell-by-cell implementation
+
+    r, c = D0.shape
+    AccDis = np.full(D0.shape, np.inf)
+    AccDis[0,0] = D0[0,0]
+    pointer = np.full(D0.shape, 0)
+    irange = range(1,min(r,1+w+1))
+
+    for i in irange:
+        AccDis[i,0] = AccDis[i-1,0] + p + D0[i,0]
+        pointer[i,0] = 1 #means "came from down"
+
+    jrange = range(1,min(c,1+w+1))
+
+    for j in jrange:
+        AccDis[0,j] = AccDis[0,j-1] + p + D0[0,j]
+        pointer[0,j] = 2 #means "came from left"
+    
+
+    for i in range(1,r):
+        jrange = range(max(1,i-w),min(c,i+w+1))
+        for j in jrange:
+            AccDis[i,j] = np.min([AccDis[i-1,j-1], AccDis[i-1,j]+p, AccDis[i,j-1]+p]) + D0[i,j]
+            pointer[i,j] = np.argmin([AccDis[i-1,j-1], AccDis[i-1,j]+p, AccDis[i,j-1]+p])
+
+    return _trace_back(AccDis, pointer)
+
+
+def _trace_back(AccDis, pointer):
+
+    r, c = AccDis.shape
+
+    if np.min(AccDis[:,c-1])<np.min(AccDis[r-1,:]):
+        r_end = np.argmin(AccDis[:,c-1])
+        c_end = c-1
+
+    else:
+        r_end = r-1
+        c_end = np.argmin(AccDis[r-1,:])
+
+    path_r, path_c = [r_end], [c_end]
+    i, j = r_end, c_end
+    while (i > 0) or (j > 0):
+        if pointer[i,j]==0:
+            i -= 1
+            j -= 1
+        elif pointer[i,j]==1:
+            i -= 1
+        else: #pointer[i,j]==2:
+            j -= 1
+        path_r.append(i)
+        path_c.append(j)
+
+    return np.array(path_r[::-1]), np.array(path_c[::-1])
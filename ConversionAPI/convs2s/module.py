@@ -5,6 +5,7 @@
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 def calc_padding(kernel_size, dilation, causal, stride=1):
 
@@ -17,6 +18,121 @@ def calc_padding(kernel_size, dilation, causal, stride=1):
     return padding
 
 
+def conv_weight(conv):
+
+    # Current weight of a Conv1d, also when weight norm is still applied to it
+    if hasattr(conv, 'weight_g'):
+        return torch._weight_norm(conv.weight_v, conv.weight_g, 0)
+
+    return conv.weight
+
+
+def tap_conv(conv, taps):
+
+    # One output frame of conv from its ks dilated taps (batch x ch x ks)
+    if isinstance(conv, Int8Conv1d):
+        return conv.linear(taps.flatten(1)).unsqueeze(2)
+
+    return F.conv1d(taps, conv_weight(conv), conv.bias)
+
+
+class Int8Conv1d(nn.Module):
+
+    # Conv1d computed as a dynamically quantized int8 Linear over its dilated taps.
+    # Weights get one scale per output channel, so small channels keep their precision next to large ones.
+    def __init__(self, conv):
+        super(Int8Conv1d, self).__init__()
+
+        self.in_channels = conv.in_channels
+        self.out_channels = conv.out_channels
+        self.kernel_size = conv.kernel_size
+        self.dilation = conv.dilation
+        self.padding = conv.padding
+
+        weight = conv_weight(conv).detach()
+
+        # Input index c*ks + k, the order of flattened taps
+        linear = nn.Linear(self.in_channels*self.kernel_size[0], self.out_channels).to(weight.device)
+        linear.weight.data.copy_(weight.reshape(self.out_channels, -1))
+        linear.bias.data.copy_(conv.bias.detach())
+
+        self.linear = torch.ao.quantization.quantize_dynamic(
+            nn.Sequential(linear), {nn.Linear: torch.ao.quantization.per_channel_dynamic_qconfig}, dtype=torch.qint8)[0]
+
+
+    def forward(self, x):
+
+        # x.shape: B x C x L
+        ks = self.kernel_size[0]
+        df = self.dilation[0]
+
+        if self.padding[0] > 0:
+            x = F.pad(x, (self.padding[0], self.padding[0]))
+
+        if ks == 1:
+            taps = x.permute(0, 2, 1)
+        else:
+            # B x L_out x C*ks
+            taps = x.unfold(2, (ks-1)*df + 1, 1)[:, :, :, ::df].permute(0, 2, 1, 3).flatten(2)
+
+        return self.linear(taps).permute(0, 2, 1)
+
+
+def quantize_convs(module):
+
+    # Replaces every stride-1, ungrouped, zero-padded Conv1d of module with an Int8Conv1d
+    remove_weight_norm(module)
+
+    for m in list(module.modules()):
+        for name, child in list(m.named_children()):
+            if (isinstance(child, nn.Conv1d) and child.stride == (1,) and child.groups == 1
+                    and child.padding_mode == 'zeros' and not isinstance(child.padding, str)):
+                setattr(m, name, Int8Conv1d(child))
+
+    return module
+
+
+class RingBuffer:
+
+    # Fixed-size input history of a causal dilated convolution, for frame-by-frame decoding.
+    # A frame is written in place and only the ks dilated taps of the next output are gathered.
+    def __init__(self, batch, ch, ks, df, device, dtype=torch.float):
+
+        self.size = (ks-1)*df + 1
+        self.position = 0
+
+        self.buffer = torch.zeros((batch, ch, self.size), device=device, dtype=dtype)
+        self.taps = torch.zeros((batch, ch, ks), device=device, dtype=dtype)
+
+        # tap_index[p]: slots of the ks taps when the newest frame is in slot p
+        self.tap_index = torch.tensor(
+            [[(p - (ks-1-k)*df) % self.size for k in range(ks)] for p in range(self.size)], 
+            device=device)
+
+
+    def push(self, x):
+
+        # x.shape: batch x ch x 1
+        self.buffer[:, :, self.position].copy_(x[:, :, 0])
+
+        torch.index_select(self.buffer, 2, self.tap_index[self.position], out=self.taps)
+
+        self.position = (self.position + 1) % self.size
+
+        # batch x ch x ks
+        return self.taps
+
+
+class IncrementalState:
+
+    # Frame-by-frame decoding state of a decoder: one ring buffer per causal layer
+    # and the number of frames decoded so far
+    def __init__(self, buffers):
+
+        self.buffers = buffers
+        self.t = 0
+
+
 class DilCausConv1D(nn.Module):
 
     def __init__(self, in_ch, out_ch, ks, df):
@@ -44,6 +160,14 @@ class DilCausConv1D(nn.Module):
         return output, state
 
 
+    def step(self, input, buffer):
+
+        # One output frame from the taps of the ring buffer, same result as forward with the equivalent state
+        taps = buffer.push(input)
+
+        return tap_conv(self.conv1, taps)
+
+
 class DilConv1D(nn.Module):
 
     def __init__(self, in_ch, out_ch, ks, df):
@@ -95,6 +219,18 @@ class DilCausConvGLU1D(nn.Module):
         return output, state
 
 
+    def step(self, input, buffer):
+
+        # One output frame from the taps of the ring buffer, same result as forward with the equivalent state
+        taps = buffer.push(input)
+
+        output = tap_conv(self.conv1, taps)
+
+        h_l, h_g = torch.split(output, output.shape[1]//2, dim=1)
+
+        return h_l * torch.sigmoid(h_g)
+
+
 class DilConvGLU1D(nn.Module):
 
     def __init__(self, in_ch, out_ch, ks, df):
@@ -118,6 +254,164 @@ class DilConvGLU1D(nn.Module):
         return h
    
 
+def remove_weight_norm(module):
+
+    # Weight norm only matters for training, at inference it recomputes every weight on each call
+    for m in module.modules():
+        if isinstance(m, nn.Conv1d) and hasattr(m, 'weight_g'):
+            nn.utils.remove_weight_norm(m)
+
+    return module
+
+
+def split_speaker_weight(conv, l):
+
+    # conv: Conv1d whose last l.shape[0] input channels are a constant speaker embedding l
+    # Returns the weight of the other input channels and the contribution of the embedding
+    # through every kernel tap (out_ch x ks)
+
+    h_ch = l.shape[0]
+    weight = conv.weight.detach()
+
+    emb_taps = torch.einsum('oik,i->ok', weight[:, -h_ch:, :], l)
+
+    return weight[:, :-h_ch, :].contiguous(), emb_taps
+
+
+def folded_conv(conv, weight, bias):
+
+    folded = nn.Conv1d(
+        weight.shape[1], weight.shape[0], conv.kernel_size[0], 
+        dilation=conv.dilation[0], padding=conv.padding[0]).to(weight.device)
+
+    folded.weight.data.copy_(weight)
+    folded.bias.data.copy_(bias)
+
+    return folded
+
+
+class SpeakerDilConv1D(nn.Module):
+
+    # DilConv1D (kernel size 1) with a constant speaker embedding folded into its bias
+    def __init__(self, layer, l):
+        super(SpeakerDilConv1D, self).__init__()
+
+        assert layer.conv1.kernel_size[0] == 1
+
+        weight, emb_taps = split_speaker_weight(layer.conv1, l)
+
+        self.conv1 = folded_conv(layer.conv1, weight, layer.conv1.bias.detach() + emb_taps[:, 0])
+
+
+    def forward(self, x):
+
+        return self.conv1(x)
+
+
+class SpeakerDilConvGLU1D(nn.Module):
+
+    # DilConvGLU1D with a constant speaker embedding folded into an effective bias.
+    # Near the edges (and padded frames) some taps fall on zero padding, which the embedding
+    # channels also had, so the bias is the embedding taps convolved with the valid-frame mask
+    def __init__(self, layer, l):
+        super(SpeakerDilConvGLU1D, self).__init__()
+
+        weight, emb_taps = split_speaker_weight(layer.conv1, l)
+
+        self.conv1 = folded_conv(layer.conv1, weight, layer.conv1.bias.detach())
+
+        # out_ch x 1 x ks
+        self.register_buffer('emb_taps', emb_taps.unsqueeze(1))
+
+
+    def forward(self, x, mask=None):
+
+        if mask is None:
+            mask = x.new_ones((1, 1, x.shape[2]))
+
+        h = self.conv1(x)
+        h = h + F.conv1d(mask, self.emb_taps, padding=self.conv1.padding, dilation=self.conv1.dilation)
+
+        h_l, h_g = torch.split(h, h.shape[1]//2, dim=1)
+        h = h_l * torch.sigmoid(h_g)
+
+        return h
+
+
+class SpeakerDilCausConvGLU1D(nn.Module):
+
+    # DilCausConvGLU1D with a constant speaker embedding folded into an effective bias.
+    # The initial state is all zeros, embedding channels included, so during the first
+    # (ks-1)*df frames only the taps that reach the segment see the embedding.
+    def __init__(self, layer, l):
+        super(SpeakerDilCausConvGLU1D, self).__init__()
+
+        self.padding = layer.padding
+
+        weight, emb_taps = split_speaker_weight(layer.conv1, l)
+
+        self.conv1 = folded_conv(layer.conv1, weight, layer.conv1.bias.detach())
+
+        ks = layer.conv1.kernel_size[0]
+        df = layer.conv1.dilation[0]
+
+        # bias_table[:, s]: embedding contribution to a frame that has s frames of the segment before it
+        bias_table = torch.zeros((emb_taps.shape[0], self.padding+1), device=emb_taps.device)
+
+        for s in range(self.padding+1):
+            for k in range(ks):
+                if s - (ks-1-k)*df >= 0:
+                    bias_table[:, s] += emb_taps[:, k]
+
+        self.register_buffer('bias_table', bias_table)
+
+
+    def bias(self, t, n_t):
+
+        # t: number of segment frames before the input, an int or a LongTensor with one entry per batch item
+        if torch.is_tensor(t):
+            s = torch.clamp(t.view(-1, 1) + torch.arange(n_t, device=t.device), max=self.padding)
+            return self.bias_table[:, s].permute(1, 0, 2)
+
+        if t >= self.padding:
+            return self.bias_table[:, self.padding:].unsqueeze(0)
+
+        s = torch.clamp(torch.arange(t, t+n_t, device=self.bias_table.device), max=self.padding)
+
+        return self.bias_table[:, s].unsqueeze(0)
+
+
+    def forward(self, input, state=None, t=0):
+
+        if state is None:
+            state = torch.zeros_like(input[:, :, :1]).repeat(1, 1, self.padding)
+
+        input = torch.cat([state, input], dim=2)
+
+        output = self.conv1(input)
+
+        state = input[:, :, -self.padding:]
+
+        output = output + self.bias(t, output.shape[2])
+
+        h_l, h_g = torch.split(output, output.shape[1]//2, dim=1)
+
+        output = h_l * torch.sigmoid(h_g)
+
+        return output, state
+
+
+    def step(self, input, buffer, t):
+
+        taps = buffer.push(input)
+
+        output = tap_conv(self.conv1, taps) + self.bias(t, 1)
+
+        h_l, h_g = torch.split(output, output.shape[1]//2, dim=1)
+
+        return h_l * torch.sigmoid(h_g)
+
+
 def position_encoding(length, n_units):
     # Implementation in the Google tensor2tensor repo
     channels = n_units
@@ -151,4 +445,269 @@ def concat_dim1(x,y):
 
     h = torch.cat((x,yy), dim=1)
 
-    return h
\ No newline at end of file
+    return h
+
+
+def speaker_embedding(eb, c, num_batch):
+
+    # A constant speaker index selects its row of the embedding table on the device,
+    # without building an index tensor on the host
+    if torch.is_tensor(c):
+        return eb(c.to(eb.weight.device))
+
+    return eb.weight[c].expand(num_batch, -1)
+
+
+class ConstantCache:
+
+    # Device-resident constants of a model, built once and sliced afterwards
+    def __init__(self, max_length=2048):
+
+        self.max_length = max_length
+
+        self.position_tables = dict()
+        self.zero_tensors = dict()
+
+
+    def position_encoding(self, length, n_units, device):
+
+        key = (n_units, device)
+
+        table = self.position_tables.get(key)
+
+        if table is None or table.shape[2] < length:
+
+            self.max_length = max(self.max_length, length)
+
+            table = torch.tensor(position_encoding(self.max_length, n_units)).to(device, dtype=torch.float)
+            self.position_tables[key] = table
+
+        # 1 x n_units x length
+        return table[:, :, 0:length]
+
+
+    def zeros(self, shape, device):
+
+        # The returned tensor is shared, it must not be written in place
+        key = (tuple(shape), device)
+
+        zero = self.zero_tensors.get(key)
+
+        if zero is None:
+
+            zero = torch.zeros(shape, device=device, dtype=torch.float)
+            self.zero_tensors[key] = zero
+
+        return zero
+
+
+def attention_weights(K, Q, key_mask):
+
+    # Scaled dot-product attention over the valid source frames of every segment.
+    # The softmax runs in fp32, also when autocast computes the scores in bfloat16.
+    scores = torch.matmul(K.permute(0,2,1), Q).float()/np.sqrt(K.shape[1])
+
+    return F.softmax(scores.masked_fill(key_mask, -np.inf), dim=1)
+
+
+class AttentionEndDetector:
+
+    # Online end-of-utterance detection for a batch of segments: a segment has ended
+    # once its attention mass stays on its final source frames for a few steps
+    def __init__(self, N_b, T_b, device, margin=3, tail=2, threshold=0.5, patience=3, check_interval=8):
+
+        n_end = torch.tensor(N_b, device=device).view(-1,1)
+
+        # tail_index.shape: B x tail, the last `tail` valid frames of every segment
+        tail_index = n_end - tail + torch.arange(tail, device=device).view(1,tail)
+
+        self.tail_valid = (tail_index >= 0).to(dtype=torch.float)
+        self.tail_index = torch.clamp(tail_index, min=0)
+
+        self.T_b = torch.tensor(T_b, device=device)
+
+        self.margin = margin
+        self.threshold = threshold
+        self.patience = patience
+
+        # Decode steps between two checks whether every segment has ended, each check waits for the device
+        self.check_interval = check_interval
+
+        self.streak = torch.zeros_like(self.T_b)
+
+        # -1 until the end of the segment is detected
+        self.end_of_frame = torch.full_like(self.T_b, -1)
+
+
+    def update(self, A, t):
+
+        # A.shape: B x N x 1, attention of decode step t
+        # t: decode step, an int or a LongTensor with one entry per batch item
+        tail_mass = torch.sum(A[:,:,0].gather(1, self.tail_index)*self.tail_valid, dim=1)
+
+        self.streak = torch.where(tail_mass >= self.threshold, self.streak + 1, 0)
+
+        detected = (self.streak >= self.patience) & (self.end_of_frame < 0)
+
+        # The end is placed `margin` steps after the attention first reached the tail
+        if torch.is_tensor(t):
+            end_of_frame = torch.minimum(self.T_b, torch.clamp(t - self.patience + 1 + self.margin, min=1))
+        else:
+            end_of_frame = self.T_b.clamp(max=max(t - self.patience + 1 + self.margin, 1))
+
+        self.end_of_frame = torch.where(detected, end_of_frame, self.end_of_frame)
+
+
+    def all_finished(self, t):
+
+        # Only every check_interval steps, the decoding continues until then. A detected end
+        # does not move, so the frames decoded past it are not part of the output.
+        if (t + 1) % self.check_interval != 0:
+            return False
+
+        return bool(self.finished(t).all())
+
+
+    def finished(self, t):
+
+        # Segments without a detected end keep decoding until their maximum length
+        return ((self.end_of_frame >= 0) & (self.end_of_frame <= t + 1)) | (self.T_b <= t + 1)
+
+
+    def select(self, index):
+
+        # Keeps the batch items in index, for batches whose items leave at different steps
+        for name in ('tail_index', 'tail_valid', 'T_b', 'streak', 'end_of_frame'):
+            setattr(self, name, getattr(self, name)[index])
+
+
+    def extend(self, other):
+
+        # Appends the batch items of another detector with the same settings
+        for name in ('tail_index', 'tail_valid', 'T_b', 'streak', 'end_of_frame'):
+            setattr(self, name, torch.cat((getattr(self, name), getattr(other, name)), dim=0))
+
+
+class ForwardAttention:
+
+    # Forward attention for a batch of segments, kept on the device: the attended source frame
+    # is predicted by a running regression over the Gaussian-weighted attention peaks,
+    # and the attention is masked to a window around it
+    def __init__(self, N_b, rf, device, sigma=5.0):
+
+        N = max(N_b)
+
+        self.n = torch.arange(N, device=device).view(1,N,1)
+        self.N_b = torch.tensor(N_b, device=device).view(-1,1,1)
+        self.valid = self.n < self.N_b
+
+        self.sigma = sigma
+        self.before = 20//rf
+        self.after = 40//rf
+
+        self.n_argmax = torch.zeros_like(self.N_b)
+
+        # Regression samples (x: step, y: peak), starting from (0, 0)
+        self.count = 1
+        self.sum_x = 0.0
+        self.sum_xx = 0.0
+        self.sum_y = torch.zeros(self.N_b.shape, device=device, dtype=torch.float64)
+        self.sum_xy = torch.zeros(self.N_b.shape, device=device, dtype=torch.float64)
+
+
+    def __call__(self, A, t):
+
+        # A.shape: B x N x 1, attention of decode step t
+
+        # Peak of the attention weighted by a Gaussian around the predicted frame, in the log domain
+        score = torch.log(A + 1e-12) - torch.square(self.n - self.n_argmax)/(2.0*self.sigma**2)
+        peak = torch.argmax(score.masked_fill(~self.valid, -np.inf), dim=1, keepdim=True)
+
+        if t == 0:
+            self.n_argmax = torch.maximum(peak, self.n_argmax)
+        else:
+            self.count += 1
+            self.sum_x += t
+            self.sum_xx += t*t
+            self.sum_y += peak
+            self.sum_xy += t*peak
+
+            mean_x = self.sum_x/self.count
+            var_x = max(self.sum_xx/self.count - mean_x**2, 0.0)
+            cov = self.sum_xy/self.count - mean_x*self.sum_y/self.count
+
+            slope = cov/(max(np.sqrt(var_x),1e-10)**2)
+            self.n_argmax = torch.round(slope*(t+1)).to(dtype=self.n.dtype)
+
+        start = torch.clamp(self.n_argmax - self.before, min=0)
+        end = torch.minimum(self.n_argmax + self.after, self.N_b - 1)
+        # A negative end counts from the end of the segment, like a NumPy slice bound
+        end = torch.where(end < 0, torch.clamp(end + self.N_b, min=0), end)
+
+        window = (self.n >= start) & (self.n < end)
+
+        A = torch.clamp(torch.where(window, A, 0.0), min=1e-10).masked_fill(~self.valid, 0.0)
+
+        return A/torch.sum(A, dim=1, keepdim=True)
+
+
+class LocalAttention:
+
+    # Scaled dot-product attention over a window of the source frames around the tracked alignment
+    # position of every segment. Items whose window loses the alignment take the full attention
+    # of that step instead, which re-centers the window. Both are computed every step and selected
+    # on the device, so the decode loop never waits for the host to decide between them.
+    def __init__(self, N_b, window, device, threshold=0.2):
+
+        N = max(N_b)
+
+        self.window = min(window, N)
+        self.threshold = threshold
+
+        N_b = torch.tensor(N_b, device=device)
+
+        # Last valid window start of every segment
+        self.max_start = torch.clamp(N_b - self.window, min=0)
+
+        self.offsets = torch.arange(self.window, device=device).view(1,-1)
+        self.position = torch.zeros_like(N_b)
+
+        # Number of steps where some item needed full attention, for monitoring
+        self.fallbacks = torch.zeros((), device=device, dtype=torch.long)
+
+
+    def __call__(self, K, V, Q, key_mask, A_out):
+
+        # K.shape, V.shape: B x d x N, Q.shape: B x d x 1, key_mask.shape: B x N x 1
+        # A_out.shape: B x N x 1, zero-initialized attention column the weights are written into
+        B, d, _ = K.shape
+
+        # The window leads the alignment, which moves forward by about half a frame per step
+        start = torch.minimum(torch.clamp(self.position - self.window//4, min=0), self.max_start)
+        index = start.view(B,1) + self.offsets
+
+        K_win = K.gather(2, index.unsqueeze(1).expand(-1, d, -1))
+        mask_win = key_mask.gather(1, index.unsqueeze(2))
+
+        A_win = attention_weights(K_win, Q, mask_win)
+
+        peak, peak_index = torch.max(A_win[:,:,0], dim=1)
+
+        # Low confidence: a flat window, or its peak on an edge the alignment may have crossed
+        on_edge = ((peak_index == 0) & (start > 0)) | ((peak_index == self.window-1) & (start < self.max_start))
+        lost = (peak < self.threshold) | on_edge
+
+        self.fallbacks += lost.any()
+
+        A = attention_weights(K, Q, key_mask)
+
+        A_local = torch.zeros_like(A).scatter_(1, index.unsqueeze(2), A_win)
+        A = torch.where(lost.view(B,1,1), A, A_local)
+
+        A_out.copy_(A)
+        self.position = torch.where(
+            lost, 
+            torch.argmax(A[:,:,0], dim=1), 
+            index.gather(1, peak_index.view(B,1)).view(B))
+
+        return torch.matmul(V, A)
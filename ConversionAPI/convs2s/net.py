@@ -9,6 +9,7 @@ import torch.nn.functional as F
 import time
 
 import convs2s.module as md
+import convs2s.dtw as dtw
 
 class Encoder1(nn.Module):
 
@@ -48,16 +49,14 @@ class Encoder1(nn.Module):
         self.dropout = nn.Dropout(p=dor)
         
 
-    def forward(self, x, c):
+    def forward(self, x, c, mask=None):
 
-        device = x.device
+        # mask: B x 1 x n_t, zero on the padded frames of a batch of segments
 
         N, n_ch, n_t = x.shape
 
-        t = torch.LongTensor(c*np.ones(N)).to(device, dtype=torch.int64)
-
         # l: embed32
-        l = self.eb(t)
+        l = md.speaker_embedding(self.eb, c, N)
         
         out = self.dropout(x)
 
@@ -72,6 +71,10 @@ class Encoder1(nn.Module):
             # outl: 512 + 32 = 544
             outl = md.concat_dim1(out,l)
 
+            # Padded frames are seen as zero padding, as for a single segment
+            if mask is not None:
+                outl = outl * mask
+
             # out: 544 -> 512
             out = layer(outl) + out
 
@@ -125,14 +128,10 @@ class PreDecoder1(nn.Module):
         if state is None:
             state = [None]*self.num_layers
 
-        device = x.device
-
         N, n_ch, n_t = x.shape
 
-        t = torch.LongTensor(c*np.ones(N)).to(device, dtype=torch.int64)
-        
         # l.shape: (N, h_ch)
-        l = self.eb(t)
+        l = md.speaker_embedding(self.eb, c, N)
         
         out = self.dropout(x)
 
@@ -157,6 +156,32 @@ class PreDecoder1(nn.Module):
         return Q, state
 
 
+    def init_state(self, batch, device):
+
+        return md.IncrementalState([
+            md.RingBuffer(batch, layer.conv1.in_channels, layer.conv1.kernel_size[0], layer.conv1.dilation[0], device) 
+            for layer in self.glu_blocks])
+
+
+    def step(self, x, c, state):
+
+        # Decodes a single frame, the layer histories are kept in the ring buffers of state
+
+        l = md.speaker_embedding(self.eb, c, x.shape[0])
+
+        out = self.start(md.concat_dim1(x,l))
+
+        for layer, buffer in zip(self.glu_blocks, state.buffers):
+
+            out = layer.step(md.concat_dim1(out,l), buffer) + out
+
+        Q = self.end(md.concat_dim1(out,l))
+
+        state.t += 1
+
+        return Q
+
+
 class PostDecoder1(nn.Module):
 
     # 1D Dilated Causal Convolution
@@ -193,13 +218,9 @@ class PostDecoder1(nn.Module):
         if state is None:
             state = [None]*self.num_layers
 
-        device = x.device
-
         N, n_ch, n_t = x.shape
 
-        t = torch.LongTensor(c*np.ones(N)).to(device, dtype=torch.int64)
-        
-        l = self.eb(t)
+        l = md.speaker_embedding(self.eb, c, N)
         # l.shape: (N, h_ch)
         
         out = self.dropout(x)
@@ -225,9 +246,140 @@ class PostDecoder1(nn.Module):
         return y, state
 
 
+    def init_state(self, batch, device):
+
+        return md.IncrementalState([
+            md.RingBuffer(batch, layer.conv1.in_channels, layer.conv1.kernel_size[0], layer.conv1.dilation[0], device) 
+            for layer in self.glu_blocks])
+
+
+    def step(self, x, c, state):
+
+        # Decodes a single frame, the layer histories are kept in the ring buffers of state
+
+        l = md.speaker_embedding(self.eb, c, x.shape[0])
+
+        out = self.start(md.concat_dim1(x,l))
+
+        for layer, buffer in zip(self.glu_blocks, state.buffers):
+
+            out = layer.step(md.concat_dim1(out,l), buffer) + out
+
+        y = self.end(md.concat_dim1(out,l))
+
+        state.t += 1
+
+        return y
+
+
+
+class SpecializedEncoder1(nn.Module):
+
+    # Inference-only Encoder1 for one fixed speaker: no weight norm,
+    # and the speaker embedding is folded into the convolutions
+    def __init__(self, enc, c):
+        super(SpecializedEncoder1, self).__init__()
+
+        l = enc.eb.weight[c].detach()
+
+        self.c = c
+        self.num_layers = enc.num_layers
+
+        self.start = md.SpeakerDilConv1D(enc.start, l)
+
+        self.glu_blocks = nn.ModuleList([md.SpeakerDilConvGLU1D(layer, l) for layer in enc.glu_blocks])
+
+        self.end = md.SpeakerDilConv1D(enc.end, l)
+
+
+    def forward(self, x, c, mask=None):
+
+        out = self.start(x)
+
+        for i, layer in enumerate(self.glu_blocks):
+
+            outl = out if mask is None else out * mask
+
+            out = layer(outl, mask) + out
+
+        out = self.end(out)
+
+        K, V = torch.split(out, out.shape[1]//2, dim=1)
+
+        return K, V
+
+
+class SpecializedDecoder1(nn.Module):
+
+    # Inference-only PreDecoder1/PostDecoder1 for one fixed speaker: no weight norm,
+    # and the speaker embedding is folded into the convolutions
+    def __init__(self, dec, c):
+        super(SpecializedDecoder1, self).__init__()
+
+        l = dec.eb.weight[c].detach()
+
+        self.c = c
+        self.num_layers = dec.num_layers
+
+        self.start = md.SpeakerDilConv1D(dec.start, l)
+
+        self.glu_blocks = nn.ModuleList([md.SpeakerDilCausConvGLU1D(layer, l) for layer in dec.glu_blocks])
+
+        self.end = md.SpeakerDilConv1D(dec.end, l)
+
+
+    def forward(self, x, c, state=None):
+
+        # state: (conv states of every layer, number of frames decoded so far)
+        if state is None:
+            state = ([None]*self.num_layers, 0)
+
+        layer_states, t = state
+
+        out = self.start(x)
+
+        new_layer_states = list()
+
+        for layer, layer_state in zip(self.glu_blocks, layer_states):
+
+            _out, _state = layer(out, layer_state, t)
+
+            new_layer_states.append(_state)
+
+            out = _out + out
+
+        y = self.end(out)
+
+        return y, (new_layer_states, t + x.shape[2])
+
+
+    def init_state(self, batch, device):
+
+        return md.IncrementalState([
+            md.RingBuffer(batch, layer.conv1.in_channels, layer.conv1.kernel_size[0], layer.conv1.dilation[0], device) 
+            for layer in self.glu_blocks])
+
+
+    def step(self, x, c, state):
+
+        out = self.start(x)
+
+        for layer, buffer in zip(self.glu_blocks, state.buffers):
+
+            out = layer.step(out, buffer, state.t) + out
+
+        y = self.end(out)
+
+        state.t += 1
+
+        return y
+
 
 class ConvS2S(nn.Module):
 
+    # Whether the decode step takes the target speaker of every batch item as an input
+    mixed_targets = False
+
     def __init__(self, enc, predec, postdec):
         super(ConvS2S, self).__init__()
 
@@ -235,6 +387,81 @@ class ConvS2S(nn.Module):
         self.predec = predec
         self.postdec = postdec
 
+        # Positional encodings and zero frames, kept on the device of the model
+        self.consts = md.ConstantCache()
+
+
+    def specialize(self, c_s, c_t):
+
+        # Turns the model into an inference-only network for a fixed source and target speaker
+        md.remove_weight_norm(self)
+
+        with torch.no_grad():
+            self.enc = SpecializedEncoder1(self.enc, c_s)
+            self.predec = SpecializedDecoder1(self.predec, c_t)
+            self.postdec = SpecializedDecoder1(self.postdec, c_t)
+
+        return self
+
+
+    def quantize(self):
+
+        # int8 weights for every conv layer, computed as dynamically quantized linear layers
+        md.quantize_convs(self)
+
+        return self
+
+
+    @property
+    def specialized(self):
+        return isinstance(self.enc, SpecializedEncoder1)
+
+
+    def init_decoder_states(self, batch, device):
+
+        # Zero initial state of every causal layer of both decoders, in the order DecoderStep takes them
+        return [torch.zeros((batch, layer.conv1.in_channels, layer.padding), device=device) 
+                for layer in list(self.predec.glu_blocks) + list(self.postdec.glu_blocks)]
+
+
+    def decoder_step(self, c_t):
+
+        # Eager DecoderStep, the module that is compiled or exported
+        return DecoderStep(self, c_t)
+
+
+    def decoder_step_inputs(self, num_mels, rf, device, batch=2, N=8):
+
+        # Example inputs of DecoderStep for tracing and export. They only fix the graph,
+        # batch size and source length stay dynamic.
+        D = num_mels*rf
+        d = self.predec.end.conv1.out_channels
+
+        return (
+            torch.zeros((batch, D, 1), device=device),
+            torch.randn((batch, d, N), device=device),
+            torch.randn((batch, d, N), device=device),
+            torch.zeros((batch, N, 1), device=device, dtype=torch.bool),
+            torch.zeros((batch,), device=device, dtype=torch.int64),
+            *self.init_decoder_states(batch, device)
+        )
+
+
+    def encoder_inputs(self, num_mels, rf, device, batch=2, N=8):
+
+        # Example inputs of SourceEncoder for export
+        return (
+            torch.randn((batch, num_mels*rf, N), device=device),
+            torch.ones((batch, 1, N), device=device)
+        )
+
+
+    def compile_decoder_step(self, c_t, num_mels, rf, device):
+
+        # TorchScript trace of DecoderStep
+        with torch.no_grad():
+            return torch.jit.trace(self.decoder_step(c_t).eval(), self.decoder_step_inputs(num_mels, rf, device), check_trace=False)
+
 
     def gaussdis(self, N,mu,sigma):
 
@@ -280,7 +507,7 @@ class ConvS2S(nn.Module):
 
         if N_mod != N:
 
-            z = torch.tensor(np.zeros((B, D, N_mod-N))).to(device, dtype=torch.float)
+            z = self.consts.zeros((B, D, N_mod-N), device)
             x = torch.cat((x, z), dim=2)
 
         out = x.permute(0,2,1).reshape(B,N_mod//rf,D*rf).permute(0,2,1)
@@ -305,7 +532,7 @@ class ConvS2S(nn.Module):
 
         B,D,N = x.shape
 
-        zero = torch.tensor(np.zeros((B,D,1))).to(device, dtype=torch.float)
+        zero = self.consts.zeros((B,D,1), device)
         
         out = torch.cat((zero,x),dim=2)
 
@@ -425,214 +652,279 @@ class ConvS2S(nn.Module):
         return MainLoss, DALoss, A_np
 
 
-    def inference(self, x_s, c_s, c_t, rf, pos_weight=1.0, attention_mode='raw'):
+    def inference(self, x_s, c_s, c_t, rf, pos_weight=1.0, attention_mode='raw', lengths=None, lean=False,
+                  end_detection='dtw', end_margin=3, decoder_step=None, encoder=None, attention_window=32,
+                  end_tail=2, end_threshold=0.5, end_patience=3):
+        # x_s.shape: batchsize x num_mels x N, segments zero-padded to the longest one
+        # lengths: number of valid frames of every segment in the batch
+        # lean: only keep the attention history the DTW trim needs, and do not return it
+        # end_detection: 'dtw' decodes 2N steps and trims with DTW afterwards,
+        #   'online' stops end_margin steps after the attention settles on the last source frames,
+        #   falling back to the DTW trim for segments where it never does
+        # end_tail, end_threshold, end_patience: the attention has settled once at least end_threshold of it
+        #   is on the last end_tail source frames for end_patience steps in a row
+        # decoder_step: compiled or exported DecoderStep for c_t, used in raw attention mode
+        # encoder: exported SourceEncoder for c_s, used instead of self.enc
+        # attention_window: width of the source window the 'local' attention mode restricts every step to
         start = time.time()
         
         device = x_s.device
         # x_s.shape: batchsize x num_mels x N
         num_mels = x_s.shape[1]
 
-        x_s = self.subsample(x_s, rf)
-        BatchSize,D,N = x_s.shape
+        K, V, key_mask, N_b = self.encode(x_s, c_s, rf, pos_weight, lengths, encoder)
+
+        BatchSize,D,N = x_s.shape[0], num_mels*rf, K.shape[2]
 
-        pos_s = md.position_encoding(N, D)
-        pos_s = torch.tensor(pos_s).to(device, dtype=torch.float)
-        pos_s = pos_s.repeat(BatchSize,1,1)
         scale_emb = D**0.5
 
-        in_s = x_s
-        in_s[:,0:pos_s.shape[1],:] = in_s[:,0:pos_s.shape[1],:] + pos_s/scale_emb * pos_weight
-        x_t = torch.tensor(np.zeros((1,D,1))).to(device, dtype=torch.float)
+        if attention_mode == 'diagonal':
+            # Exactly diagonal attention (no time-warping)
+            T_b = N_b
+        else:
+            T_b = [round(n*2.0) for n in N_b]
+
+        # Every segment is decoded for as many steps as the longest one needs
+        T = max(T_b)
+
+        pos = self.consts.position_encoding(T, D, device) * (pos_weight/scale_emb)
+
+        x_t = self.consts.zeros((BatchSize,D,1), device)
 
-        self.enc.eval()
         self.predec.eval()
         self.postdec.eval()
 
-        with torch.no_grad():
-            K, V = self.enc(in_s,c_s)
-        d = K.shape[1]
-        
-        if attention_mode == 'raw' or attention_mode == None:
-            # Raw attention
-            T = round(N*2.0)
-            in_t = x_t
+        if attention_mode == 'forward':
+            forward_attention = md.ForwardAttention(N_b, rf, device)
 
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
+        if attention_mode == 'local':
+            local_attention = md.LocalAttention(N_b, attention_window, device)
 
-            state_out_predec = None
-            state_out_postdec = None
+        in_t = x_t
 
-            for t in range(0,T):
+        if attention_mode != 'raw':
+            decoder_step = None
 
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-                
-                with torch.no_grad():
+        if decoder_step is not None:
+            # Explicit conv states of the compiled step, and its per-item frame counters
+            decoder_states = self.init_decoder_states(BatchSize, device)
+            steps = torch.arange(T, device=device).view(T,1).repeat(1,BatchSize)
+            targets = (c_t,) if self.mixed_targets else ()
+        else:
+            # Conv histories of both decoders, in preallocated ring buffers
+            state_predec = self.predec.init_state(BatchSize, device)
+            state_postdec = self.postdec.init_state(BatchSize, device)
 
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
+        # Decoder outputs and attention history are written in place, one column per step
+        y_buffer = torch.zeros((BatchSize,D,T), device=device, dtype=torch.float)
 
-                    # Scaled dot-product attention
-                    A = F.softmax(torch.matmul(K.permute(0,2,1), Q)/np.sqrt(d), dim=1)
-                    R = torch.matmul(V,A)
-                    R = torch.cat((R,F.dropout(Q, p=0.0, training=False)), dim=1)
+        if attention_mode == 'diagonal':
+            A_buffer = None
+        else:
+            A_buffer = torch.zeros((BatchSize,N,T), device=device, dtype=torch.float)
 
-                    y, state_out_postdec = self.postdec(R,c_t, state_out_postdec)
+        if end_detection == 'online' and attention_mode != 'diagonal':
+            end_detector = md.AttentionEndDetector(
+                N_b, T_b, device, margin=end_margin, tail=end_tail, threshold=end_threshold, patience=end_patience)
+        else:
+            end_detector = None
 
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
-                    A_concat = A if t == 0 else torch.cat((A_concat,A), dim=2)
+        ended = False
 
-                    in_t = y
+        for t in range(0,T):
 
-            elapsed_time = time.time() - start
-            A_np = A_concat[0,:,:].detach().cpu().clone().numpy()**0.3
-            path = self.mydtw_fromDistMat(1.0-A_np,w=100,p=0.1)
+            in_t = in_t + pos[:,:,t:t+1]
 
-            end_of_frame = path[1][-1]
-            #end_of_frame = min(path[1][-1]+20, T)
-            #end_of_frame = T
-                
-        elif attention_mode == 'diagonal':
-            # Exactly diagonal attention (no time-warping)
-            T = N
-            end_of_frame = T
-            in_t = x_t
-
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
-
-            state_out_predec = None
-            state_out_postdec = None
-            for t in range(0,T):
-
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-
-                with torch.no_grad():
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
-                    R = torch.cat((V[:,:,t:t+1],F.dropout(Q, p=0.0, training=False)), dim=1)
-                    y, state_out_postdec = self.postdec(R,c_t, state_out_postdec)
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
-                    in_t = y
-
-            elapsed_time = time.time() - start
-            A_concat = np.eye(N).reshape(1,N,N)
-            A_concat = torch.tensor(A_concat).to(device, dtype=torch.float)
-            path = [np.arange(N), np.arange(N)]
-
-        elif attention_mode == 'forward':
-            # Forward attention
-            T = round(N*2.0)
-            n_argmax = 0
-            y_samples = np.array([0])
-            x_samples = np.array([0])
-            in_t = x_t
-
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
-
-            state_out_predec = None
-            state_out_postdec = None
-            for t in range(0,T):
-
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-
-                with torch.no_grad():
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
-                    # Scaled dot-product attention
-                    A = F.softmax(torch.matmul(K.permute(0,2,1), Q)/np.sqrt(d), dim=1)
-
-                    A_np = A.detach().cpu().clone().numpy()
-                    # Prediction of attended time point
-                    if t==0:
-                        n_argmax_tmp = self.localpeak(A_np,n_argmax,5.0)[0]
-                        if n_argmax_tmp > n_argmax:
-                            n_argmax = n_argmax_tmp
+            with torch.no_grad():
+
+                if decoder_step is not None:
+
+                    y, A, *decoder_states = decoder_step(in_t, K, V, key_mask, steps[t], *targets, *decoder_states)
+
+                else:
+
+                    Q = self.predec.step(in_t, c_t, state_predec)
+
+                    if attention_mode == 'diagonal':
+                        R = V[:,:,t:t+1]
+                    elif attention_mode == 'local':
+                        # Written straight into the attention history
+                        A = A_buffer[:,:,t:t+1]
+                        R = local_attention(K, V, Q, key_mask, A)
                     else:
-                        n_argmax_tmp = self.localpeak(A_np,n_argmax,5.0)[0]
-                        y_samples = np.append(y_samples,n_argmax_tmp)
-                        x_samples = np.append(x_samples,t)
-                        slope = (np.mean((y_samples-np.mean(y_samples))*(x_samples-np.mean(x_samples)))
-                                 /(max(np.std(x_samples),1e-10)**2))
-                        n_argmax = int(round(slope*(t+1)))
-
-                    A_np[0,0:max(n_argmax-20//rf,0),0] = 0
-                    A_np[0,min(n_argmax+40//rf,N-1):,0] = 0
-                    A_np = (np.maximum(A_np,1e-10))/np.sum(np.maximum(A_np,1e-10))
-                    A_ = torch.tensor(A_np).to(device, dtype=torch.float)
-                    A_concat = A_ if t == 0 else torch.cat((A_concat, A_), dim=2)
-                    R = torch.matmul(V,A_)
+                        # Scaled dot-product attention over the valid frames of every segment
+                        A = md.attention_weights(K, Q, key_mask)
+
+                        if attention_mode == 'forward':
+                            A = forward_attention(A, t)
+
+                        R = torch.matmul(V,A)
+
                     R = torch.cat((R,F.dropout(Q, p=0.0, training=False)), dim=1)
-                    y, state_out_postdec = self.postdec(R,c_t,state_out_postdec)
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
 
-                    in_t = y
+                    y = self.postdec.step(R, c_t, state_postdec)
 
-            elapsed_time = time.time() - start
-            A_tmp = A_concat[0,:,:].detach().cpu().clone().numpy()**0.3
-            #import pdb;pdb.set_trace() # Breakpoint
-            path = self.mydtw_fromDistMat(1.0-A_tmp,w=100,p=0.1)
-            end_of_frame = path[1][-1]
-            #end_of_frame = T
-            
-        A_out = A_concat[:,:,0:end_of_frame].clone()
-        A_out = A_out.detach().cpu().clone().numpy()
+                if attention_mode != 'diagonal':
+                    if attention_mode != 'local':
+                        A_buffer[:,:,t:t+1] = A
+
+                    if end_detector is not None:
+                        end_detector.update(A, t)
+                        ended = end_detector.all_finished(t)
+
+                y_buffer[:,:,t:t+1] = y
+
+                in_t = y
+
+            if ended:
+                break
+
+        elapsed_time = time.time() - start
 
-        melspec_conv = self.expand(y_concat[:,0:D,0:end_of_frame],rf).detach().cpu().clone().numpy()
-        melspec_conv = melspec_conv[0,:,:]
+        melspec_conv_list = list()
+        A_out_list = None if lean else list()
 
-        return melspec_conv, A_out, elapsed_time
+        if end_detector is not None:
+            detected_end = end_detector.end_of_frame.tolist()
+        else:
+            detected_end = [-1]*BatchSize
+
+        for b in range(BatchSize):
+
+            if attention_mode == 'diagonal':
+                end_of_frame = T_b[b]
+            elif detected_end[b] >= 0:
+                end_of_frame = detected_end[b]
+            else:
+                end_of_frame = self.alignment_end(A_buffer[b,0:N_b[b],0:T_b[b]])
+                #end_of_frame = min(path[1][-1]+20, T)
+                #end_of_frame = T
+
+                # A path that reaches the last source frame on the first target frame means the attention
+                # never followed the source, e.g. a local window that lost the alignment. The whole decode
+                # is kept instead of an empty segment.
+                if end_of_frame == 0:
+                    end_of_frame = T_b[b]
+
+            if not lean:
+                if attention_mode == 'diagonal':
+                    A_out = np.eye(N_b[b]).reshape(1,N_b[b],N_b[b])
+                else:
+                    A_out = A_buffer[b:b+1,0:N_b[b],0:end_of_frame].cpu().numpy()
+
+                A_out_list.append(A_out[:,:,0:end_of_frame])
+
+            melspec_conv = self.expand(y_buffer[b:b+1,0:D,0:end_of_frame],rf).cpu().numpy()
+            melspec_conv_list.append(melspec_conv[0,:,:])
+
+        return melspec_conv_list, A_out_list, elapsed_time
+
+
+    def encode(self, x_s, c_s, rf, pos_weight=1.0, lengths=None, encoder=None):
+
+        # Encoder keys and values of a zero-padded batch of source segments
+        # x_s.shape: batchsize x num_mels x N, lengths: number of valid frames of every segment
+        device = x_s.device
+
+        if lengths is None:
+            lengths = [x_s.shape[2]]*x_s.shape[0]
+
+        x_s = self.subsample(x_s, rf)
+        BatchSize,D,N = x_s.shape
+
+        # Number of valid subsampled frames of every segment
+        N_b = [int(np.ceil(length/rf)) for length in lengths]
+
+        src_mask = torch.arange(N, device=device).view(1,1,N) < torch.tensor(N_b, device=device).view(BatchSize,1,1)
+        # key_mask.shape: B x N x 1, True on padded source frames
+        key_mask = ~src_mask.permute(0,2,1)
+
+        in_s = x_s + self.consts.position_encoding(N, D, device) * (pos_weight/D**0.5)
+
+        self.enc.eval()
+
+        with torch.no_grad():
+            if encoder is not None:
+                K, V = encoder(in_s, src_mask.to(dtype=torch.float))
+            else:
+                K, V = self.enc(in_s, c_s, src_mask.to(dtype=torch.float))
+
+        return K, V, key_mask, N_b
+
+
+    def alignment_end(self, A):
+
+        # Last target frame of the DTW path through the attention matrix A (N_b x T_b) of one segment
+        A_np = A.cpu().numpy()**0.3
+        path = self.mydtw_fromDistMat(1.0-A_np,w=100,p=0.1)
+
+        return path[1][-1]
 
 
     def mydtw_fromDistMat(self, D0, w=np.inf, p=0.0):
 
-        r, c = D0.shape
-        AccDis = np.full(D0.shape, np.inf)
-        AccDis[0,0] = D0[0,0]
-        pointer = np.full(D0.shape, 0)
-        irange = range(1,min(r,1+w+1))
+        return dtw.banded_dtw(D0, w=w, p=p)
 
-        for i in irange:
-            AccDis[i,0] = AccDis[i-1,0] + p + D0[i,0]
-            pointer[i,0] = 1 #means "came from down"
 
-        jrange = range(1,min(c,1+w+1))
 
-        for j in jrange:
-            AccDis[0,j] = AccDis[0,j-1] + p + D0[0,j]
-            pointer[0,j] = 2 #means "came from left"
-        
+class DecoderStep(nn.Module):
 
-        for i in range(1,r):
-            jrange = range(max(1,i-w),min(c,i+w+1))
-            for j in jrange:
-                AccDis[i,j] = np.min([AccDis[i-1,j-1], AccDis[i-1,j]+p, AccDis[i,j-1]+p]) + D0[i,j]
-                pointer[i,j] = np.argmin([AccDis[i-1,j-1], AccDis[i-1,j]+p, AccDis[i,j-1]+p])
-                
-        if np.min(AccDis[:,c-1])<np.min(AccDis[r-1,:]):
-            r_end = np.argmin(AccDis[:,c-1])
-            c_end = c-1
+    # One raw-attention decode step (predecoder, attention, postdecoder) as a single graph
+    # with explicit conv states, so that it can be traced and saved with TorchScript
+    def __init__(self, model, c_t):
+        super(DecoderStep, self).__init__()
 
-        else:
-            r_end = r-1
-            c_end = np.argmin(AccDis[r-1,:])
+        self.predec = model.predec
+        self.postdec = model.postdec
+        self.c_t = c_t
 
-        #import pdb;pdb.set_trace() # Breakpoint
-            
-        # trace back
-        path_r, path_c = [r_end], [c_end]
-        i, j = r_end, c_end
-        while (i > 0) or (j > 0):
-            if pointer[i,j]==0:
-                i -= 1
-                j -= 1
-            elif pointer[i,j]==1:
-                i -= 1
-            else: #pointer[i,j]==2:
-                j -= 1
-            path_r.insert(0, i)
-            path_c.insert(0, j)
-
-        #import pdb;pdb.set_trace() # Breakpoint
-        return np.array(path_r), np.array(path_c)
+        self.specialized = model.specialized
+
+
+    def forward(self, in_t, K, V, key_mask, t, *states):
+
+        return self.decode(in_t, K, V, key_mask, t, self.c_t, states)
+
+
+    def decode(self, in_t, K, V, key_mask, t, c_t, states):
+
+        # t: LongTensor with the number of frames decoded so far for every batch item
+        num_predec_layers = len(self.predec.glu_blocks)
+
+        state_predec = list(states[:num_predec_layers])
+        state_postdec = list(states[num_predec_layers:])
+
+        if self.specialized:
+            state_predec = (state_predec, t)
+            state_postdec = (state_postdec, t)
+
+        Q, state_predec = self.predec(in_t, c_t, state_predec)
+
+        # Scaled dot-product attention over the valid frames of every segment
+        A = md.attention_weights(K, Q, key_mask)
+        R = torch.cat((torch.matmul(V,A), Q), dim=1)
+
+        y, state_postdec = self.postdec(R, c_t, state_postdec)
+
+        if self.specialized:
+            state_predec = state_predec[0]
+            state_postdec = state_postdec[0]
+
+        return (y, A, *state_predec, *state_postdec)
+
+
+
+class SourceEncoder(nn.Module):
+
+    # Encoder for a fixed source speaker that only takes the source frames and their mask,
+    # so that it can be exported as a standalone graph
+    def __init__(self, model, c_s):
+        super(SourceEncoder, self).__init__()
+
+        self.enc = model.enc
+        self.c_s = c_s
+
+
+    def forward(self, in_s, mask):
+
+        return self.enc(in_s, self.c_s, mask)
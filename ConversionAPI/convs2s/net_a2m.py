@@ -5,9 +5,9 @@ import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import time
 
-import module as md
+import convs2s.module as md
+from convs2s import net
 
 class EncoderAny(nn.Module):
 
@@ -40,7 +40,10 @@ class EncoderAny(nn.Module):
         self.dropout = nn.Dropout(p=dor)
         
 
-    def forward(self, x):
+    def forward(self, x, c=None, mask=None):
+
+        # c: unused, the encoder is speaker-independent
+        # mask: B x 1 x n_t, zero on the padded frames of a batch of segments
         
         out = self.dropout(x)
 
@@ -49,6 +52,10 @@ class EncoderAny(nn.Module):
 
         for i, layer in enumerate(self.glu_blocks):
 
+            # Padded frames are seen as zero padding, as for a single segment
+            if mask is not None:
+                out = out * mask
+
             # out: 512 -> 512
             out = layer(out)
 
@@ -61,7 +68,11 @@ class EncoderAny(nn.Module):
         return K, V
     
 
-class ConvS2SAny2Many(nn.Module):
+class ConvS2SAny2Many(net.ConvS2S):
+
+    # One model for every target speaker: the encoder is speaker-independent and
+    # the target speaker of every batch item is an input of the decode step
+    mixed_targets = True
 
     def __init__(self, enc: EncoderAny, predec, postdec):
         super(ConvS2SAny2Many, self).__init__(enc, predec, postdec)
@@ -171,161 +182,42 @@ class ConvS2SAny2Many(nn.Module):
         return MainLoss, DALoss, A_np
 
     
-    def inference(self, x_s, c_t, rf, pos_weight=1.0, attention_mode='raw'):
-        start = time.time()
-        
-        device = x_s.device
-        # x_s.shape: batchsize x num_mels x N
-        num_mels = x_s.shape[1]
+    def target_indices(self, c_t, batch, device):
 
-        x_s = self.subsample(x_s, rf)
-        BatchSize,D,N = x_s.shape
+        # c_t: one target index for the whole batch, or one per batch item
+        c_t = torch.as_tensor(c_t, device=device, dtype=torch.int64).view(-1)
 
-        pos_s = md.position_encoding(N, D)
-        pos_s = torch.tensor(pos_s).to(device, dtype=torch.float)
-        pos_s = pos_s.repeat(BatchSize,1,1)
-        scale_emb = D**0.5
+        return c_t.expand(batch) if c_t.numel() == 1 else c_t
 
-        in_s = x_s
-        in_s[:,0:pos_s.shape[1],:] = in_s[:,0:pos_s.shape[1],:] + pos_s/scale_emb * pos_weight
-        x_t = torch.tensor(np.zeros((1,D,1))).to(device, dtype=torch.float)
 
-        self.enc.eval()
-        self.predec.eval()
-        self.postdec.eval()
+    def inference(self, x_s, c_s, c_t, *args, **kwargs):
 
-        with torch.no_grad():
-            K, V = self.enc(in_s)
-        d = K.shape[1]
-        
-        if attention_mode == 'raw' or attention_mode == None:
-            # Raw attention
-            T = round(N*2.0)
-            in_t = x_t
-
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
-
-            state_out_predec = None
-            state_out_postdec = None
-
-            for t in range(0,T):
-
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-                
-                with torch.no_grad():
-
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
-
-                    # Scaled dot-product attention
-                    A = F.softmax(torch.matmul(K.permute(0,2,1), Q)/np.sqrt(d), dim=1)
-                    R = torch.matmul(V,A)
-                    R = torch.cat((R,F.dropout(Q, p=0.0, training=False)), dim=1)
-
-                    y, state_out_postdec = self.postdec(R,c_t, state_out_postdec)
-
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
-                    A_concat = A if t == 0 else torch.cat((A_concat,A), dim=2)
-
-                    in_t = y
-
-            elapsed_time = time.time() - start
-            A_np = A_concat[0,:,:].detach().cpu().clone().numpy()**0.3
-            path = self.mydtw_fromDistMat(1.0-A_np,w=100,p=0.1)
-
-            end_of_frame = path[1][-1]
-            #end_of_frame = min(path[1][-1]+20, T)
-            #end_of_frame = T
-                
-        elif attention_mode == 'diagonal':
-            # Exactly diagonal attention (no time-warping)
-            T = N
-            end_of_frame = T
-            in_t = x_t
-
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
-
-            state_out_predec = None
-            state_out_postdec = None
-            for t in range(0,T):
-
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-
-                with torch.no_grad():
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
-                    R = torch.cat((V[:,:,t:t+1],F.dropout(Q, p=0.0, training=False)), dim=1)
-                    y, state_out_postdec = self.postdec(R,c_t, state_out_postdec)
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
-                    in_t = y
-
-            elapsed_time = time.time() - start
-            A_concat = np.eye(N).reshape(1,N,N)
-            A_concat = torch.tensor(A_concat).to(device, dtype=torch.float)
-            path = [np.arange(N), np.arange(N)]
-
-        elif attention_mode == 'forward':
-            # Forward attention
-            T = round(N*2.0)
-            n_argmax = 0
-            y_samples = np.array([0])
-            x_samples = np.array([0])
-            in_t = x_t
-
-            pos_t = md.position_encoding(T, D)
-            pos_t = torch.tensor(pos_t).to(device, dtype=torch.float)
-            pos_t = pos_t.repeat(BatchSize,1,1)
-
-            state_out_predec = None
-            state_out_postdec = None
-            for t in range(0,T):
-
-                in_t[:,0:pos_t.shape[1],:] = in_t[:,0:pos_t.shape[1],:] + pos_t[:,:,t:t+1]/scale_emb * pos_weight
-
-                with torch.no_grad():
-                    Q, state_out_predec = self.predec(in_t, c_t, state_out_predec)
-                    # Scaled dot-product attention
-                    A = F.softmax(torch.matmul(K.permute(0,2,1), Q)/np.sqrt(d), dim=1)
-
-                    A_np = A.detach().cpu().clone().numpy()
-                    # Prediction of attended time point
-                    if t==0:
-                        n_argmax_tmp = self.localpeak(A_np,n_argmax,5.0)[0]
-                        if n_argmax_tmp > n_argmax:
-                            n_argmax = n_argmax_tmp
-                    else:
-                        n_argmax_tmp = self.localpeak(A_np,n_argmax,5.0)[0]
-                        y_samples = np.append(y_samples,n_argmax_tmp)
-                        x_samples = np.append(x_samples,t)
-                        slope = (np.mean((y_samples-np.mean(y_samples))*(x_samples-np.mean(x_samples)))
-                                 /(max(np.std(x_samples),1e-10)**2))
-                        n_argmax = int(round(slope*(t+1)))
-
-                    A_np[0,0:max(n_argmax-20//rf,0),0] = 0
-                    A_np[0,min(n_argmax+40//rf,N-1):,0] = 0
-                    A_np = (np.maximum(A_np,1e-10))/np.sum(np.maximum(A_np,1e-10))
-                    A_ = torch.tensor(A_np).to(device, dtype=torch.float)
-                    A_concat = A_ if t == 0 else torch.cat((A_concat, A_), dim=2)
-                    R = torch.matmul(V,A_)
-                    R = torch.cat((R,F.dropout(Q, p=0.0, training=False)), dim=1)
-                    y, state_out_postdec = self.postdec(R,c_t,state_out_postdec)
-                    y_concat = y if t == 0 else torch.cat((y_concat,y), dim=2)
-
-                    in_t = y
-
-            elapsed_time = time.time() - start
-            A_tmp = A_concat[0,:,:].detach().cpu().clone().numpy()**0.3
-            #import pdb;pdb.set_trace() # Breakpoint
-            path = self.mydtw_fromDistMat(1.0-A_tmp,w=100,p=0.1)
-            end_of_frame = path[1][-1]
-            #end_of_frame = T
-            
-        A_out = A_concat[:,:,0:end_of_frame].clone()
-        A_out = A_out.detach().cpu().clone().numpy()
-
-        melspec_conv = self.expand(y_concat[:,0:D,0:end_of_frame],rf).detach().cpu().clone().numpy()
-        melspec_conv = melspec_conv[0,:,:]
-
-        return melspec_conv, A_out, elapsed_time
+        # Same as ConvS2S.inference, c_s is unused and c_t may differ between batch items
+        return super(ConvS2SAny2Many, self).inference(
+            x_s, c_s, self.target_indices(c_t, x_s.shape[0], x_s.device), *args, **kwargs)
+
+
+    def decoder_step(self, c_t=None):
+
+        return DecoderStepAny2Many(self)
+
+
+    def decoder_step_inputs(self, num_mels, rf, device, batch=2, N=8):
+
+        # The per-item target speakers follow the frame counters
+        inputs = super(ConvS2SAny2Many, self).decoder_step_inputs(num_mels, rf, device, batch, N)
+
+        return inputs[0:5] + (torch.zeros((batch,), device=device, dtype=torch.int64),) + inputs[5:]
+
+
+
+class DecoderStepAny2Many(net.DecoderStep):
+
+    # DecoderStep that takes the target speaker of every batch item as an input
+    def __init__(self, model):
+        super(DecoderStepAny2Many, self).__init__(model, None)
+
+
+    def forward(self, in_t, K, V, key_mask, t, c_t, *states):
+
+        return self.decode(in_t, K, V, key_mask, t, c_t, states)
@@ -3,12 +3,15 @@ from service.preprocessor import AudioPreprocessor
 from service.mapper import SpectrogramConverter
 from service.vocoder import SpectrogramVocoder
 from service.enhancer import SpectrogramEnhancer
+from service.resampler import Resampler
+import multiprocessing
 import torch
 import json
 import os
 from typing import Dict
 
 compressor = AudioCompressor()
+resampler: Resampler = None
 preprocessor: AudioPreprocessor = None
 converters: Dict[str, SpectrogramConverter] = dict()
 vocoders: Dict[str, SpectrogramVocoder] = dict()
@@ -32,34 +35,108 @@ with open('./thesis_project_api/api_config.json') as conf:
     if __device.type == 'cuda':
         torch.cuda.device(__device)
 
-    preprocessor = AudioPreprocessor(
-        os.path.join(files_root, api_config["files"]["data_config"]),
-        __device)
-    
+    # Shared by the preprocessor and for resampling converted audio
+    resampler = Resampler(__device)
+
     mapper_files = api_config["conversion"]["mappers"]["files"]
     vocoder_files = api_config["conversion"]["vocoders"]["files"]
+    vocoder_targets = set(vocoder_json["trg_spk"] for vocoder_json in vocoder_files)
+
+
+def create_converter(mapper_json: Dict) -> SpectrogramConverter:
+
+    return SpectrogramConverter(
+        os.path.join(api_config["conversion"]["mappers"]["path"], mapper_json["name"]),
+        mapper_json["model"],
+        mapper_json["config"],
+        mapper_json["attention_mode"],
+        __device,
+        mapper_json["lean"],
+        mapper_json["end_detection"],
+        mapper_json["end_margin"],
+        mapper_json.get("trg_spk"),
+        mapper_json["specialize"],
+        mapper_json["compile"],
+        mapper_json["quantize"],
+        mapper_json["backend"],
+        mapper_json["attention_window"],
+        mapper_json["continuous_batching"],
+        mapper_json["max_batch"],
+        mapper_json["type"],
+        mapper_json["precision"],
+        mapper_json["workers"],
+        mapper_json["worker_threads"],
+        mapper_json["end_tail"],
+        mapper_json["end_threshold"],
+        mapper_json["end_patience"]
+    )
+
+
+def create_vocoder(vocoder_json: Dict) -> SpectrogramVocoder:
+
+    return SpectrogramVocoder(
+        os.path.join(api_config["conversion"]["vocoders"]["path"], vocoder_json["name"]),
+        vocoder_json["model"],
+        vocoder_json["config"],
+        __device,
+        vocoder_json["backend"],
+        vocoder_json["precision"],
+        vocoder_json["workers"],
+        vocoder_json["worker_threads"],
+        vocoder_json["max_batch_frames"],
+        vocoder_json["crossfade"],
+        vocoder_json["chunk_frames"],
+        vocoder_json["context_frames"],
+        vocoder_json["pad_value"]
+    )
+
+
+def create_enhancer(enhancer_json: Dict) -> SpectrogramEnhancer:
+
+    return SpectrogramEnhancer(
+        enhancer_json["path"], 
+        enhancer_json["file"], 
+        __device, 
+        enhancer_json["quantize"],
+        enhancer_json["backend"],
+        enhancer_json["precision"],
+        enhancer_json["workers"],
+        enhancer_json["worker_threads"],
+        enhancer_json["max_batch_frames"]
+    )
+
+
+def create_preprocessor(preprocessor_json: Dict) -> AudioPreprocessor:
+
+    return AudioPreprocessor(
+        os.path.join(files_root, api_config["files"]["data_config"]),
+        __device,
+        preprocessor_json["precision"],
+        resampler=resampler
+    )
+
+
+# Segment worker processes are spawned with their own copy of a stage and load only its model,
+# the models are loaded once in the serving process
+if multiprocessing.parent_process() is None:
+
+    preprocessor = create_preprocessor(api_config["conversion"]["preprocessor"])
 
     for mapper_json in mapper_files:
-        
-        converter = SpectrogramConverter(
-            os.path.join(api_config["conversion"]["mappers"]["path"], mapper_json["name"]),
-            mapper_json["model"],
-            mapper_json["config"],
-            mapper_json["attention_mode"],
-            __device
-        )
+
+        converter = create_converter(mapper_json)
 
         converter.load()
-        converters[mapper_json["trg_spk"]] = converter
-    
+
+        # An any-to-many mapper is shared by every target speaker it converts to that has a vocoder,
+        # the source speaker and speakers without one are not conversion targets
+        for trg_spk in converter.targets:
+            if trg_spk in vocoder_targets:
+                converters[trg_spk] = converter
+
     for vocoder_json in vocoder_files:
 
-        vocoder = SpectrogramVocoder(
-            os.path.join(api_config["conversion"]["vocoders"]["path"], vocoder_json["name"]),
-            vocoder_json["model"],
-            vocoder_json["config"],
-            __device
-        )  
+        vocoder = create_vocoder(vocoder_json)
 
         vocoder.load()
         vocoders[vocoder_json["trg_spk"]] = vocoder
@@ -67,12 +144,12 @@ with open('./thesis_project_api/api_config.json') as conf:
     enhancer_config = api_config["conversion"]["enhancer"]
 
     if enhancer_config != None:
-        enhancer = SpectrogramEnhancer(enhancer_config["path"], enhancer_config["file"], __device)
+        enhancer = create_enhancer(enhancer_config)
         enhancer.load()
 
 
 def unload_converter_models():
-    for _, map in converters.items():
+    for map in set(converters.values()):
         map.unload()
 
 
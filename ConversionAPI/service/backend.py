@@ -0,0 +1,156 @@
+from typing import Dict, List, Tuple
+import hashlib
+import numpy as np
+import torch
+import os
+
+# Inference backends a model can be served with, selected per model in api_config.json
+BACKENDS = ('torch', 'onnx')
+
+
+def check_backend(backend: str):
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}, expected one of {', '.join(BACKENDS)}.")
+
+
+def cached_file(model_file: str, cache_path: str, name: str, tag: str, extension: str, config_file: str | None = None) -> str:
+
+    # Compiled and exported graphs are keyed by the model weights, the model configuration they are built from,
+    # the options they were built with and the torch version, so a restarted worker loads them instead of building them again
+    key = hashlib.sha256()
+
+    for key_file in (model_file, config_file):
+        if key_file is not None:
+            with open(key_file, 'rb') as f:
+                key.update(f.read())
+
+    key.update(f"{tag}-{torch.__version__}".encode())
+
+    return os.path.join(cache_path, f"{name}-{key.hexdigest()[:16]}.{extension}")
+
+
+def export_graph(
+        module: torch.nn.Module,
+        example_inputs: Tuple[torch.Tensor, ...],
+        input_names: List[str],
+        output_names: List[str],
+        dynamic_axes: Dict[str, Dict[int, str]],
+        graph_file: str,
+        quantize: bool = False):
+
+    # ONNX export of an fp32 module. With quantize, the saved graph gets int8 weights from
+    # ONNX Runtime's dynamic quantization instead, which is the ONNX counterpart of the torch int8 layers.
+    os.makedirs(os.path.dirname(graph_file), exist_ok=True)
+
+    export_file = graph_file + '.fp32' if quantize else graph_file
+
+    # The exporter traces in eval mode and restores the training flags afterwards
+    with torch.no_grad():
+        torch.onnx.export(
+            module,
+            example_inputs,
+            export_file,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        quantize_dynamic(export_file, graph_file, weight_type=QuantType.QInt8)
+        os.remove(export_file)
+
+
+# Element types of the tensors bound to ONNX Runtime graphs
+TORCH_TYPES = {
+    'tensor(float)': torch.float,
+    'tensor(int64)': torch.int64,
+    'tensor(int32)': torch.int32,
+    'tensor(bool)': torch.bool
+}
+
+NUMPY_TYPES = {
+    torch.float: np.float32,
+    torch.int64: np.int64,
+    torch.int32: np.int32,
+    torch.bool: np.bool_
+}
+
+
+class OnnxGraph:
+
+    # ONNX Runtime session that is called like the module it was exported from,
+    # with torch tensors in and out on the device of the model
+    def __init__(self, graph_file: str, input_names: List[str], device):
+
+        # Only deployments that select the ONNX backend need onnxruntime
+        import onnxruntime as ort
+
+        self.__device = device
+        self.__input_names = input_names
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        if device.type == 'cuda':
+            providers = [('CUDAExecutionProvider', {'device_id': device.index or 0}), 'CPUExecutionProvider']
+        else:
+            providers = ['CPUExecutionProvider']
+
+        self.__session = ort.InferenceSession(graph_file, options, providers=providers)
+
+        # The exporter drops inputs the graph does not use, e.g. the frame counter of an unspecialized decoder
+        self.__graph_inputs = set(graph_input.name for graph_input in self.__session.get_inputs())
+
+        self.__outputs = [(graph_output.name, TORCH_TYPES[graph_output.type]) for graph_output in self.__session.get_outputs()]
+
+        # Output shapes per input shapes, known after the first run with those shapes
+        self.__output_shapes: Dict[Tuple, List[Tuple[int, ...]]] = dict()
+
+
+    def __call__(self, *inputs: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+
+        # Inputs and outputs are bound to the memory of torch tensors on the model device,
+        # so decoder states and encoder keys stay there between steps instead of going through host numpy arrays
+        binding = self.__session.io_binding()
+        device_type, device_id = self.__device.type, self.__device.index or 0
+
+        inputs = [
+            (name, x.detach().contiguous())
+            for name, x in zip(self.__input_names, inputs)
+            if name in self.__graph_inputs
+        ]
+
+        for name, x in inputs:
+            binding.bind_input(name, device_type, device_id, NUMPY_TYPES[x.dtype], tuple(x.shape), x.data_ptr())
+
+        signature = tuple(tuple(x.shape) for _, x in inputs)
+        output_shapes = self.__output_shapes.get(signature)
+
+        # The first run with new input shapes lets ONNX Runtime allocate the outputs
+        if output_shapes is None:
+            for name, _ in self.__outputs:
+                binding.bind_output(name, device_type, device_id)
+
+            self.__session.run_with_iobinding(binding)
+
+            outputs = binding.get_outputs()
+            self.__output_shapes[signature] = [tuple(output.shape()) for output in outputs]
+
+            return tuple(torch.from_numpy(output.numpy()).to(self.__device) for output in outputs)
+
+        # Fresh output tensors every run, the outputs of one step are bound as inputs of the next
+        outputs = [
+            torch.empty(shape, dtype=dtype, device=self.__device)
+            for (_, dtype), shape in zip(self.__outputs, output_shapes)
+        ]
+
+        for (name, _), y in zip(self.__outputs, outputs):
+            binding.bind_output(name, device_type, device_id, NUMPY_TYPES[y.dtype], tuple(y.shape), y.data_ptr())
+
+        self.__session.run_with_iobinding(binding)
+
+        return tuple(outputs)
@@ -0,0 +1,57 @@
+from typing import Iterable, Iterator, List
+import numpy as np
+
+
+def join_segments(segments: List[np.ndarray], crossfade: int) -> np.ndarray:
+
+    # The waveforms of consecutive segments as one, every join overlapping crossfade samples
+    return np.concatenate(
+        [np.zeros(0, dtype=np.float32)] + list(join_stream(([segment] for segment in segments), crossfade)),
+        dtype=np.float32)
+
+
+def join_stream(segments: Iterable[Iterable[np.ndarray]], crossfade: int) -> Iterator[np.ndarray]:
+
+    # Every join overlaps the last crossfade samples of a segment with the first of the next one,
+    # faded out and in at equal power, which avoids clicks where the waveforms do not line up.
+    # The last samples of every segment are held back until the start of the next one is synthesized.
+    tail = np.zeros(0, dtype=np.float32)
+
+    for chunks in segments:
+
+        rest = np.zeros(0, dtype=np.float32)
+        faded = False
+
+        for chunk in chunks:
+
+            rest = np.concatenate((rest, chunk))
+
+            if not faded:
+                if rest.shape[0] < tail.shape[0]:
+                    continue
+
+                yield _fade(tail, rest[0:tail.shape[0]])
+                rest, faded = rest[tail.shape[0]:], True
+
+            if rest.shape[0] > crossfade:
+                yield rest[0:rest.shape[0] - crossfade]
+                rest = rest[rest.shape[0] - crossfade:]
+
+        # A segment shorter than the tail of the previous one overlaps only the end of it
+        if not faded:
+            n = rest.shape[0]
+
+            yield tail[0:tail.shape[0] - n]
+            yield _fade(tail[tail.shape[0] - n:], rest)
+            rest = rest[n:]
+
+        tail = rest
+
+    yield tail
+
+
+def _fade(previous: np.ndarray, segment: np.ndarray) -> np.ndarray:
+
+    fade = (np.arange(segment.shape[0]) + 0.5)/max(segment.shape[0], 1)*np.pi/2
+
+    return previous*np.cos(fade) + segment*np.sin(fade)
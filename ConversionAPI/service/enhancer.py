@@ -2,7 +2,27 @@ import os
 from nemo.collections.tts.models import SpectrogramEnhancerModel
 import torch
 import numpy as np
+import copy
 from typing import List
+from .profiling import state_dict_bytes
+from .backend import check_backend, cached_file, export_graph, OnnxGraph
+from .precision import check_precision, autocast
+from .workers import SegmentPool
+from .silence import map_speech
+from .padding import length_batches, pad_segments
+
+
+class EnhancerGraph(torch.nn.Module):
+
+    # Keyword-only forward of the enhancer, with positional inputs for export
+    def __init__(self, enhancer_model):
+        super(EnhancerGraph, self).__init__()
+
+        self.enhancer_model = enhancer_model
+
+    def forward(self, spec, lengths):
+
+        return self.enhancer_model.forward(input_spectrograms=spec, lengths=lengths)
 
 
 class SpectrogramEnhancer:
@@ -11,7 +31,13 @@ class SpectrogramEnhancer:
             self,
             enhancer_path: str, 
             enhancer_model_file: str,
-            device):
+            device,
+            quantize: bool = False,
+            backend: str = 'torch',
+            precision: str = 'fp32',
+            workers: int = 0,
+            worker_threads: int = 0,
+            max_batch_frames: int = 0):
 
         self.__device = device
         self.__loaded = False
@@ -21,47 +47,148 @@ class SpectrogramEnhancer:
 
         self.__enhancer_model: SpectrogramEnhancerModel = None
 
+        # int8 weights for the linear layers; its modulated convolutions compute their weights per input (CPU only)
+        self.__quantize = quantize
+
+        if quantize and device.type != 'cpu':
+            raise ValueError("int8 quantized inference is only supported on CPU.")
+
+        # 'onnx' runs the enhancer as an ONNX Runtime graph, exported on first load
+        check_backend(backend)
+
+        self.__backend = backend
+        self.__enhancer_graph: OnnxGraph = None
+
+        # 'bf16' runs the enhancer under autocast, its output spectrogram is returned in fp32
+        check_precision(precision)
+
+        self.__precision = precision
+
+        if precision != 'fp32' and (quantize or backend == 'onnx'):
+            raise ValueError("bf16 inference runs the fp32 PyTorch network, it cannot be combined with quantization or the ONNX backend.")
+
+        # Segments of a request are split between worker processes holding the loaded model (CPU, PyTorch backend)
+        self.__workers = workers
+        self.__worker_threads = worker_threads
+        self.__pool: SegmentPool = None
+
+        if workers > 0 and (device.type != 'cpu' or backend != 'torch'):
+            raise ValueError("Segment worker processes are only supported for the PyTorch backend on CPU.")
+
+        # Segments are enhanced in padded batches of at most this many frames (0: all segments in one batch)
+        self.__max_batch_frames = max_batch_frames
+
     @property
     def loaded(self):
         return self.__loaded
 
+    @property
+    def footprint(self) -> int:
+        return state_dict_bytes(self.__enhancer_model)
+
     def load(self):
 
         if not self.__loaded:
 
+            # The workers are started before the model is loaded here, each loads it into an unloaded copy of the enhancer
+            if self.__workers > 0:
+                self.__pool = SegmentPool(self.__worker_copy(), 'enhance', self.__workers, self.__worker_threads)
+
             self.__enhancer_model: SpectrogramEnhancerModel = SpectrogramEnhancerModel.restore_from(
                 os.path.join(self.__enhancer_path, self.__enhancer_model_file)).to(self.__device)
+            if self.__backend == 'onnx':
+                self.__enhancer_graph = self.__load_graph()
+            if self.__quantize:
+                self.__enhancer_model = torch.ao.quantization.quantize_dynamic(
+                    self.__enhancer_model, {torch.nn.Linear}, dtype=torch.qint8)
+
             self.__loaded = True
 
+    def __worker_copy(self) -> 'SpectrogramEnhancer':
+
+        # Enhances the segments of a worker in-process, without workers of its own
+        enhancer = copy.copy(self)
+        enhancer.__workers = 0
+
+        return enhancer
+
     def unload(self):
 
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
         del self.__enhancer_model
+        self.__enhancer_graph = None
         self.__loaded = False
 
 
+    def __load_graph(self) -> OnnxGraph:
+
+        graph_file = cached_file(
+            os.path.join(self.__enhancer_path, self.__enhancer_model_file),
+            os.path.join(self.__enhancer_path, 'onnx'),
+            'enhancer',
+            f"{self.__quantize}",
+            'onnx')
+
+        if not os.path.exists(graph_file):
+            export_graph(
+                EnhancerGraph(self.__enhancer_model),
+                (torch.randn((1, self.__enhancer_model.cfg.n_bands, 64), device=self.__device), 
+                 torch.tensor([64], device=self.__device)),
+                ['spec', 'lengths'],
+                ['enhanced'],
+                {'spec': {0: 'batch', 2: 'frames'}, 'lengths': {0: 'batch'}, 'enhanced': {0: 'batch', 2: 'frames'}},
+                graph_file,
+                self.__quantize)
+
+        return OnnxGraph(graph_file, ['spec', 'lengths'], self.__device)
+
+
     def enhance(self, conv_melspec_list: List[np.ndarray]) -> List[np.ndarray]:
 
         if self.__loaded:
-            segment_list: List[np.ndarray] = list()
 
-            for melspec in conv_melspec_list:
-                
-                enhanced_segment = self.__enhance_segment(melspec)
-                segment_list.append(enhanced_segment)
+            # Silent segments bypass the enhancer
+            if self.__pool is not None:
+                return map_speech(conv_melspec_list, self.__pool.map)
 
-            return segment_list
+            return map_speech(conv_melspec_list, self.__enhance_segments)
 
         raise RuntimeError("Enhancer model currently not loaded.")
 
 
+    def __enhance_segments(self, conv_melspec_list: List[np.ndarray]) -> List[np.ndarray]:
+
+        # One forward per padded batch of similar-length segments, the enhancer masks every item by its length
+        lengths = [melspec.shape[-1] for melspec in conv_melspec_list]
+        segment_list: List[np.ndarray] = [None]*len(conv_melspec_list)
+
+        for batch in length_batches(lengths, self.__max_batch_frames):
+
+            enhanced_batch = self.__enhance_batch([conv_melspec_list[i] for i in batch], [lengths[i] for i in batch])
+
+            for i, enhanced_melspec in zip(batch, enhanced_batch):
+                segment_list[i] = enhanced_melspec[:, 0:lengths[i]]
+
+        return segment_list
+
+
     @torch.no_grad()
-    def __enhance_segment(self, conv_melspec) -> np.ndarray:
+    def __enhance_batch(self, conv_melspec_list: List[np.ndarray], lengths: List[int]) -> np.ndarray:
+
+        conv_melspec = pad_segments(conv_melspec_list, self.__device)
+
+        lengths = torch.tensor(lengths, device=self.__device)
 
-        conv_melspec = torch.tensor(np.reshape(conv_melspec, (1,) + conv_melspec.shape), dtype=torch.float).to(self.__device)
+        if self.__enhancer_graph is not None:
+            return self.__enhancer_graph(conv_melspec, lengths)[0].cpu().numpy()
 
-        enhanced_melspec = self.__enhancer_model.forward(
-                                input_spectrograms=conv_melspec, 
-                                lengths=torch.tensor([conv_melspec.shape[2]]).to(self.__device)
-                            ).cpu().numpy()
+        with autocast(self.__precision, self.__device):
+            enhanced_melspec = self.__enhancer_model.forward(
+                                    input_spectrograms=conv_melspec, 
+                                    lengths=lengths
+                                )
 
-        return enhanced_melspec[0]
\ No newline at end of file
+        return enhanced_melspec.float().cpu().numpy()
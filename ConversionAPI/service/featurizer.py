@@ -1,5 +1,5 @@
 import torch
-import torch
+from typing import List
 from nemo.collections.asr.parts.preprocessing.features import FilterbankFeatures
 from torch import nn
 from sklearn.preprocessing import StandardScaler
@@ -69,14 +69,20 @@ class NormalizableFilterbankFeatures(FilterbankFeatures):
         )
         
         if (normalize != None and normalize == "by_statistics"):
-            self._features_scaler = StandardScaler()
 
             if os.path.exists(statistics_filepath):
                 with open(statistics_filepath, mode='rb') as f:
-                    self._features_scaler = pickle.load(f)
+                    features_scaler: StandardScaler = pickle.load(f)
             else:
                 raise Exception("Statistics file not found.")
 
+            # Per-feature mean and scale of the fitted scaler, as buffers that follow the featurizer to its device
+            mean = features_scaler.mean_ if features_scaler.with_mean else 0.0
+            scale = features_scaler.scale_ if features_scaler.with_std else 1.0
+
+            self.register_buffer("features_mean", torch.tensor(mean, dtype=torch.float).view(1, -1, 1))
+            self.register_buffer("features_scale", torch.tensor(scale, dtype=torch.float).view(1, -1, 1))
+
 
     @staticmethod
     def splice_frames(x, frame_splicing):
@@ -93,15 +99,16 @@ class NormalizableFilterbankFeatures(FilterbankFeatures):
 
 
     def _normalize_features(self, x: torch.Tensor, seq_len: torch.Tensor):
+
+        valid = torch.arange(x.shape[-1], device=x.device).view(1, 1, -1) < seq_len.to(x.device).view(-1, 1, 1)
         
         if self.normalize == "per_melspec":
 
-            x_mean = torch.zeros(seq_len.shape, dtype=x.dtype, device=x.device)
-            x_std = torch.zeros(seq_len.shape, dtype=x.dtype, device=x.device) 
+            # Mean and (unbiased) std of every item over its valid frames, in one masked pass over the batch
+            count = seq_len.to(device=x.device, dtype=x.dtype) * x.shape[1]
 
-            for i in range(x.shape[0]):
-                x_mean[i] = x[i, :, : seq_len.int().numpy()[i]].mean()
-                x_std[i] = x[i, :, : seq_len.int().numpy()[i]].std()
+            x_mean = torch.where(valid, x, 0.0).sum(dim=(1, 2)) / count
+            x_std = torch.sqrt(torch.where(valid, x - x_mean.view(-1, 1, 1), 0.0).pow(2).sum(dim=(1, 2)) / (count - 1))
 
             # make sure x_std is not zero
             x_std += CONSTANT
@@ -109,18 +116,31 @@ class NormalizableFilterbankFeatures(FilterbankFeatures):
         
         elif self.normalize == "by_statistics":
 
-            x = x.numpy()
-
-            for i in range(x.shape[0]):
-                x[i, :, :seq_len.int().numpy()[i]] = self._features_scaler.transform(x[i, :, :seq_len.int().numpy()[i]].T).T
-            
-            return torch.tensor(x)
+            # StandardScaler.transform of the valid frames of every item, in one masked operation over the batch
+            return torch.where(valid, (x - self.features_mean.to(x.dtype)) / self.features_scale.to(x.dtype), x)
         
         else:
             raise ValueError("Invalid normalization technique")
 
 
 
+    def featurize(self, waveforms: List[torch.Tensor]) -> List[torch.Tensor]:
+
+        # Features of several waveforms computed as one zero-padded batch. Frames within seq_len only see
+        # their own waveform, every item keeps as many frames as it gets on its own, past seq_len pad_value.
+        lengths = torch.tensor([waveform.shape[0] for waveform in waveforms], device=self.fb.device)
+        batch = nn.utils.rnn.pad_sequence(waveforms, batch_first=True)
+
+        x, seq_len = self.forward(batch, lengths)
+
+        # The STFT frames of a centered transform also cover the padding around each waveform
+        uncentered = (batch.shape[1] - self.n_fft) // self.hop_length + 1
+        padding = 0 if x.shape[-1] == uncentered else self.n_fft
+        frames = ((lengths + padding - self.n_fft) // self.hop_length + 1).tolist()
+
+        return [x[b, :, 0:frames[b]] for b in range(len(waveforms))]
+
+
     def forward(self, x, seq_len, linear_spec=False):
 
         seq_len = torch.floor((seq_len - self.n_fft) / self.hop_length) + 1
@@ -135,8 +155,8 @@ class NormalizableFilterbankFeatures(FilterbankFeatures):
         # torch stft returns complex tensor (of shape [B,N,T]); so convert to magnitude
         # guard is needed for sqrt if grads are passed through
         guard = 0 if not self.use_grads else CONSTANT
-        x = torch.view_as_real(x)
-        x = torch.sqrt(x.pow(2).sum(-1) + guard)
+        # elementwise, a reduction over the real/imaginary pair of a strided batch is much slower
+        x = torch.sqrt(x.real.pow(2) + x.imag.pow(2) + guard)
 
         if self.training and self.nb_augmentation_prob > 0.0:
             for idx in range(x.shape[0]):
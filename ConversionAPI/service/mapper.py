@@ -1,9 +1,20 @@
 from typing import List
 import numpy as np
+import copy
+import functools
 import json
 import torch
 import os
 from convs2s import net 
+from convs2s import net_a2m
+from convs2s.batching import DecodeBatch
+from .profiling import state_dict_bytes
+from .backend import check_backend, cached_file, export_graph, OnnxGraph
+from .scheduler import DecodeScheduler
+from .precision import check_precision, autocast
+from .workers import SegmentPool
+from .silence import map_speech
+from .padding import pad_segments
 
 class SpectrogramConverter:
 
@@ -13,15 +24,116 @@ class SpectrogramConverter:
             mapper_model_file: str, 
             mapper_config_file: str, 
             attention_mode: str,
-            device):
+            device,
+            lean: bool = True,
+            end_detection: str = 'dtw',
+            end_margin: int = 3,
+            target: str | None = None,
+            specialize: bool = False,
+            compile_step: bool = False,
+            quantize: bool = False,
+            backend: str = 'torch',
+            attention_window: int = 32,
+            continuous_batching: bool = False,
+            max_batch: int = 16,
+            model_type: str = 'convs2s',
+            precision: str = 'fp32',
+            workers: int = 0,
+            worker_threads: int = 0,
+            end_tail: int = 2,
+            end_threshold: float = 0.5,
+            end_patience: int = 3):
 
         self.__device = device
         self.__loaded: bool = False
 
         self.__mapper_path = mapper_path
         self.__mapper_model_file = mapper_model_file
+        self.__mapper_config_file = mapper_config_file
         self.__attention_mode = attention_mode
 
+        # Width of the source window of every decode step in 'local' attention mode
+        self.__attention_window = attention_window
+
+        # Lean inference does not build or return the attention matrices beyond what the DTW trim needs
+        self.__lean = lean
+
+        # 'online' stops decoding once the attention settles on the end of the source, 'dtw' trims afterwards
+        self.__end_detection = end_detection
+        self.__end_margin = end_margin
+
+        # The attention has settled once end_threshold of it is on the last end_tail source frames for end_patience steps
+        self.__end_tail = end_tail
+        self.__end_threshold = end_threshold
+        self.__end_patience = end_patience
+
+        # 'convs2s' maps to the target speaker it was trained for, 'any2many' is one model for every
+        # target speaker of its configuration, with the target an input of every batch item
+        if model_type not in ('convs2s', 'any2many'):
+            raise ValueError(f"Unknown mapper type {model_type}, expected convs2s or any2many.")
+
+        self.__any2many = model_type == 'any2many'
+
+        if self.__any2many and specialize:
+            raise ValueError("The any-to-many mapper cannot be specialized for a single target speaker.")
+
+        # Target speaker the mapper serves, needed to specialize the network or compile its decode step
+        self.__target = target
+
+        # Specialized network: weight norm removed, speaker embeddings folded into the convolutions
+        self.__specialize = specialize
+
+        # TorchScript decode step, cached on disk next to the mapper model
+        self.__compile_step = compile_step
+        self.__decoder_step = None
+
+        # int8 weights for every conv layer (CPU only)
+        self.__quantize = quantize
+
+        if quantize and device.type != 'cpu':
+            raise ValueError("int8 quantized inference is only supported on CPU.")
+
+        # 'onnx' runs the encoder and the raw-attention decode step as ONNX Runtime graphs,
+        # exported on first load and cached next to the mapper model. They replace the compiled decode step.
+        check_backend(backend)
+
+        self.__backend = backend
+        self.__encoder = None
+
+        # Segments of concurrent requests share one live decode batch, joining and leaving it at any step
+        self.__continuous_batching = continuous_batching
+        self.__max_batch = max_batch
+        self.__scheduler: DecodeScheduler = None
+
+        # 'bf16' runs the network under autocast, attention softmax and end detection stay in fp32
+        check_precision(precision)
+
+        self.__precision = precision
+
+        if precision != 'fp32' and (quantize or backend == 'onnx'):
+            raise ValueError("bf16 inference runs the fp32 PyTorch network, it cannot be combined with quantization or the ONNX backend.")
+
+        if continuous_batching and attention_mode != 'raw':
+            raise ValueError("Continuous batching requires raw attention.")
+
+        # Segments of a request are split between worker processes holding the loaded model (CPU, PyTorch backend)
+        self.__workers = workers
+        self.__worker_threads = worker_threads
+        self.__pool: SegmentPool = None
+
+        if workers > 0 and (device.type != 'cpu' or backend != 'torch'):
+            raise ValueError("Segment worker processes are only supported for the PyTorch backend on CPU.")
+
+        if workers > 0 and continuous_batching:
+            raise ValueError("Continuous batching already shares the decode batch between requests, it does not use segment workers.")
+
+        # The specialized network, the compiled or exported decode step and the live decode batch
+        # are built for the target speaker, unless the target is an input of the model
+        self.__fixed_target = not self.__any2many and (specialize or compile_step or backend == 'onnx' or continuous_batching)
+
+        if self.__fixed_target and target is None:
+            raise ValueError("A target speaker is required to specialize, compile, export or continuously batch the mapper.")
+
         with open(os.path.join(mapper_path, mapper_config_file)) as f:
             self.__model_config = json.load(f)
 
@@ -34,62 +146,285 @@ class SpectrogramConverter:
         num_layers = self.__model_config['num_layers']
         reduction_factor = self.__model_config['reduction_factor']
 
-        enc = net.Encoder1(num_mels*reduction_factor,n_spk,hdim,zdim,kdim,num_layers)
         predec = net.PreDecoder1(num_mels*reduction_factor,n_spk,hdim,zdim,kdim,num_layers)
         postdec = net.PostDecoder1(zdim*2,n_spk,hdim,num_mels*reduction_factor,mdim,num_layers)
-        self.__mapper_model = net.ConvS2S(enc, predec, postdec)
+
+        if self.__any2many:
+            enc = net_a2m.EncoderAny(num_mels*reduction_factor,zdim,kdim,num_layers)
+            self.__mapper_model = net_a2m.ConvS2SAny2Many(enc, predec, postdec)
+        else:
+            enc = net.Encoder1(num_mels*reduction_factor,n_spk,hdim,zdim,kdim,num_layers)
+            self.__mapper_model = net.ConvS2S(enc, predec, postdec)
 
 
     @property
     def loaded(self):
         return self.__loaded
 
+    @property
+    def targets(self) -> List[str]:
+
+        # Target speakers the mapper converts to
+        if self.__any2many:
+            return list(self.__model_config['spk_list'])
+
+        return [self.__target]
+
+    @property
+    def footprint(self) -> int:
+        return state_dict_bytes(self.__mapper_model)
+
     def load(self):
 
         if not self.__loaded:
 
+            # The workers are started before the model is loaded here, each loads it into an unloaded copy of the converter
+            if self.__workers > 0:
+                self.__pool = SegmentPool(self.__worker_copy(), 'convert', self.__workers, self.__worker_threads)
+
             state_dict = torch.load(os.path.join(self.__mapper_path, self.__mapper_model_file), map_location=self.__device)
             self.__mapper_model.load_state_dict(state_dict['model_state_dict'])
             self.__mapper_model.to(self.__device).eval()
 
+            if self.__specialize:
+                self.__mapper_model.specialize(
+                    self.__source_index(), 
+                    self.__target_index())
+
+            if self.__backend == 'onnx':
+                self.__encoder, self.__decoder_step = self.__load_graphs()
+
+            if self.__quantize:
+                self.__mapper_model.quantize()
+
+            if self.__compile_step and self.__backend == 'torch':
+                self.__decoder_step = self.__load_decoder_step()
+
+            if self.__continuous_batching:
+                self.__scheduler = self.__create_scheduler()
+
             self.__loaded = True
 
+    def __worker_copy(self) -> 'SpectrogramConverter':
+
+        # Converts the segments of a worker in-process, without workers of its own
+        converter = copy.copy(self)
+        converter.__workers = 0
+
+        return converter
+
     def unload(self):
 
+        if self.__scheduler is not None:
+            self.__scheduler.stop()
+            self.__scheduler = None
+
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
         del self.__mapper_model
+        self.__decoder_step = None
+        self.__encoder = None
         self.__loaded = False
 
+
+    def __load_decoder_step(self):
+
+        step_file = cached_file(
+            os.path.join(self.__mapper_path, self.__mapper_model_file),
+            os.path.join(self.__mapper_path, 'compiled'),
+            'decoder_step',
+            f"{self.__target}-{self.__model_config['reduction_factor']}-{self.__specialize}-{self.__quantize}",
+            'pt',
+            os.path.join(self.__mapper_path, self.__mapper_config_file))
+
+        if os.path.exists(step_file):
+            return torch.jit.load(step_file, map_location=self.__device)
+
+        decoder_step = self.__mapper_model.compile_decoder_step(
+            self.__target_index(), 
+            self.__model_config['num_mels'], 
+            self.__model_config['reduction_factor'], 
+            self.__device)
+
+        os.makedirs(os.path.dirname(step_file), exist_ok=True)
+        torch.jit.save(decoder_step, step_file)
+
+        return decoder_step
+
+
+    def __create_scheduler(self) -> DecodeScheduler:
+
+        decoder_step = self.__decoder_step
+
+        if decoder_step is None:
+            decoder_step = self.__mapper_model.decoder_step(self.__target_index())
+
+        # The scheduler creates its live batch and the batch it retries failed segments in
+        create_batch = functools.partial(
+            DecodeBatch,
+            self.__mapper_model,
+            decoder_step,
+            self.__model_config['num_mels'],
+            self.__model_config['reduction_factor'],
+            self.__device,
+            self.__model_config['pos_weight'],
+            self.__end_detection,
+            self.__end_margin,
+            self.__end_tail,
+            self.__end_threshold,
+            self.__end_patience)
+
+        return DecodeScheduler(
+            create_batch, 
+            self.__encode, 
+            self.__max_batch, 
+            lambda: autocast(self.__precision, self.__device))
+
+
+    def __encode(self, melspec_list: List[np.ndarray]):
+
+        lengths = [melspec.shape[2] for melspec in melspec_list]
+        melspec_batch = pad_segments(melspec_list, self.__device)
+
+        return self.__mapper_model.encode(
+            melspec_batch,
+            self.__source_index(),
+            self.__model_config['reduction_factor'],
+            self.__model_config['pos_weight'],
+            lengths,
+            self.__encoder)
+
+
+    def __load_graphs(self):
+
+        # Exported from the fp32 network, before any torch quantization
+        num_mels = self.__model_config['num_mels']
+        reduction_factor = self.__model_config['reduction_factor']
+
+        encoder_inputs = ['in_s', 'mask']
+        state_inputs = [f'state_{i}' for i in range(self.__num_decoder_layers())]
+        step_inputs = ['in_t', 'K', 'V', 'key_mask', 't'] + (['c_t'] if self.__any2many else []) + state_inputs
+
+        graph_files = [
+            cached_file(
+                os.path.join(self.__mapper_path, self.__mapper_model_file),
+                os.path.join(self.__mapper_path, 'onnx'),
+                name,
+                f"{self.__target}-{reduction_factor}-{self.__specialize}-{self.__quantize}",
+                'onnx',
+                os.path.join(self.__mapper_path, self.__mapper_config_file))
+            for name in ('encoder', 'decoder_step')]
+
+        encoder_file, step_file = graph_files
+
+        if not os.path.exists(encoder_file):
+            export_graph(
+                net.SourceEncoder(self.__mapper_model, self.__source_index()),
+                self.__mapper_model.encoder_inputs(num_mels, reduction_factor, self.__device),
+                encoder_inputs,
+                ['K', 'V'],
+                {'in_s': {0: 'batch', 2: 'N'}, 'mask': {0: 'batch', 2: 'N'}, 'K': {0: 'batch', 2: 'N'}, 'V': {0: 'batch', 2: 'N'}},
+                encoder_file,
+                self.__quantize)
+
+        if not os.path.exists(step_file):
+            state_outputs = [f'state_out_{i}' for i in range(self.__num_decoder_layers())]
+
+            dynamic_axes = {'in_t': {0: 'batch'}, 'K': {0: 'batch', 2: 'N'}, 'V': {0: 'batch', 2: 'N'},
+                            'key_mask': {0: 'batch', 1: 'N'}, 't': {0: 'batch'}, 'y': {0: 'batch'}, 'A': {0: 'batch', 1: 'N'}}
+            dynamic_axes.update({name: {0: 'batch'} for name in step_inputs[5:] + state_outputs})
+
+            export_graph(
+                self.__mapper_model.decoder_step(self.__target_index()),
+                self.__mapper_model.decoder_step_inputs(num_mels, reduction_factor, self.__device),
+                step_inputs,
+                ['y', 'A'] + state_outputs,
+                dynamic_axes,
+                step_file,
+                self.__quantize)
+
+        return OnnxGraph(encoder_file, encoder_inputs, self.__device), OnnxGraph(step_file, step_inputs, self.__device)
+
+
+    def __num_decoder_layers(self) -> int:
+
+        return len(self.__mapper_model.predec.glu_blocks) + len(self.__mapper_model.postdec.glu_blocks)
+
     
         
     def convert(self, melspec_list: List[np.ndarray], target: str) -> List[np.ndarray]:
         
         if self.__loaded:
-            converted_melspec_list: List[np.ndarray] = list()
-            
-            for melspec in melspec_list:
 
-                converted_melspec = self.__convert_melspec(self.__attention_mode, melspec, target)
-                converted_melspec_list.append(converted_melspec)
-
-            return converted_melspec_list
+            # Silent segments bypass the mapper
+            return map_speech(melspec_list, lambda speech_list: self.__convert_speech(speech_list, target))
 
         raise RuntimeError("Mapper model currently not loaded.")
 
 
-    def __convert_melspec(self, attention_mode, melspec: np.ndarray, target) -> np.ndarray:
+    def __convert_speech(self, melspec_list: List[np.ndarray], target: str) -> List[np.ndarray]:
+
+        if self.__scheduler is not None:
+            if self.__fixed_target and target != self.__target:
+                raise RuntimeError(f"Mapper model is specialized for target speaker {self.__target}.")
+
+            return self.__scheduler.submit(melspec_list, self.__speaker_index(target))
+
+        if self.__pool is not None:
+            return self.__pool.map(melspec_list, target)
+
+        # All segments of the request are decoded together as one padded batch
+        return self.__convert_batch(self.__attention_mode, melspec_list, target)
+
+
+    def __convert_batch(self, attention_mode, melspec_list: List[np.ndarray], target) -> List[np.ndarray]:
         
-        source_index = list(self.__model_config['spk_list']).index("czr")
-        target_index = list(self.__model_config['spk_list']).index(target)
+        if self.__fixed_target and target != self.__target:
+            raise RuntimeError(f"Mapper model is specialized for target speaker {self.__target}.")
+
+        source_index = self.__source_index()
+        target_index = self.__speaker_index(target)
+
+        lengths = [melspec.shape[2] for melspec in melspec_list]
+        melspec_batch = pad_segments(melspec_list, self.__device)
 
-        with torch.no_grad():
-            conv_melspec, A, elapsed_time = self.__mapper_model.inference(
-                melspec,
+        with torch.no_grad(), autocast(self.__precision, self.__device):
+            conv_melspec_list, A, elapsed_time = self.__mapper_model.inference(
+                melspec_batch,
                 source_index, 
                 target_index, 
                 self.__model_config['reduction_factor'], 
                 self.__model_config['pos_weight'], 
-                attention_mode
+                attention_mode,
+                lengths,
+                self.__lean,
+                self.__end_detection,
+                self.__end_margin,
+                self.__decoder_step,
+                self.__encoder,
+                self.__attention_window,
+                self.__end_tail,
+                self.__end_threshold,
+                self.__end_patience
             )
         
-        return conv_melspec
+        return conv_melspec_list
+
+
+    def __speaker_index(self, speaker: str) -> int:
+
+        return list(self.__model_config['spk_list']).index(speaker)
+
+
+    def __source_index(self) -> int | None:
+
+        # The any-to-many encoder is speaker-independent
+        return None if self.__any2many else self.__speaker_index("czr")
+
+
+    def __target_index(self) -> int | None:
 
+        # The any-to-many decode step takes the target of every batch item as an input
+        return None if self.__any2many else self.__speaker_index(self.__target)
@@ -0,0 +1,37 @@
+from typing import List
+import numpy as np
+import torch
+
+
+def length_batches(lengths: List[int], max_batch_frames: int = 0) -> List[List[int]]:
+
+    # Indices of the segments grouped into batches of similar length, shortest first. A batch holds at most
+    # max_batch_frames frames once padded to its longest segment (0 for no limit), or a single longer segment.
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = list()
+
+    for i in order:
+
+        if len(batches) > 0 and (max_batch_frames <= 0 or (len(batches[-1]) + 1)*lengths[i] <= max_batch_frames):
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+
+    return batches
+
+
+def pad_segments(segments: List[np.ndarray], device, pad_value: float = 0.0) -> torch.Tensor:
+
+    # batch x n_mels x frames, every n_mels x frames (or 1 x n_mels x frames) segment padded at the end
+    # to the longest one with pad_value, the value of a frame without content in the domain of the model
+    batch = torch.full(
+        (len(segments), segments[0].shape[-2], max(segment.shape[-1] for segment in segments)),
+        pad_value,
+        dtype=torch.float,
+        device=device)
+
+    for i, segment in enumerate(segments):
+        segment = torch.as_tensor(segment, dtype=torch.float, device=device)
+        batch[i, :, 0:segment.shape[-1]] = segment.reshape(segment.shape[-2], segment.shape[-1])
+
+    return batch
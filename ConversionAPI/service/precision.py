@@ -0,0 +1,21 @@
+from contextlib import nullcontext
+import torch
+
+# Numeric precisions a pipeline stage can run in, selected per stage in api_config.json
+PRECISIONS = ('fp32', 'bf16')
+
+
+def check_precision(precision: str):
+
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision}, expected one of {', '.join(PRECISIONS)}.")
+
+
+def autocast(precision: str, device):
+
+    # bf16 runs the convolutions and matmuls of a stage in bfloat16, everything else stays in fp32.
+    # Autocast is thread-local, it has to be entered on the thread that runs the stage.
+    if precision == 'bf16':
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+
+    return nullcontext()
@@ -1,104 +1,140 @@
-from typing import List
+from typing import Dict, List
 import numpy as np
 import json
 import librosa
+import threading
 import torch
 from .featurizer import NormalizableFilterbankFeatures
+from .precision import check_precision, autocast
+from .segmentation import split_waveform, voice_activity, bucket_counts
+from .silence import SilentSegment
+from .resampler import Resampler
 
 class AudioPreprocessor:
 
-    def __init__(self, data_config_path: str, device):
+    def __init__(self, data_config_path: str, device, precision: str = 'fp32', batch_size: int = 32, resampler: Resampler = None):
 
         self.__device = device
+
+        # Brings every upload to the sample rate of the models in one pass, before segmentation
+        self.__resampler = resampler or Resampler(device)
+
+        # 'bf16' computes the filterbank features under autocast, the melspecs are returned in fp32
+        check_precision(precision)
+
+        self.__precision = precision
+
+        # Segments featurized together in one padded batch
+        self.__batch_size = batch_size
         
         with open(data_config_path) as f:
             self.__data_config = json.load(f)
 
         self.__featurizer = NormalizableFilterbankFeatures(
-                normalize='per_melspec',
-                statistics_filepath=None,
+                normalize=self.__data_config['norm_technique'],
+                statistics_filepath=self.__data_config['stat_path'],
                 n_window_size=self.__data_config['flen'], 
                 n_window_stride=self.__data_config['fshift'], 
                 lowfreq=self.__data_config['fmin'], 
                 highfreq=self.__data_config['fmax'], 
-                nfilt=self.__data_config['num_mels'])
-            
+                nfilt=self.__data_config['num_mels']).to(device).eval()
 
-    def preprocess_waveform(self, waveform: np.ndarray, sr: int = 32000) -> List[np.ndarray]:
+        # Segment lengths the planner cuts to, so the models see a few recurring shapes, and how often each was cut
+        self.__buckets = self.__data_config['segment_buckets']
+        self.__bucket_counts = bucket_counts([], self.__data_config['sr'], self.__buckets)
+        self.__bucket_lock = threading.Lock()
 
-        melspec_list: List[np.ndarray] = list()
 
-        split_waveform = AudioPreprocessor.__split_waveform(waveform, sr)
+    def preprocess_waveform(self, waveform: np.ndarray, sr: int = 32000) -> List[torch.Tensor | SilentSegment]:
 
-        for segment in split_waveform:
+        return self.preprocess_waveforms([waveform], sr)[0]
 
-            melspec = self.__preprocess_segment(segment, sr)
-            melspec_list.append(melspec)
 
-        return melspec_list
+    def preprocess_waveforms(self, waveform_list: List[np.ndarray], sr: int = 32000) -> List[List[torch.Tensor | SilentSegment]]:
 
+        # Melspecs of the segments of every waveform, the segments of all waveforms are featurized together
+        data_sr = self.__data_config['sr']
 
-    def __preprocess_segment(self, waveform: np.ndarray, sr: int) -> np.ndarray:
-        
-        return self.__extract_melspec(waveform, sr)
-        
-    
-    def __extract_melspec(self, waveform: np.ndarray, sr_: int):
+        segment_lists = [
+            split_waveform(
+                self.__resampler.resample(waveform, sr, data_sr), 
+                data_sr, 
+                self.__data_config['segment_min_length'], 
+                self.__data_config['segment_max_length'], 
+                self.__data_config['segment_frame_length'],
+                self.__buckets)
+            for waveform in waveform_list]
 
-        trim_silence = self.__data_config['trim_silence']
-        top_db = self.__data_config['top_db']
-        sr = self.__data_config['sr']
+        # Requests are preprocessed on concurrent threads
+        with self.__bucket_lock:
+            for segment_list in segment_lists:
+                for bucket, count in bucket_counts(segment_list, data_sr, self.__buckets).items():
+                    self.__bucket_counts[bucket] += count
 
-        if trim_silence:
-            waveform, _ = librosa.effects.trim(waveform, top_db=top_db, frame_length=2048, hop_length=512)
-        if sr != sr_:
-            waveform = librosa.resample(y=waveform, orig_sr=sr_, target_sr=sr)
-        
-        melspec, _ = self.__featurizer.forward(torch.tensor(waveform), torch.tensor([waveform.shape[0]]))
+        # Segments without speech are not featurized, they only keep their duration
+        speech_lists = [self.__voice_activity(segment_list, data_sr) for segment_list in segment_lists]
 
-        melspec = melspec.numpy()[0].astype(np.float32) # n_mels x n_frame
+        segments = [
+            self.__prepare_segment(segment) 
+            for segment_list, speech_list in zip(segment_lists, speech_lists)
+            for segment, speech in zip(segment_list, speech_list) if speech]
 
-        # plt.matshow(melspec)
-        # plt.show()
+        # Batches of segments of similar length, to pad as little as possible
+        order = sorted(range(len(segments)), key=lambda i: segments[i].shape[0])
+        melspecs: List[torch.Tensor] = [None]*len(segments)
 
-        b_melspec = np.reshape(melspec, (1,) + melspec.shape)
+        for start in range(0, len(order), self.__batch_size):
+            batch = order[start:start + self.__batch_size]
 
-        return torch.tensor(b_melspec).to(self.__device, dtype=torch.float)
+            for i, melspec in zip(batch, self.__extract_melspecs([segments[i] for i in batch])):
+                melspecs[i] = melspec
 
+        melspecs = iter(melspecs)
 
-    @staticmethod
-    def __split_waveform(waveform: np.ndarray, sr: int, max_length: float = 4.0) -> List[np.ndarray]:
-        
-        segments: List[np.ndarray] = list() 
-        samples = waveform.shape[0]
+        return [
+            [next(melspecs) if speech else SilentSegment(segment.shape[0]/data_sr) for segment, speech in zip(segment_list, speech_list)]
+            for segment_list, speech_list in zip(segment_lists, speech_lists)]
+
+
+    @property
+    def segment_buckets(self) -> Dict[str, int]:
+
+        # Segments cut so far per bucket length (in seconds), 'other' are the remainders at the end of a waveform
+        with self.__bucket_lock:
+            return dict(self.__bucket_counts)
 
-        index = 0
-        while index < samples:
 
-            limit = int(index + sr*max_length)
+    def __voice_activity(self, segments: List[np.ndarray], sr: int) -> List[bool]:
 
-            if limit > samples:
+        if not self.__data_config['vad']:
+            return [True]*len(segments)
 
-                segments.append(waveform[index:])
-                index = samples
+        return voice_activity(
+            segments, 
+            sr, 
+            self.__data_config['segment_frame_length'], 
+            self.__data_config['vad_threshold_db'], 
+            self.__data_config['vad_floor_db'], 
+            self.__data_config['vad_min_speech'])
 
-            else:
 
-                min_vol = 100000.0
-                min_vol_index = limit
+    def __prepare_segment(self, waveform: np.ndarray) -> torch.Tensor:
 
-                while limit > index + 2.0*sr:
+        trim_silence = self.__data_config['trim_silence']
+        top_db = self.__data_config['top_db']
+
+        if trim_silence:
+            waveform, _ = librosa.effects.trim(waveform, top_db=top_db, frame_length=2048, hop_length=512)
 
-                    if abs(waveform[limit]) < min_vol:
-                        min_vol = abs(waveform[limit])
-                        min_vol_index = limit
+        return torch.as_tensor(waveform, dtype=torch.float).to(self.__device)
 
-                    limit -= 1
 
-                segments.append(waveform[index:min_vol_index])
+    @torch.no_grad()
+    def __extract_melspecs(self, waveforms: List[torch.Tensor]) -> List[torch.Tensor]:
 
-                index = min_vol_index
+        # One padded STFT/filterbank batch on the model device, where the filterbank and window are kept
+        with autocast(self.__precision, self.__device):
+            melspecs = self.__featurizer.featurize(waveforms)
 
-        return segments
-            
-            
+        # 1 x n_mels x n_frame each
+        return [melspec.float().unsqueeze(0) for melspec in melspecs]
@@ -0,0 +1,54 @@
+from typing import Callable, List, Tuple
+import numpy as np
+import torch
+import time
+import io
+from .silence import is_silent
+
+
+def state_dict_bytes(model: torch.nn.Module) -> int:
+
+    # Size of the serialized weights, which also counts packed int8 weights
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+
+    return buffer.getbuffer().nbytes
+
+
+def timed(function: Callable, repeats: int = 1) -> Tuple[object, float]:
+
+    # Result of the last call and the mean wall time of a call, in seconds
+    start = time.perf_counter()
+
+    for _ in range(repeats):
+        result = function()
+
+    return result, (time.perf_counter() - start)/repeats
+
+
+def deviation(reference: List[np.ndarray], output: List[np.ndarray]) -> Tuple[float, float]:
+
+    # Max and mean absolute difference over the frames/samples both outputs have, silent segments are skipped
+    max_diff, sum_diff, count = 0.0, 0.0, 0
+
+    for ref, out in zip(reference, output):
+
+        if is_silent(ref) or is_silent(out):
+            continue
+
+        n = min(ref.shape[-1], out.shape[-1])
+        diff = np.abs(ref[..., 0:n] - out[..., 0:n])
+
+        max_diff = max(max_diff, float(diff.max()))
+        sum_diff += float(diff.sum())
+        count += diff.size
+
+    return max_diff, sum_diff/max(count, 1)
+
+
+def snr_db(reference: np.ndarray, output: np.ndarray) -> float:
+
+    n = min(reference.shape[-1], output.shape[-1])
+    noise = np.sum(np.square(reference[..., 0:n] - output[..., 0:n]))
+
+    return float(10.0*np.log10(np.sum(np.square(reference[..., 0:n]))/max(noise, 1e-20)))
@@ -0,0 +1,80 @@
+from typing import Dict, Tuple
+from math import gcd, ceil
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class Resampler:
+
+    # Polyphase windowed-sinc resampling of a whole waveform at once. The filter kernels of every
+    # (orig_sr, target_sr) pair are computed once and kept on the device.
+    def __init__(self, device, lowpass_filter_width: int = 6, rolloff: float = 0.99):
+
+        self.__device = device
+
+        # Zero crossings of the sinc on each side, and cutoff as a fraction of the lower Nyquist frequency
+        self.__lowpass_filter_width = lowpass_filter_width
+        self.__rolloff = rolloff
+
+        self.__kernels: Dict[Tuple[int, int], Tuple[torch.Tensor, int, int]] = dict()
+
+
+    @torch.no_grad()
+    def resample(self, waveform: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+
+        if orig_sr == target_sr:
+            return waveform
+
+        # kernel.shape: new x window, the filter of every output phase over a window of input samples
+        kernel, orig, width = self.__kernel(orig_sr, target_sr)
+        new, window = kernel.shape
+
+        samples = waveform.shape[0]
+        frames = samples//orig + 1
+
+        x = torch.as_tensor(waveform, dtype=torch.float, device=self.__device)
+        x = F.pad(x.view(1, -1), (width, width + orig))[0]
+
+        # Every frame of orig input samples gives new output samples, one per phase
+        if window <= 64:
+            # Short kernels (small rate ratios): one strided multiply-add per kernel tap
+            y = torch.zeros((new, frames), device=self.__device)
+
+            for k in range(window):
+                y.addcmul_(kernel[:, k:k+1], x[k:k + (frames - 1)*orig + 1:orig].unsqueeze(0))
+
+            y = y.t()
+        else:
+            y = torch.matmul(x.unfold(0, window, orig), kernel.t())
+
+        return y.reshape(-1)[0:ceil(new*samples/orig)].cpu().numpy()
+
+
+    def __kernel(self, orig_sr: int, target_sr: int) -> Tuple[torch.Tensor, int, int]:
+
+        if (orig_sr, target_sr) not in self.__kernels:
+            self.__kernels[(orig_sr, target_sr)] = self.__build_kernel(orig_sr, target_sr)
+
+        return self.__kernels[(orig_sr, target_sr)]
+
+
+    def __build_kernel(self, orig_sr: int, target_sr: int) -> Tuple[torch.Tensor, int, int]:
+
+        # Hann-windowed sinc of every phase, for the rates reduced by their gcd
+        g = gcd(orig_sr, target_sr)
+        orig, new = orig_sr//g, target_sr//g
+
+        base_freq = min(orig, new)*self.__rolloff
+        width = ceil(self.__lowpass_filter_width*orig/base_freq)
+
+        index = np.arange(-width, width + orig)/orig
+        t = (np.arange(0, -new, -1)[:, np.newaxis]/new + index[np.newaxis, :])*base_freq
+        t = np.clip(t, -self.__lowpass_filter_width, self.__lowpass_filter_width)
+
+        window = np.cos(t*np.pi/self.__lowpass_filter_width/2)**2
+
+        t = t*np.pi
+        kernel = np.where(t == 0.0, 1.0, np.sin(t)/np.where(t == 0.0, 1.0, t))*window*base_freq/orig
+
+        return torch.tensor(kernel, dtype=torch.float, device=self.__device), orig, width
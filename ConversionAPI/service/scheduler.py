@@ -0,0 +1,154 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from typing import Callable, Dict, List, Tuple
+from collections import deque
+from convs2s.batching import DecodeBatch
+import numpy as np
+import threading
+import torch
+
+
+class DecodeScheduler:
+
+    # Continuous batching of a mapper's decoding across concurrent requests. A worker thread owns
+    # the live batch: waiting segments are encoded and join it before the next decode step,
+    # and a segment leaves it, resolving its future, as soon as it is finished.
+    def __init__(
+            self,
+            create_batch: Callable[[], DecodeBatch],
+            encode: Callable[[List[np.ndarray]], Tuple[torch.Tensor, torch.Tensor, torch.Tensor, List[int]]],
+            max_batch: int = 16,
+            context: Callable[[], AbstractContextManager] = nullcontext):
+
+        # create_batch: a new empty DecodeBatch, one for the live batch and one for retries
+        # encode: K, V, key_mask and N_b of a list of source melspecs
+        # context: entered on the worker threads around encoding and decoding, e.g. autocast
+        self.__create_batch = create_batch
+        self.__batch = create_batch()
+        self.__encode = encode
+        self.__max_batch = max_batch
+        self.__context = context
+
+        self.__waiting: deque = deque()
+
+        # Source melspec and target of every segment in the live batch, by its future, to retry it alone after a failure
+        self.__decoding: Dict[Future, Tuple[np.ndarray, int]] = dict()
+        self.__condition = threading.Condition()
+        self.__stopped = False
+
+        # Segments of a failed step are retried one at a time on a thread of their own,
+        # while the worker goes on serving the other requests
+        self.__retry_batch: DecodeBatch = None
+        self.__retries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode-retry")
+
+        self.__worker = threading.Thread(target=self.__run, name="decode-scheduler", daemon=True)
+        self.__worker.start()
+
+
+    def submit(self, melspec_list: List[np.ndarray], c_t: int) -> List[np.ndarray]:
+
+        # Blocks until every segment of the request is converted for target speaker index c_t
+        futures = [Future() for _ in melspec_list]
+
+        with self.__condition:
+            if self.__stopped:
+                raise RuntimeError("Decode scheduler is stopped.")
+
+            self.__waiting.extend((melspec, c_t, future) for melspec, future in zip(melspec_list, futures))
+            self.__condition.notify()
+
+        return [future.result() for future in futures]
+
+
+    def stop(self):
+
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+
+        self.__worker.join()
+        self.__retries.shutdown(wait=True)
+
+
+    def __run(self):
+
+        while True:
+
+            with self.__condition:
+                while not self.__stopped and len(self.__waiting) == 0 and self.__batch.size == 0:
+                    self.__condition.wait()
+
+                if self.__stopped:
+                    break
+
+                joining = [self.__waiting.popleft()
+                           for _ in range(min(len(self.__waiting), self.__max_batch - self.__batch.size))]
+
+            try:
+                self.__decode(joining)
+
+            except Exception:
+                # The live batch is dropped and its segments and the joining ones are handed to the retry thread
+                futures = self.__batch.clear()
+                retried = [(*self.__decoding[future], future) for future in futures]
+                retried += [segment for segment in joining if segment[2] not in futures]
+
+                self.__decoding.clear()
+                self.__retries.submit(self.__retry, retried)
+
+        self.__decoding.clear()
+        self.__fail(self.__batch.clear() + [future for _, _, future in self.__waiting], RuntimeError("Decode scheduler is stopped."))
+
+
+    def __decode(self, joining: List[Tuple[np.ndarray, int, Future]]):
+
+        # Admits the joining segments to the live batch and decodes one step
+        with self.__context():
+            if len(joining) > 0:
+                melspec_list, targets, futures = zip(*joining)
+
+                self.__decoding.update((future, (melspec, c_t)) for melspec, c_t, future in joining)
+
+                K, V, key_mask, N_b = self.__encode(list(melspec_list))
+                self.__batch.admit(K, V, key_mask, N_b, futures, targets)
+
+            finished = self.__batch.step()
+
+        for future, melspec_conv in finished:
+            del self.__decoding[future]
+            future.set_result(melspec_conv)
+
+
+    def __retry(self, segments: List[Tuple[np.ndarray, int, Future]]):
+
+        # Decodes every segment alone in the retry batch, so only the segments that fail on their own fail their requests
+        if self.__retry_batch is None:
+            self.__retry_batch = self.__create_batch()
+
+        batch = self.__retry_batch
+
+        for melspec, c_t, future in segments:
+            try:
+                with self.__context():
+                    K, V, key_mask, N_b = self.__encode([melspec])
+                    batch.admit(K, V, key_mask, N_b, [future], [c_t])
+
+                    finished = list()
+
+                    while batch.size > 0:
+                        finished += batch.step()
+
+                for future, melspec_conv in finished:
+                    future.set_result(melspec_conv)
+
+            except Exception as e:
+                batch.clear()
+                self.__fail([future], e)
+
+
+    @staticmethod
+    def __fail(futures: List[Future], e: Exception):
+
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
@@ -0,0 +1,174 @@
+from typing import Dict, List, Tuple
+import numpy as np
+
+
+def frame_energies(waveform: np.ndarray, frame_length: int, hop_length: int) -> Tuple[np.ndarray, np.ndarray]:
+
+    # Energy of every frame_length window starting at a multiple of hop_length, and the window starts,
+    # from one cumulative sum of the squared samples
+    samples = waveform.shape[0]
+
+    power = np.concatenate(([0.0], np.cumsum(np.square(waveform, dtype=np.float64))))
+    starts = np.arange(0, max(samples - frame_length, 0) + 1, hop_length)
+
+    return power[np.minimum(starts + frame_length, samples)] - power[starts], starts
+
+
+def split_waveform(
+        waveform: np.ndarray,
+        sr: int,
+        min_length: float = 2.0,
+        max_length: float = 4.0,
+        frame_length: float = 0.025,
+        buckets: List[float] = None) -> List[np.ndarray]:
+
+    # Splits the waveform into segments of min_length to max_length seconds, every cut in the middle
+    # of the quietest frame_length window the segment can end in. Only the last segment can be shorter.
+    # With buckets, every segment but the last is exactly one of the bucket lengths between min_length
+    # and max_length, the one whose end falls in the quietest window.
+    bucket_samples = sorted({int(sr*bucket) for bucket in buckets or [] if min_length <= bucket <= max_length})
+
+    if len(bucket_samples) > 0:
+        return _split_bucketed(waveform, bucket_samples, max(1, int(sr*frame_length)))
+
+    samples = waveform.shape[0]
+    min_samples, max_samples = int(sr*min_length), int(sr*max_length)
+
+    frame = max(1, int(sr*frame_length))
+    energies, starts = frame_energies(waveform, frame, max(1, frame//2))
+    centers = starts + frame//2
+
+    segments: List[np.ndarray] = list()
+
+    index = 0
+    while samples - index > max_samples:
+
+        first = np.searchsorted(centers, index + min_samples, side='right')
+        last = np.searchsorted(centers, index + max_samples, side='right')
+
+        if first < last:
+            cut = int(centers[first + np.argmin(energies[first:last])])
+        else:
+            cut = index + max_samples
+
+        segments.append(waveform[index:cut])
+        index = cut
+
+    if index < samples:
+        segments.append(waveform[index:])
+
+    return segments
+
+
+def _split_bucketed(waveform: np.ndarray, bucket_samples: List[int], frame: int) -> List[np.ndarray]:
+
+    # Energy of the frame window centered on every candidate cut, from one cumulative sum of the squared samples
+    samples = waveform.shape[0]
+    power = np.concatenate(([0.0], np.cumsum(np.square(waveform, dtype=np.float64))))
+    lengths = np.array(bucket_samples)
+
+    segments: List[np.ndarray] = list()
+
+    index = 0
+    while samples - index > lengths[-1]:
+
+        cuts = index + lengths
+        energies = power[np.minimum(cuts + frame//2, samples)] - power[cuts - frame//2]
+
+        cut = int(cuts[np.argmin(energies)])
+
+        segments.append(waveform[index:cut])
+        index = cut
+
+    if index < samples:
+        segments.append(waveform[index:])
+
+    return segments
+
+
+def bucket_counts(segments: List[np.ndarray], sr: int, buckets: List[float]) -> Dict[str, int]:
+
+    # Number of segments of every bucket length, segments of any other length are counted as 'other'
+    bucket_samples = {int(sr*bucket): f"{bucket:g}" for bucket in buckets}
+    counts = dict.fromkeys(list(bucket_samples.values()) + ['other'], 0)
+
+    for segment in segments:
+        counts[bucket_samples.get(segment.shape[0], 'other')] += 1
+
+    return counts
+
+
+def voice_activity(
+        segments: List[np.ndarray],
+        sr: int,
+        frame_length: float = 0.025,
+        threshold_db: float = -40.0,
+        floor_db: float = -60.0,
+        min_speech: float = 0.1) -> List[bool]:
+
+    # Energy-based speech/non-speech decision for every segment of a waveform. A frame is active when its
+    # mean power is within threshold_db of the loudest frame of the waveform and above floor_db (dBFS),
+    # a segment is speech when it has at least min_speech seconds of active frames.
+    frame = max(1, int(sr*frame_length))
+    powers = [frame_energies(segment, frame, frame)[0]/frame for segment in segments]
+
+    loudest = max((float(power.max()) for power in powers if power.shape[0] > 0), default=0.0)
+    level = max(loudest*10.0**(threshold_db/10.0), 10.0**(floor_db/10.0))
+
+    return [np.count_nonzero(power >= level)*frame >= min_speech*sr for power in powers]
+
+
+def split_waveform_loop(waveform: np.ndarray, sr: int, max_length: float = 4.0) -> List[np.ndarray]:
+
+    # Reference: cuts at the quietest single sample between 2 s and max_length, one sample per iteration
+    segments: List[np.ndarray] = list()
+    samples = waveform.shape[0]
+
+    index = 0
+    while index < samples:
+
+        limit = int(index + sr*max_length)
+
+        if limit > samples:
+
+            segments.append(waveform[index:])
+            index = samples
+
+        else:
+
+            min_vol = 100000.0
+            min_vol_index = limit
+
+            while limit > index + 2.0*sr:
+
+                if abs(waveform[limit]) < min_vol:
+                    min_vol = abs(waveform[limit])
+                    min_vol_index = limit
+
+                limit -= 1
+
+            segments.append(waveform[index:min_vol_index])
+
+            index = min_vol_index
+
+    return segments
+
+
+def speech_like(seconds: float, sr: int, seed: int = 0) -> np.ndarray:
+
+    # Synthetic recording for tests and benchmarks: noise bursts of 0.2-1.5 s with a syllable-rate envelope,
+    # separated by pauses of 20-400 ms
+    rng = np.random.default_rng(seed)
+    parts = list()
+    total = 0
+
+    while total < seconds*sr:
+
+        burst = int(sr*rng.uniform(0.2, 1.5))
+        envelope = 0.5 + 0.5*np.sin(2*np.pi*rng.uniform(3.0, 6.0)*np.arange(burst)/sr)
+        pause = int(sr*rng.uniform(0.02, 0.4))
+
+        parts += [0.3*envelope*rng.standard_normal(burst), 0.001*rng.standard_normal(pause)]
+        total += burst + pause
+
+    return np.concatenate(parts)[0:int(seconds*sr)].astype(np.float32)
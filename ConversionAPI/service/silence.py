@@ -0,0 +1,24 @@
+from typing import Callable, List
+
+
+class SilentSegment:
+
+    # Segment without speech: skips the mapper and enhancer, and the vocoder emits silence of its duration
+    def __init__(self, duration: float):
+
+        # Seconds of source audio
+        self.duration = duration
+
+
+def is_silent(segment) -> bool:
+
+    return isinstance(segment, SilentSegment)
+
+
+def map_speech(segments: List, convert: Callable[[List], List]) -> List:
+
+    # Converts the speech segments in one call, silent segments keep their place in the list
+    speech = [segment for segment in segments if not is_silent(segment)]
+    converted = iter(convert(speech) if len(speech) > 0 else [])
+
+    return [segment if is_silent(segment) else next(converted) for segment in segments]
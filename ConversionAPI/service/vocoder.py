@@ -1,8 +1,30 @@
 import os, yaml
 from nemo.collections.tts.models import HifiGanModel
 import torch
+import torch.nn.functional as F
 import numpy as np
-from typing import List, Tuple
+import copy
+from typing import Iterator, List, Tuple
+from .profiling import state_dict_bytes
+from .backend import check_backend, cached_file, export_graph, OnnxGraph
+from .precision import check_precision, autocast
+from .workers import SegmentPool
+from .silence import map_speech, is_silent
+from .padding import length_batches, pad_segments
+from .crossfade import join_segments, join_stream
+
+
+class GeneratorGraph(torch.nn.Module):
+
+    # HiFi-GAN generator from spectrogram to audio, as convert_spectrogram_to_audio runs it
+    def __init__(self, generator):
+        super(GeneratorGraph, self).__init__()
+
+        self.generator = generator
+
+    def forward(self, spec):
+
+        return self.generator(x=spec).squeeze(1)
 
 
 class SpectrogramVocoder:
@@ -12,7 +34,16 @@ class SpectrogramVocoder:
             vocoder_path: str, 
             vocoder_model_file: str, 
             vocoder_config_file: str, 
-            device):
+            device,
+            backend: str = 'torch',
+            precision: str = 'fp32',
+            workers: int = 0,
+            worker_threads: int = 0,
+            max_batch_frames: int = 0,
+            crossfade: float = 0.0,
+            chunk_frames: int = 0,
+            context_frames: int = 0,
+            pad_value: float = -11.52):
 
         self.__device = device
         self.__loaded = False
@@ -25,55 +56,229 @@ class SpectrogramVocoder:
 
         self.__vocoder_model: HifiGanModel = None
 
+        # 'onnx' runs the generator as an ONNX Runtime graph, exported on first load
+        check_backend(backend)
+
+        self.__backend = backend
+        self.__generator: OnnxGraph = None
+
+        # 'bf16' runs the generator under autocast, its audio is returned in fp32
+        check_precision(precision)
+
+        self.__precision = precision
+
+        if precision != 'fp32' and backend == 'onnx':
+            raise ValueError("bf16 inference runs the fp32 PyTorch network, it cannot be combined with the ONNX backend.")
+
+        # Segments of a request are split between worker processes holding the loaded model (CPU, PyTorch backend)
+        self.__workers = workers
+        self.__worker_threads = worker_threads
+        self.__pool: SegmentPool = None
+
+        if workers > 0 and (device.type != 'cpu' or backend != 'torch'):
+            raise ValueError("Segment worker processes are only supported for the PyTorch backend on CPU.")
+
+        # Segments are synthesized in padded batches of at most this many frames (0: all segments in one batch)
+        self.__max_batch_frames = max_batch_frames
+
+        # Seconds by which consecutive segments overlap when joined (0: plain concatenation)
+        self.__crossfade = crossfade
+
+        # Segments are synthesized in windows of chunk_frames frames (0: whole segments)
+        self.__chunk_frames = chunk_frames
+
+        # Frames around a segment or window that cover the generator's receptive field: a window is run with
+        # context_frames of its neighbours on both sides, and the end of every segment is followed by
+        # context_frames of the log-mel floor, so batching and chunking do not change the samples of a segment
+        self.__context_frames = context_frames
+
+        # Log-mel value of a frame without energy, padding with 0 would be a loud frame
+        self.__pad_value = pad_value
+
     @property
     def loaded(self):
         return self.__loaded
 
+    @property
+    def footprint(self) -> int:
+        return state_dict_bytes(self.__vocoder_model)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.__vocoder_config["sample_rate"]
+
     def load(self):
 
         if not self.__loaded:
 
+            # The workers are started before the model is loaded here, each loads it into an unloaded copy of the vocoder
+            if self.__workers > 0:
+                self.__pool = SegmentPool(self.__worker_copy(), 'synthesize', self.__workers, self.__worker_threads)
+
             self.__vocoder_model: HifiGanModel = HifiGanModel.restore_from(os.path.join(self.__vocoder_path, self.__vocoder_model_file)).to(self.__device)
+            if self.__backend == 'onnx':
+                self.__generator = self.__load_graph()
+
             self.__loaded = True
 
+    def __worker_copy(self) -> 'SpectrogramVocoder':
+
+        # Synthesizes the segments of a worker in-process, without workers of its own
+        vocoder = copy.copy(self)
+        vocoder.__workers = 0
+
+        return vocoder
+
     def unload(self):
 
+        if self.__pool is not None:
+            self.__pool.shutdown()
+            self.__pool = None
+
         del self.__vocoder_model
+        self.__generator = None
         self.__loaded = False
 
 
+    def __load_graph(self) -> OnnxGraph:
+
+        graph_file = cached_file(
+            os.path.join(self.__vocoder_path, self.__vocoder_model_file),
+            os.path.join(self.__vocoder_path, 'onnx'),
+            'generator',
+            "fp32",
+            'onnx')
+
+        if not os.path.exists(graph_file):
+            generator = self.__vocoder_model.generator
+
+            export_graph(
+                GeneratorGraph(generator),
+                (torch.randn((1, generator.conv_pre.in_channels, 64), device=self.__device),),
+                ['spec'],
+                ['audio'],
+                {'spec': {0: 'batch', 2: 'frames'}, 'audio': {0: 'batch', 1: 'samples'}},
+                graph_file)
+
+        return OnnxGraph(graph_file, ['spec'], self.__device)
+
+
     def vocode(self, conv_melspec_list: List[np.ndarray]) -> Tuple[np.ndarray, int]:
 
         if self.__loaded:
-            segment_list: List[np.ndarray] = list()
 
-            for melspec in conv_melspec_list:
-                
-                synthesized_segment = self.__synthesize_segment(melspec)
-                segment_list.append(synthesized_segment)
+            sample_rate = self.__vocoder_config["sample_rate"]
 
+            # Chunked synthesis bounds the generator's memory by the window size instead of the segment length
+            if self.__chunk_frames > 0:
+                return np.concatenate([np.zeros(0, dtype=np.float32)] + list(self.__stream(conv_melspec_list))), sample_rate
 
-            return SpectrogramVocoder.__join_segments(segment_list), self.__vocoder_config["sample_rate"]
+            return join_segments(self.synthesize(conv_melspec_list), round(self.__crossfade*sample_rate)), sample_rate
 
-        raise RuntimeError("Mapper model currently not loaded.")
+        raise RuntimeError("Vocoder model currently not loaded.")
 
 
-    @torch.no_grad()
-    def __synthesize_segment(self, melspec) -> np.ndarray:
+    def synthesize(self, conv_melspec_list: List[np.ndarray]) -> List[np.ndarray]:
 
-        ## HiFiGAN
+        # The waveform of every segment, not joined
+        if self.__loaded:
+
+            if self.__pool is not None:
+                segment_list = map_speech(conv_melspec_list, self.__pool.map)
+            else:
+                segment_list = map_speech(conv_melspec_list, self.__synthesize_segments)
 
-        melspec = torch.tensor(np.reshape(melspec, (1,) + melspec.shape), dtype=torch.float).to(self.__device)
+            # Silent segments are emitted as silence of their source duration
+            return [
+                self.__silence(segment) if is_silent(segment) else segment 
+                for segment in segment_list]
 
-        #start = time.time()
-        x = self.__vocoder_model.convert_spectrogram_to_audio(spec=melspec).cpu().numpy()
+        raise RuntimeError("Vocoder model currently not loaded.")
+
+
+    def vocode_stream(self, conv_melspec_list: List[np.ndarray]) -> Iterator[np.ndarray]:
+
+        # The audio at sample_rate as consecutive chunks, every chunk synthesized only when it is requested
+        if self.__loaded:
+            return self.__stream(conv_melspec_list)
+
+        raise RuntimeError("Vocoder model currently not loaded.")
+
+
+    def __stream(self, conv_melspec_list: List[np.ndarray]) -> Iterator[np.ndarray]:
+
+        segments = (
+            iter([self.__silence(melspec)]) if is_silent(melspec) else self.__synthesize_chunks(melspec) 
+            for melspec in conv_melspec_list)
+
+        for chunk in join_stream(segments, round(self.__crossfade*self.__vocoder_config["sample_rate"])):
+            if chunk.shape[0] > 0:
+                yield chunk.astype(np.float32, copy=False)
+
+
+    def __synthesize_chunks(self, melspec: np.ndarray) -> Iterator[np.ndarray]:
+
+        # Every window is synthesized with its context and the samples of the context are discarded.
+        # Past the end of the segment the context is the log-mel floor, as for a whole segment.
+        frames = melspec.shape[-1]
+        chunk_frames = self.__chunk_frames if self.__chunk_frames > 0 else frames
+
+        for start in range(0, frames, chunk_frames):
+
+            end = min(start + chunk_frames, frames)
+            left, right = max(start - self.__context_frames, 0), min(end + self.__context_frames, frames)
+
+            window = self.__pad([melspec[..., left:right]], end + self.__context_frames - right)
+
+            x = self.__synthesize_batch(window)[0]
+            hop_length = x.shape[-1] // window.shape[-1]
+
+            yield x[(start - left)*hop_length:(end - left)*hop_length]
+
+
+    def __silence(self, segment) -> np.ndarray:
+
+        return np.zeros(round(segment.duration*self.__vocoder_config["sample_rate"]), dtype=np.float32)
+
+
+    def __synthesize_segments(self, conv_melspec_list: List[np.ndarray]) -> List[np.ndarray]:
+
+        # One generator run per padded batch of similar-length segments, every waveform trimmed to the
+        # samples of its own frames
+        lengths = [melspec.shape[-1] for melspec in conv_melspec_list]
+        segment_list: List[np.ndarray] = [None]*len(conv_melspec_list)
+
+        for batch in length_batches(lengths, self.__max_batch_frames):
+
+            melspec = self.__pad([conv_melspec_list[i] for i in batch], self.__context_frames)
+            x = self.__synthesize_batch(melspec)
+
+            # The generator upsamples every frame to the same number of samples
+            hop_length = x.shape[-1] // melspec.shape[-1]
+
+            for b, i in enumerate(batch):
+                segment_list[i] = x[b, 0:lengths[i]*hop_length]
+
+        return segment_list
+
+
+    def __pad(self, segments: List[np.ndarray], context: int) -> torch.Tensor:
+
+        # Padded with the log-mel floor to the longest segment and context frames past it
+        melspec = pad_segments(segments, self.__device, self.__pad_value)
+
+        return F.pad(melspec, (0, context), value=self.__pad_value)
+
+
+    @torch.no_grad()
+    def __synthesize_batch(self, melspec: torch.Tensor) -> np.ndarray:
+
+        ## HiFiGAN
 
-        del melspec
+        if self.__generator is not None:
+            return self.__generator(melspec)[0].cpu().numpy()
 
-        return x[0]
+        with autocast(self.__precision, self.__device):
+            x = self.__vocoder_model.convert_spectrogram_to_audio(spec=melspec)
 
-    
-    @staticmethod
-    def __join_segments(segments: List[np.ndarray]) -> np.ndarray:
-        
-        return np.concatenate(tuple(segments), dtype=np.float32)
\ No newline at end of file
+        return x.float().cpu().numpy()
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Callable, List
+import multiprocessing
+import numpy as np
+import torch
+import os
+
+# Per-segment function of the stage a worker process serves, set when the worker starts
+_function: Callable = None
+
+
+def _init_worker(stage, method: str, threads: int):
+
+    global _function
+
+    # The worker loads the model of its unloaded copy of the stage with its own intra-op threads
+    torch.set_num_threads(threads)
+    stage.load()
+
+    _function = getattr(stage, method)
+
+
+def _run(segments: List, args: tuple) -> List:
+
+    with torch.no_grad():
+        return _function(segments, *args)
+
+
+def _ready() -> bool:
+
+    return _function is not None
+
+
+class SegmentPool:
+
+    # Worker processes that convert the segments of one request in parallel. The workers are spawned,
+    # not forked, since the serving process runs threads (the web server, decode schedulers, intra-op pools)
+    # whose locks a forked child could inherit held. Every worker loads its own copy of the model
+    # and runs its share of the segments with its own intra-op threads.
+    def __init__(self, stage, method: str, workers: int, threads: int = 0):
+
+        # stage: unloaded, picklable copy of the pipeline stage, loaded in every worker without workers of its own
+        # method: public method of the stage that converts a list of segments, returns one result per segment, in order
+        # threads: intra-op threads of every worker, 0 shares the cores of the machine between them
+        if threads <= 0:
+            threads = max(1, (os.cpu_count() or 1)//workers)
+
+        self.__workers = workers
+
+        self.__executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(stage, method, threads))
+
+        # Starts every worker now and waits until each has loaded its model, instead of on the first request
+        for ready in [self.__executor.submit(_ready) for _ in range(workers)]:
+            ready.result()
+
+
+    def map(self, segments: List, *args) -> List:
+
+        if len(segments) == 0:
+            return list()
+
+        # Splits the segments into contiguous chunks of about equal length, one per worker
+        chunks = [chunk for chunk in SegmentPool.__split(segments, self.__workers) if len(chunk) > 0]
+
+        return [result for results in self.__executor.map(_run, chunks, repeat(args)) for result in results]
+
+
+    def shutdown(self):
+
+        self.__executor.shutdown()
+
+
+    @staticmethod
+    def __split(segments: List, parts: int) -> List[List]:
+
+        ends = np.cumsum([segment.shape[-1] for segment in segments])
+        bounds = np.searchsorted(ends, ends[-1]*np.arange(1, parts)/parts, side='right')
+
+        return [segments[start:end] for start, end in zip([0, *bounds], [*bounds, len(segments)])]
@@ -0,0 +1,34 @@
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+# Importing the service package loads every model of api_config.json. The tests import its
+# modules from a bare package instead, so they run without the models or the API configuration.
+if 'service' not in sys.modules:
+    service = types.ModuleType('service')
+    service.__path__ = [os.path.join(ROOT, 'service')]
+    sys.modules['service'] = service
+
+
+import pytest
+import torch
+from convs2s import net
+
+
+@pytest.fixture
+def mapper():
+
+    # Small randomly initialized ConvS2S with 4 speakers, 16 mels and a reduction factor of 2
+    torch.manual_seed(0)
+
+    num_mels, rf, n_spk = 16, 2, 4
+
+    enc = net.Encoder1(num_mels*rf, n_spk, 32, 16, 24, 2)
+    predec = net.PreDecoder1(num_mels*rf, n_spk, 32, 16, 24, 2)
+    postdec = net.PostDecoder1(16*2, n_spk, 32, num_mels*rf, 24, 2)
+
+    return net.ConvS2S(enc, predec, postdec).eval()
@@ -0,0 +1,40 @@
+import numpy as np
+import torch
+
+
+# Segment lengths of the padded batches the backend and precision tests convert: 1, 3 and 5 segments
+BATCHES = [[25], [30, 22, 17], [41, 9, 30, 22, 13]]
+
+
+def melspecs(lengths, num_mels=16):
+
+    torch.manual_seed(1)
+    x = torch.zeros((len(lengths), num_mels, max(lengths)))
+
+    for b, length in enumerate(lengths):
+        x[b, :, 0:length] = torch.randn((num_mels, length))
+
+    return x
+
+
+def convert(mapper, x, lengths, c_t=2, **options):
+
+    # Lean conversion of a padded batch from speaker 0 to c_t with the fixture's reduction factor of 2
+    options = {'lean': True, **options}
+
+    with torch.no_grad():
+        return mapper.inference(x, 0, c_t, 2, lengths=lengths, **options)[0]
+
+
+def assert_close_melspecs(reference, output, atol=1e-4, frames=0):
+
+    # Same number of segments, lengths within `frames` of each other and values within atol on the common frames
+    assert len(reference) == len(output)
+
+    for ref, out in zip(reference, output):
+        assert ref.shape[0] == out.shape[0]
+        assert abs(ref.shape[-1] - out.shape[-1]) <= frames
+
+        common = min(ref.shape[-1], out.shape[-1])
+        np.testing.assert_allclose(out[..., 0:common], ref[..., 0:common], rtol=0, atol=atol)
+
@@ -0,0 +1,84 @@
+import pytest
+import torch
+from convs2s import net, net_a2m
+from convs2s.batching import DecodeBatch
+from helpers import assert_close_melspecs, convert, melspecs
+
+
+@pytest.fixture
+def any2many():
+
+    # Small randomly initialized ConvS2SAny2Many with the sizes of the mapper fixture
+    torch.manual_seed(0)
+
+    num_mels, rf, n_spk = 16, 2, 4
+
+    enc = net_a2m.EncoderAny(num_mels*rf, 16, 24, 2)
+    predec = net.PreDecoder1(num_mels*rf, n_spk, 32, 16, 24, 2)
+    postdec = net.PostDecoder1(16*2, n_spk, 32, num_mels*rf, 24, 2)
+
+    return net_a2m.ConvS2SAny2Many(enc, predec, postdec).eval()
+
+
+def convert_alone(any2many, x, lengths, targets, **options):
+
+    # Every segment converted in a batch of its own, to its own target
+    return [
+        convert(any2many, x[b:b+1, :, 0:length], [length], c_t=target, **options)[0]
+        for b, (length, target) in enumerate(zip(lengths, targets))]
+
+
+# The compiled step only runs raw attention
+@pytest.mark.parametrize("attention_mode, compiled", [('raw', False), ('forward', False), ('raw', True)])
+def test_mixed_targets_match_each_target_alone(any2many, attention_mode, compiled):
+
+    lengths, targets = [30, 22, 17, 25], [1, 3, 2, 1]
+    x = melspecs(lengths)
+
+    options = {'attention_mode': attention_mode, 'lean': False}
+
+    if compiled:
+        with torch.no_grad():
+            options['decoder_step'] = any2many.compile_decoder_step(None, 16, 2, torch.device('cpu'))
+
+    output = convert(any2many, x, lengths, c_t=targets, **options)
+
+    assert_close_melspecs(convert_alone(any2many, x, lengths, targets, **options), output, atol=1e-5)
+
+
+def test_continuous_batch_with_mixed_targets(any2many):
+
+    lengths, targets = [30, 22, 17, 25], [1, 3, 2, 1]
+    x = melspecs(lengths)
+
+    batch = DecodeBatch(any2many, any2many.decoder_step(), 16, 2, torch.device('cpu'))
+    results = dict()
+
+    def admit(first, last):
+        K, V, key_mask, N_b = any2many.encode(x[first:last], 0, 2, lengths=lengths[first:last])
+        batch.admit(K, V, key_mask, N_b, range(first, last), targets[first:last])
+
+    # The last two segments join the live batch of the first two after a few steps
+    with torch.no_grad():
+        admit(0, 2)
+
+        for _ in range(3):
+            results.update(batch.step())
+
+        admit(2, 4)
+
+        while batch.size > 0:
+            results.update(batch.step())
+
+    assert_close_melspecs(convert_alone(any2many, x, lengths, targets), [results[b] for b in range(4)], atol=1e-5)
+
+
+def test_targets_change_the_conversion(any2many):
+
+    # The per-item targets do reach the decoders: one source converted to two speakers differs
+    lengths = [30, 30]
+    x = melspecs([30]).repeat(2, 1, 1)
+
+    output = convert(any2many, x, lengths, c_t=[1, 3], lean=False)
+
+    assert (abs(output[0][..., 0:20] - output[1][..., 0:20])).max() > 1e-3
@@ -0,0 +1,18 @@
+import pytest
+from helpers import melspecs, convert, assert_close_melspecs
+
+
+@pytest.mark.parametrize("attention_mode", ['raw', 'forward', 'diagonal'])
+@pytest.mark.parametrize("lengths", [[30, 22, 17], [9, 40], [25]])
+def test_padded_batch_matches_segments_alone(mapper, attention_mode, lengths):
+
+    # Every segment of a padded batch is decoded as if it was the only one, padding and
+    # the longer decode of the batch do not reach its frames or its DTW trim
+    x = melspecs(lengths)
+    batched = convert(mapper, x, lengths, attention_mode=attention_mode, lean=False)
+
+    alone = [
+        convert(mapper, x[b:b+1, :, 0:length], [length], attention_mode=attention_mode, lean=False)[0]
+        for b, length in enumerate(lengths)]
+
+    assert_close_melspecs(alone, batched, atol=1e-5)
@@ -0,0 +1,37 @@
+import pytest
+import torch
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+from service.backend import cached_file
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+@pytest.mark.parametrize("specialized", [False, True])
+def test_compiled_step_matches(mapper, lengths, specialized):
+
+    if specialized:
+        mapper.specialize(0, 2)
+
+    x = melspecs(lengths)
+
+    reference = convert(mapper, x, lengths)
+
+    with torch.no_grad():
+        decoder_step = mapper.compile_decoder_step(2, 16, 2, torch.device('cpu'))
+
+    assert_close_melspecs(reference, convert(mapper, x, lengths, decoder_step=decoder_step), atol=1e-5)
+
+
+def test_cache_key_follows_the_model_config(tmp_path):
+
+    model_file, config_file = tmp_path / 'model.pt', tmp_path / 'config.json'
+    model_file.write_bytes(b'weights')
+    config_file.write_text('{"reduction_factor": 2}')
+
+    key = cached_file(str(model_file), str(tmp_path), 'decoder_step', 'tag', 'pt', str(config_file))
+
+    assert key == cached_file(str(model_file), str(tmp_path), 'decoder_step', 'tag', 'pt', str(config_file))
+    assert key != cached_file(str(model_file), str(tmp_path), 'decoder_step', 'tag', 'pt')
+
+    config_file.write_text('{"reduction_factor": 3}')
+
+    assert key != cached_file(str(model_file), str(tmp_path), 'decoder_step', 'tag', 'pt', str(config_file))
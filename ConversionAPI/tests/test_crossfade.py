@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from service.crossfade import join_segments, join_stream
+
+
+def segments_of(lengths, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    return [rng.standard_normal(length).astype(np.float32) for length in lengths]
+
+
+def test_without_crossfade_segments_are_concatenated():
+
+    segments = segments_of([100, 7, 0, 250])
+
+    np.testing.assert_array_equal(join_segments(segments, 0), np.concatenate(segments))
+
+
+def test_joins_overlap_by_the_crossfade():
+
+    segments = segments_of([300, 200, 250])
+    joined = join_segments(segments, 50)
+
+    assert joined.dtype == np.float32
+    assert joined.shape[0] == 750 - 2*50
+
+    # Outside the overlaps the samples are untouched
+    np.testing.assert_array_equal(joined[0:250], segments[0][0:250])
+    np.testing.assert_array_equal(joined[300:400], segments[1][50:150])
+    np.testing.assert_array_equal(joined[450:], segments[2][50:])
+
+
+def test_fade_keeps_the_power_of_a_constant():
+
+    joined = join_segments([np.ones(100, dtype=np.float32), np.ones(100, dtype=np.float32)], 40)
+    overlap = joined[60:100]
+
+    fade = (np.arange(40) + 0.5)/40*np.pi/2
+    np.testing.assert_allclose(overlap, np.cos(fade) + np.sin(fade), rtol=1e-6)
+
+    # Faded out and in at equal power, cos² + sin² = 1
+    assert np.all(overlap >= 1.0) and np.all(overlap <= np.sqrt(2.0) + 1e-6)
+
+
+def test_short_segment_overlaps_the_end_of_the_previous_one():
+
+    # The 10 samples fade into the last 10 of the first segment and leave no tail to fade into the third
+    segments = segments_of([200, 10, 150])
+    joined = join_segments(segments, 30)
+
+    assert joined.shape[0] == 200 + 150
+    np.testing.assert_array_equal(joined[0:190], segments[0][0:190])
+    np.testing.assert_array_equal(joined[200:], segments[2])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_stream_matches_the_whole_join(seed):
+
+    # The segments arrive in chunks of random length, as chunked synthesis yields them
+    rng = np.random.default_rng(seed)
+    segments = segments_of(rng.integers(0, 400, size=6), seed)
+    crossfade = int(rng.integers(0, 80))
+
+    def chunked(segment):
+        bounds = np.sort(rng.integers(0, segment.shape[0] + 1, size=int(rng.integers(0, 5))))
+        return np.split(segment, bounds)
+
+    streamed = np.concatenate([np.zeros(0, dtype=np.float32)] + list(join_stream((chunked(segment) for segment in segments), crossfade)))
+
+    np.testing.assert_allclose(streamed, join_segments(segments, crossfade), rtol=1e-6, atol=1e-7)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from convs2s import dtw
+
+
+def distance_matrix(rng, N, T):
+
+    # Same distance as the one computed from the attention matrix in ConvS2S.inference
+    A = rng.random((N, T)).astype(np.float32)
+
+    return 1.0 - A**0.3
+
+
+@pytest.mark.parametrize("N, T, w", [(1, 1, 100), (1, 7, 100), (7, 1, 100), (12, 24, 3), (40, 80, 100), (83, 166, 100), (30, 60, 0)])
+def test_banded_dtw_matches_loop(N, T, w):
+
+    rng = np.random.default_rng(N*1000 + T)
+
+    for _ in range(5):
+        D0 = distance_matrix(rng, N, T)
+
+        path_loop = dtw.banded_dtw_loop(D0, w=w, p=0.1)
+        path = dtw.banded_dtw(D0, w=w, p=0.1)
+
+        np.testing.assert_array_equal(path[0], path_loop[0])
+        np.testing.assert_array_equal(path[1], path_loop[1])
+
+
+def test_banded_dtw_unbounded_band():
+
+    D0 = distance_matrix(np.random.default_rng(0), 20, 40)
+
+    path_loop = dtw.banded_dtw_loop(D0)
+    path = dtw.banded_dtw(D0)
+
+    np.testing.assert_array_equal(path[0], path_loop[0])
+    np.testing.assert_array_equal(path[1], path_loop[1])
+
+
+def test_banded_dtw_ties():
+
+    # Constant distances make every step a tie, the vectorized version has to break them like the loop
+    D0 = np.ones((10, 20))
+
+    path_loop = dtw.banded_dtw_loop(D0, w=100, p=0.0)
+    path = dtw.banded_dtw(D0, w=100, p=0.0)
+
+    np.testing.assert_array_equal(path[0], path_loop[0])
+    np.testing.assert_array_equal(path[1], path_loop[1])
+
+
+def test_banded_dtw_path_is_monotonic():
+
+    D0 = distance_matrix(np.random.default_rng(1), 25, 50)
+
+    path_r, path_c = dtw.banded_dtw(D0, w=100, p=0.1)
+
+    assert path_r[0] == 0 and path_c[0] == 0
+    assert np.all(np.diff(path_r) >= 0) and np.all(np.diff(path_c) >= 0)
+    assert np.all(np.diff(path_r) + np.diff(path_c) >= 1)
@@ -0,0 +1,66 @@
+import torch
+from convs2s import module as md
+from helpers import melspecs
+
+
+def diagonal_attention():
+
+    # Attention on source frame t//2 at decode step t, so every segment reaches its end at a different step
+    calls = [0]
+
+    def attention_weights(K, Q, key_mask):
+
+        N_b = (~key_mask[:, :, 0]).sum(dim=1)
+        peak = torch.minimum(torch.full_like(N_b, calls[0]//2), N_b - 1)
+        calls[0] += 1
+
+        return torch.nn.functional.one_hot(peak, K.shape[2]).to(K.dtype).unsqueeze(2)
+
+    return attention_weights
+
+
+def test_check_interval_keeps_the_detected_ends(mapper, monkeypatch):
+
+    lengths = [40, 26, 34]
+    x = melspecs(lengths)
+
+    detector_class = md.AttentionEndDetector
+
+    def run(check_interval):
+
+        class Detector(detector_class):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs, check_interval=check_interval)
+
+        monkeypatch.setattr(md, 'AttentionEndDetector', Detector)
+        monkeypatch.setattr(md, 'attention_weights', diagonal_attention())
+
+        with torch.no_grad():
+            return mapper.inference(x, 0, 1, 2, lengths=lengths, lean=True, end_detection='online')[0]
+
+    every_step, every_8 = run(1), run(8)
+
+    # Subsampled by 2, the segments have 20, 13 and 17 source frames and end 3 steps after reaching their last 2
+    assert [a.shape[1] for a in every_step] == [2*(2*18 + 3), 2*(2*11 + 3), 2*(2*15 + 3)]
+
+    for a, b in zip(every_step, every_8):
+        assert a.shape == b.shape
+        torch.testing.assert_close(torch.as_tensor(a), torch.as_tensor(b))
+
+
+def test_detector_places_the_end_after_the_margin():
+
+    # Two segments of 5 source frames, the first attends its last 2 frames from step 3 on
+    detector = md.AttentionEndDetector([5, 5], [10, 10], torch.device('cpu'), margin=3, tail=2, threshold=0.5, patience=3, check_interval=1)
+
+    for t in range(10):
+        A = torch.zeros((2, 5, 1))
+        A[0, 4 if t >= 3 else 0, 0] = 1.0
+        A[1, 0, 0] = 1.0
+
+        detector.update(A, t)
+
+    # Settled at step 3, detected at step 5 after 3 steps, the end is 3 frames after step 3
+    assert detector.end_of_frame.tolist() == [6, -1]
+    assert detector.finished(9).tolist() == [True, True]
+    assert not detector.all_finished(5)
@@ -0,0 +1,68 @@
+import types
+import numpy as np
+import pytest
+import torch
+from sklearn.preprocessing import StandardScaler
+
+pytest.importorskip("nemo")
+
+from service.featurizer import NormalizableFilterbankFeatures
+
+
+def normalize(featurizer, x, lengths):
+
+    return NormalizableFilterbankFeatures._normalize_features(featurizer, x, torch.tensor(lengths))
+
+
+def padded_features(lengths, n_mels=8, pad_value=-11.52):
+
+    # Log-mel-like features of every item and their batch, padded with pad_value as the featurizer pads it
+    torch.manual_seed(0)
+    items = [torch.randn((1, n_mels, length))*2.0 - 5.0 for length in lengths]
+
+    x = torch.full((len(lengths), n_mels, max(lengths)), pad_value)
+
+    for b, item in enumerate(items):
+        x[b, :, 0:lengths[b]] = item[0]
+
+    return items, x
+
+
+@pytest.mark.parametrize("lengths", [[40, 25, 7], [12], [3, 30]])
+def test_masked_per_melspec_matches_each_item(lengths):
+
+    featurizer = types.SimpleNamespace(normalize="per_melspec")
+    items, x = padded_features(lengths)
+
+    output = normalize(featurizer, x, lengths)
+
+    for b, item in enumerate(items):
+        reference = normalize(featurizer, item, [lengths[b]])
+        torch.testing.assert_close(output[b:b+1, :, 0:lengths[b]], reference, rtol=0, atol=1e-5)
+
+        # Unbiased statistics over the valid frames only
+        expected = (item - item.mean()) / (item.std() + 1e-5)
+        torch.testing.assert_close(reference, expected, rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize("lengths", [[40, 25, 7], [12], [3, 30]])
+def test_masked_by_statistics_matches_the_scaler(lengths):
+
+    items, x = padded_features(lengths)
+
+    scaler = StandardScaler().fit(torch.cat(items, dim=2)[0].T.numpy())
+
+    featurizer = types.SimpleNamespace(
+        normalize="by_statistics",
+        features_mean=torch.tensor(scaler.mean_, dtype=torch.float).view(1, -1, 1),
+        features_scale=torch.tensor(scaler.scale_, dtype=torch.float).view(1, -1, 1))
+
+    output = normalize(featurizer, x, lengths)
+
+    for b, item in enumerate(items):
+        reference = scaler.transform(item[0].T.numpy()).T
+
+        np.testing.assert_allclose(output[b, :, 0:lengths[b]].numpy(), reference, rtol=0, atol=1e-5)
+
+        # Padded frames keep the pad value
+        assert bool((output[b, :, lengths[b]:] == x[b, :, lengths[b]:]).all())
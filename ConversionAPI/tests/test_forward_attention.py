@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+import torch
+from convs2s import module as md
+
+
+def reference_attention(mapper, A_steps, rf):
+
+    # Forward attention of a single segment as the unbatched decoder computed it, one NumPy column per step
+    N = A_steps[0].shape[0]
+    n_argmax = 0
+    y_samples, x_samples = np.array([0]), np.array([0])
+    outputs = list()
+
+    for t, A in enumerate(A_steps):
+
+        A_np = A.reshape(1, N, 1).copy()
+        n_argmax_tmp = mapper.localpeak(A_np, n_argmax, 5.0)[0]
+
+        if t == 0:
+            n_argmax = max(n_argmax, n_argmax_tmp)
+        else:
+            y_samples, x_samples = np.append(y_samples, n_argmax_tmp), np.append(x_samples, t)
+            slope = (np.mean((y_samples - np.mean(y_samples))*(x_samples - np.mean(x_samples)))
+                     /(max(np.std(x_samples), 1e-10)**2))
+            n_argmax = int(round(slope*(t+1)))
+
+        A_np[0, 0:max(n_argmax - 20//rf, 0), 0] = 0
+        A_np[0, min(n_argmax + 40//rf, N-1):, 0] = 0
+        outputs.append(np.maximum(A_np, 1e-10)[0, :, 0]/np.sum(np.maximum(A_np, 1e-10)))
+
+    return outputs
+
+
+@pytest.mark.parametrize("rf", [1, 2, 4])
+def test_batched_forward_attention_matches_reference(mapper, rf):
+
+    rng = np.random.default_rng(rf)
+    N_b = [60, 23, 41, 8]
+    N, T = max(N_b), 2*max(N_b)
+
+    # Attention peaked along a noisy diagonal of every segment, zero on the padded frames
+    A = np.zeros((T, len(N_b), N))
+
+    for b, n in enumerate(N_b):
+        for t in range(T):
+            scores = rng.standard_normal(n) - 0.5*np.square(np.arange(n) - t*n/T - rng.normal(0, 2))
+            A[t, b, 0:n] = np.exp(scores - scores.max())/np.exp(scores - scores.max()).sum()
+
+    attention = md.ForwardAttention(N_b, rf, torch.device('cpu'))
+    outputs = [attention(torch.tensor(A[t], dtype=torch.float).unsqueeze(2), t)[:, :, 0].numpy() for t in range(T)]
+
+    for b, n in enumerate(N_b):
+        reference = reference_attention(mapper, [A[t, b, 0:n] for t in range(T)], rf)
+
+        for t in range(T):
+            np.testing.assert_allclose(outputs[t][b, 0:n], reference[t], rtol=1e-4, atol=1e-7)
+            assert np.all(outputs[t][b, n:] == 0)
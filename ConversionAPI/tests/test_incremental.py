@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import torch
+from convs2s import module as md
+
+
+def step_through(step, x):
+
+    # Feeds x one frame at a time and concatenates the outputs
+    with torch.no_grad():
+        return torch.cat([step(x[:, :, t:t+1]) for t in range(x.shape[2])], dim=2)
+
+
+@pytest.mark.parametrize("layer_type", [md.DilCausConv1D, md.DilCausConvGLU1D])
+@pytest.mark.parametrize("ks, df", [(5, 1), (5, 3), (3, 9)])
+def test_causal_layer_step_matches_forward(layer_type, ks, df):
+
+    torch.manual_seed(0)
+
+    layer = layer_type(8, 6, ks, df).eval()
+    x = torch.randn(3, 8, 40)
+
+    with torch.no_grad():
+        reference, _ = layer(x)
+
+    buffer = md.RingBuffer(3, 8, ks, df, x.device)
+    output = step_through(lambda frame: layer.step(frame, buffer), x)
+
+    np.testing.assert_allclose(output.numpy(), reference.numpy(), rtol=0, atol=1e-5)
+
+
+def test_speaker_layer_step_matches_forward():
+
+    torch.manual_seed(0)
+
+    base = md.DilCausConvGLU1D(8 + 4, 8, 5, 3).eval()
+    layer = md.SpeakerDilCausConvGLU1D(base, torch.randn(4)).eval()
+    x = torch.randn(2, 8, 40)
+
+    with torch.no_grad():
+        reference, _ = layer(x)
+
+    buffer = md.RingBuffer(2, 8, 5, 3, x.device)
+    t = iter(range(x.shape[2]))
+    output = step_through(lambda frame: layer.step(frame, buffer, next(t)), x)
+
+    np.testing.assert_allclose(output.numpy(), reference.numpy(), rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize("decoder", ['predec', 'postdec'])
+@pytest.mark.parametrize("specialized", [False, True])
+def test_decoder_step_matches_forward(mapper, decoder, specialized):
+
+    if specialized:
+        mapper.specialize(0, 2)
+
+    dec = getattr(mapper, decoder)
+
+    # Both decoders of the test mapper take 32 input channels
+    torch.manual_seed(1)
+    x = torch.randn(3, 32, 40)
+
+    with torch.no_grad():
+        reference, _ = dec(x, 2)
+
+    state = dec.init_state(3, x.device)
+    output = step_through(lambda frame: dec.step(frame, 2, state), x)
+
+    assert state.t == x.shape[2]
+    np.testing.assert_allclose(output.numpy(), reference.numpy(), rtol=0, atol=1e-5)
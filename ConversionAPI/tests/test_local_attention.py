@@ -0,0 +1,27 @@
+import pytest
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+def test_full_window_matches_raw_attention(mapper, lengths):
+
+    # A window over every source frame scores the same keys as raw attention
+    x = melspecs(lengths)
+
+    reference = convert(mapper, x, lengths, attention_mode='raw', lean=False)
+    output = convert(mapper, x, lengths, attention_mode='local', attention_window=max(lengths), lean=False)
+
+    assert_close_melspecs(reference, output, atol=1e-5)
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+@pytest.mark.parametrize("attention_window", [2, 4, 8])
+def test_small_window_keeps_every_segment(mapper, lengths, attention_window):
+
+    # A window that loses the alignment must not trim a segment to nothing
+    x = melspecs(lengths)
+
+    output = convert(mapper, x, lengths, attention_mode='local', attention_window=attention_window, lean=False)
+
+    assert len(output) == len(lengths)
+    assert all(out.shape[-1] > 0 for out in output)
@@ -0,0 +1,9 @@
+import pytest
+import torch
+from service.mapper import SpectrogramConverter
+
+
+def test_any2many_mapper_cannot_be_specialized(tmp_path):
+
+    with pytest.raises(ValueError):
+        SpectrogramConverter(str(tmp_path), 'model.pt', 'config.json', 'raw', torch.device('cpu'), model_type='any2many', specialize=True)
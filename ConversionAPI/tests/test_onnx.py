@@ -0,0 +1,64 @@
+import pytest
+import torch
+from convs2s import net
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+from service.backend import export_graph, OnnxGraph
+
+
+@pytest.fixture
+def graphs(mapper, tmp_path):
+
+    # Encoder and decoder step exported from example inputs with a batch of 2 and 8 source frames,
+    # batch size and source length are dynamic axes
+    device = torch.device('cpu')
+    layers = len(mapper.predec.glu_blocks) + len(mapper.postdec.glu_blocks)
+
+    state_inputs = [f'state_{i}' for i in range(layers)]
+    state_outputs = [f'state_out_{i}' for i in range(layers)]
+    step_inputs = ['in_t', 'K', 'V', 'key_mask', 't'] + state_inputs
+
+    dynamic_axes = {'in_t': {0: 'batch'}, 'K': {0: 'batch', 2: 'N'}, 'V': {0: 'batch', 2: 'N'},
+                    'key_mask': {0: 'batch', 1: 'N'}, 't': {0: 'batch'}, 'y': {0: 'batch'}, 'A': {0: 'batch', 1: 'N'}}
+    dynamic_axes.update({name: {0: 'batch'} for name in state_inputs + state_outputs})
+
+    export_graph(
+        net.SourceEncoder(mapper, 0),
+        mapper.encoder_inputs(16, 2, device),
+        ['in_s', 'mask'],
+        ['K', 'V'],
+        {'in_s': {0: 'batch', 2: 'N'}, 'mask': {0: 'batch', 2: 'N'}, 'K': {0: 'batch', 2: 'N'}, 'V': {0: 'batch', 2: 'N'}},
+        str(tmp_path / 'encoder.onnx'))
+
+    export_graph(
+        mapper.decoder_step(2),
+        mapper.decoder_step_inputs(16, 2, device),
+        step_inputs,
+        ['y', 'A'] + state_outputs,
+        dynamic_axes,
+        str(tmp_path / 'decoder_step.onnx'))
+
+    return {
+        'encoder': OnnxGraph(str(tmp_path / 'encoder.onnx'), ['in_s', 'mask'], device),
+        'decoder_step': OnnxGraph(str(tmp_path / 'decoder_step.onnx'), step_inputs, device)
+    }
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+def test_onnx_graphs_match(mapper, graphs, lengths):
+
+    x = melspecs(lengths)
+    reference = convert(mapper, x, lengths)
+
+    # Twice, the second run binds preallocated outputs for the shapes seen in the first
+    for _ in range(2):
+        assert_close_melspecs(reference, convert(mapper, x, lengths, **graphs))
+
+
+def test_onnx_graphs_follow_changing_shapes(mapper, graphs):
+
+    # Batch sizes and source lengths change between runs of the same sessions,
+    # after their output shapes have been cached
+    for lengths in BATCHES + BATCHES[::-1]:
+        x = melspecs(lengths)
+
+        assert_close_melspecs(convert(mapper, x, lengths), convert(mapper, x, lengths, **graphs))
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import torch
+from service.padding import length_batches, pad_segments
+
+
+@pytest.mark.parametrize("max_batch_frames", [0, 1, 50, 120, 400])
+def test_length_batches(max_batch_frames):
+
+    lengths = [30, 12, 55, 12, 40, 100, 7, 33]
+    batches = length_batches(lengths, max_batch_frames)
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+
+    # Shortest first, and every batch within the frame budget once padded, unless it holds a single segment
+    order = [lengths[i] for batch in batches for i in batch]
+    assert order == sorted(order)
+
+    for batch in batches:
+        assert len(batch) == 1 or max_batch_frames <= 0 or len(batch)*max(lengths[i] for i in batch) <= max_batch_frames
+
+    if max_batch_frames <= 0:
+        assert len(batches) == 1
+
+
+def test_length_batches_of_nothing():
+
+    assert length_batches([], 100) == []
+
+
+@pytest.mark.parametrize("leading", [(), (1,)])
+def test_pad_segments(leading):
+
+    rng = np.random.default_rng(0)
+    segments = [rng.standard_normal((*leading, 4, length)).astype(np.float32) for length in (5, 9, 3)]
+
+    batch = pad_segments(segments, torch.device('cpu'), pad_value=-11.5)
+
+    assert batch.shape == (3, 4, 9)
+
+    for b, segment in enumerate(segments):
+        length = segment.shape[-1]
+        np.testing.assert_array_equal(batch[b, :, 0:length].numpy(), segment.reshape(4, length))
+        assert bool((batch[b, :, length:] == -11.5).all())
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import torch
+from convs2s import module as md
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+from service.precision import check_precision, autocast
+
+
+def test_unknown_precision_is_rejected():
+
+    with pytest.raises(ValueError):
+        check_precision('fp16')
+
+
+def test_attention_softmax_stays_fp32():
+
+    torch.manual_seed(0)
+    K, Q = torch.randn((2, 24, 10)), torch.randn((2, 24, 1))
+    key_mask = torch.zeros((2, 10, 1), dtype=torch.bool)
+    key_mask[1, 6:] = True
+
+    with autocast('bf16', torch.device('cpu')):
+        A = md.attention_weights(K, Q, key_mask)
+
+    assert A.dtype == torch.float
+    torch.testing.assert_close(A.sum(dim=1), torch.ones((2, 1)))
+    assert bool((A[1, 6:] == 0).all())
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+@pytest.mark.parametrize("attention_mode", ['raw', 'forward'])
+def test_bf16_mapper_stays_close(mapper, lengths, attention_mode):
+
+    x = melspecs(lengths)
+
+    reference = convert(mapper, x, lengths, attention_mode=attention_mode)
+
+    with autocast('bf16', torch.device('cpu')):
+        output = convert(mapper, x, lengths, attention_mode=attention_mode)
+
+    assert all(out.dtype == np.float32 for out in output)
+
+    scale = max(abs(ref).max() for ref in reference)
+
+    assert_close_melspecs(reference, output, atol=0.1*scale, frames=2)
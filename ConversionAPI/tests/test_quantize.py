@@ -0,0 +1,56 @@
+import pytest
+import torch
+from convs2s import module as md
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+
+
+@pytest.mark.parametrize("kernel_size, dilation, padding", [(1, 1, 0), (3, 1, 1), (5, 2, 4), (3, 4, 0)])
+def test_int8_conv_matches_conv(kernel_size, dilation, padding):
+
+    torch.manual_seed(0)
+    conv = torch.nn.Conv1d(24, 32, kernel_size, dilation=dilation, padding=padding)
+    x = torch.randn((2, 24, 40))
+
+    with torch.no_grad():
+        reference = conv(x)
+        output = md.Int8Conv1d(conv)(x)
+
+    assert output.shape == reference.shape
+    assert (output - reference).abs().max() < 0.05*reference.abs().max()
+
+
+@pytest.mark.parametrize("scales", [(1e-3, 1e2), (1e-4, 1.0, 1e3), (1.0, 1.0)])
+def test_int8_conv_keeps_every_channel_scale(scales):
+
+    # Output channels whose weights differ by orders of magnitude, each must stay close on its own scale
+    torch.manual_seed(0)
+    conv = torch.nn.Conv1d(24, len(scales), 5, dilation=2, padding=4)
+    x = torch.randn((2, 24, 40))
+
+    with torch.no_grad():
+        for o, scale in enumerate(scales):
+            conv.weight[o] *= scale
+            conv.bias[o] *= scale
+
+        reference = conv(x)
+        output = md.Int8Conv1d(conv)(x)
+
+    error = (output - reference).abs().amax(dim=(0, 2))
+
+    assert (error < 0.05*reference.abs().amax(dim=(0, 2))).all()
+
+
+@pytest.mark.parametrize("lengths", BATCHES)
+def test_quantized_mapper_stays_close(mapper, lengths):
+
+    x = melspecs(lengths)
+
+    reference = convert(mapper, x, lengths)
+
+    mapper.quantize()
+
+    assert not any(isinstance(m, torch.nn.Conv1d) for m in mapper.modules())
+
+    scale = max(abs(ref).max() for ref in reference)
+
+    assert_close_melspecs(reference, convert(mapper, x, lengths), atol=0.1*scale, frames=2)
@@ -0,0 +1,46 @@
+from math import gcd
+import librosa
+import numpy as np
+import pytest
+import scipy.signal
+import torch
+from service.resampler import Resampler
+
+RATES = [(44100, 22050), (48000, 22050), (44100, 16000), (48000, 16000)]
+
+
+def tones(sr, frequencies, seconds=1.0):
+
+    t = np.arange(int(sr*seconds))/sr
+    phases = np.random.default_rng(0).uniform(0.0, 2*np.pi, len(frequencies))
+
+    return sum(0.2*np.sin(2*np.pi*f*t + p) for f, p in zip(frequencies, phases)).astype(np.float32)
+
+
+@pytest.mark.parametrize("orig_sr, target_sr", RATES)
+def test_passband_matches_reference_resamplers(orig_sr, target_sr):
+
+    # Tones up to 70% of the target Nyquist frequency, compared away from the edges of the waveform
+    waveform = tones(orig_sr, [f*target_sr/2 for f in [0.01, 0.1, 0.3, 0.5, 0.7]])
+
+    output = Resampler(torch.device('cpu')).resample(waveform, orig_sr, target_sr)
+
+    g = gcd(orig_sr, target_sr)
+    references = [
+        librosa.resample(waveform, orig_sr=orig_sr, target_sr=target_sr),
+        scipy.signal.resample_poly(waveform, target_sr//g, orig_sr//g)]
+
+    for reference in references:
+        assert output.shape == reference.shape
+        np.testing.assert_allclose(output[100:-100], reference[100:-100], rtol=0, atol=5e-3)
+
+
+@pytest.mark.parametrize("orig_sr, target_sr", RATES)
+def test_stopband_is_attenuated(orig_sr, target_sr):
+
+    # A tone well above the target Nyquist frequency must not alias into the output
+    waveform = tones(orig_sr, [0.7*orig_sr/2])
+
+    output = Resampler(torch.device('cpu')).resample(waveform, orig_sr, target_sr)
+
+    assert np.abs(output[100:-100]).max() < 0.01*0.2
@@ -0,0 +1,141 @@
+import threading
+import time
+import numpy as np
+import pytest
+from service.scheduler import DecodeScheduler
+
+
+class FakeBatch:
+
+    # Rows finish after a number of steps given by their source, a step fails while a NaN source is in the batch
+    def __init__(self):
+
+        self.tags = list()
+        self.rows = list()
+        self.started = threading.Event()
+        self.go = threading.Event()
+
+    @property
+    def size(self):
+        return len(self.tags)
+
+    def admit(self, K, V, key_mask, N_b, tags, c_t=None):
+
+        self.rows += [[melspec, int(melspec.shape[-1])] for melspec in K]
+        self.tags += list(tags)
+
+    def clear(self):
+
+        tags, self.tags, self.rows = self.tags, list(), list()
+
+        return tags
+
+    def step(self):
+
+        self.started.set()
+        self.go.wait()
+
+        if any(np.isnan(melspec).any() for melspec, _ in self.rows):
+            raise ValueError("bad segment")
+
+        for row in self.rows:
+            row[1] -= 1
+
+        finished = [(tag, 2*row[0]) for tag, row in zip(self.tags, self.rows) if row[1] == 0]
+
+        self.tags = [tag for tag, row in zip(self.tags, self.rows) if row[1] > 0]
+        self.rows = [row for row in self.rows if row[1] > 0]
+
+        return finished
+
+
+def fake_scheduler(batches):
+
+    # DecodeScheduler over the given batches, the first one is its live batch and the second the retry batch
+    batches = iter(batches)
+
+    return DecodeScheduler(lambda: next(batches), lambda melspec_list: (melspec_list, None, None, None))
+
+
+def test_failing_segment_fails_only_its_request():
+
+    batch, retry_batch = FakeBatch(), FakeBatch()
+    retry_batch.go.set()
+
+    scheduler = fake_scheduler([batch, retry_batch])
+
+    good = [np.full((1, 2, 5), 1.0), np.full((1, 2, 3), 2.0)]
+    bad = [np.full((1, 2, 4), np.nan)]
+    results = dict()
+
+    def request(name, melspec_list):
+        try:
+            results[name] = scheduler.submit(melspec_list, 0)
+        except ValueError as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=request, args=('good', good))]
+    threads[0].start()
+
+    # The bad request joins the live batch of the good one
+    batch.started.wait()
+    threads.append(threading.Thread(target=request, args=('bad', bad)))
+    threads[1].start()
+
+    time.sleep(0.1)
+    batch.go.set()
+
+    for thread in threads:
+        thread.join(timeout=5)
+
+    scheduler.stop()
+
+    assert isinstance(results['bad'], ValueError)
+    assert len(results['good']) == 2
+
+    for melspec, melspec_conv in zip(good, results['good']):
+        np.testing.assert_array_equal(melspec_conv, 2*melspec)
+
+
+def test_requests_are_served_while_a_retry_runs():
+
+    batch, retry_batch = FakeBatch(), FakeBatch()
+    batch.go.set()
+
+    scheduler = fake_scheduler([batch, retry_batch])
+    results = dict()
+
+    def request(name, melspec_list):
+        try:
+            results[name] = scheduler.submit(melspec_list, 0)
+        except ValueError as e:
+            results[name] = e
+
+    bad = threading.Thread(target=request, args=('bad', [np.full((1, 2, 4), np.nan)]))
+    bad.start()
+
+    # The failed segment is held in its retry while a new request comes in
+    assert retry_batch.started.wait(timeout=5)
+
+    good = threading.Thread(target=request, args=('good', [np.full((1, 2, 3), 1.0)]))
+    good.start()
+    good.join(timeout=5)
+
+    assert 'good' in results and 'bad' not in results
+
+    retry_batch.go.set()
+    bad.join(timeout=5)
+
+    scheduler.stop()
+
+    np.testing.assert_array_equal(results['good'][0], np.full((1, 2, 3), 2.0))
+    assert isinstance(results['bad'], ValueError)
+
+
+def test_stopped_scheduler_rejects_requests():
+
+    scheduler = fake_scheduler([FakeBatch(), FakeBatch()])
+    scheduler.stop()
+
+    with pytest.raises(RuntimeError):
+        scheduler.submit([np.zeros((1, 2, 3))], 0)
@@ -0,0 +1,111 @@
+import json
+import os
+import numpy as np
+import pytest
+from service.segmentation import split_waveform, voice_activity, bucket_counts, speech_like
+
+SR = 16000
+
+
+@pytest.mark.parametrize("buckets", [None, [2.0, 2.5, 3.0, 3.5, 4.0]])
+def test_segments_add_up_within_bounds(buckets):
+
+    waveform = speech_like(60.0, SR)
+    segments = split_waveform(waveform, SR, 2.0, 4.0, 0.025, buckets)
+
+    np.testing.assert_array_equal(np.concatenate(segments), waveform)
+
+    lengths = np.array([segment.shape[0] for segment in segments])/SR
+
+    assert np.all(lengths[:-1] >= 2.0)
+    assert np.all(lengths <= 4.0)
+
+
+def test_bucketed_segments_have_bucket_lengths():
+
+    buckets = [2.0, 3.0, 4.0]
+    segments = split_waveform(speech_like(60.0, SR, seed=1), SR, 2.0, 4.0, 0.025, buckets)
+    counts = bucket_counts(segments, SR, buckets)
+
+    assert sum(counts.values()) == len(segments)
+    assert counts['other'] <= 1
+    assert all(segment.shape[0] in (2*SR, 3*SR, 4*SR) for segment in segments[:-1])
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_bucketed_cuts_fall_in_pauses_like_unbucketed_ones(seed):
+
+    # Segments cut to 125 ms buckets still end in the pauses of speech about as often as free cuts
+    waveform = speech_like(120.0, SR, seed)
+    half = int(0.025*SR)//2
+
+    def pause_fraction(segments):
+        cuts = np.cumsum([segment.shape[0] for segment in segments])[:-1]
+        rms = np.array([np.sqrt(np.mean(np.square(waveform[cut-half:cut+half]))) for cut in cuts])
+        return np.mean(rms < 0.01)
+
+    segments = split_waveform(waveform, SR, 2.0, 4.0, 0.025)
+    bucketed = split_waveform(waveform, SR, 2.0, 4.0, 0.025, [2.0 + 0.125*i for i in range(17)])
+
+    assert abs(len(bucketed) - len(segments)) <= 0.1*len(segments)
+    assert pause_fraction(segments) == 1.0
+    assert pause_fraction(bucketed) >= 0.9
+
+
+def test_cuts_fall_in_pauses():
+
+    # Bursts of 2.5 s separated by 0.5 s of silence, every cut lands in a silence
+    burst, pause = np.ones(int(2.5*SR), dtype=np.float32), np.zeros(SR//2, dtype=np.float32)
+    waveform = np.concatenate([burst, pause]*6)
+
+    segments = split_waveform(waveform, SR, 2.0, 4.0, 0.025)
+    cuts = np.cumsum([segment.shape[0] for segment in segments])[:-1]
+
+    assert len(cuts) > 0
+    assert np.all(waveform[cuts] == 0)
+
+
+def test_short_waveform_is_one_segment():
+
+    waveform = speech_like(1.5, SR)
+
+    assert len(split_waveform(waveform, SR, 2.0, 4.0)) == 1
+    assert len(split_waveform(np.zeros(0, dtype=np.float32), SR)) == 0
+
+
+def test_voice_activity_drops_quiet_segments():
+
+    rng = np.random.default_rng(0)
+    loud = 0.3*rng.standard_normal(2*SR).astype(np.float32)
+    quiet = 0.0001*rng.standard_normal(2*SR).astype(np.float32)
+    blip = np.concatenate([0.3*rng.standard_normal(SR//20), 0.0001*rng.standard_normal(SR)]).astype(np.float32)
+
+    assert voice_activity([loud, quiet, blip], SR) == [True, False, False]
+    assert voice_activity([quiet], SR) == [False]
+
+
+def test_voice_activity_keeps_short_and_quiet_words():
+
+    # With the shipped configuration, voice activity detection is off. When it is turned on,
+    # a short word in a long silence and a word 30 dB below the loudest one are still speech.
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'data_config.json')) as f:
+        data_config = json.load(f)
+
+    assert not data_config['vad']
+
+    rng = np.random.default_rng(0)
+    silence = lambda seconds: 0.0001*rng.standard_normal(int(SR*seconds))
+
+    loud = np.concatenate([silence(1.0), 0.3*rng.standard_normal(SR), silence(1.0)]).astype(np.float32)
+    short = np.concatenate([silence(1.9), 0.3*rng.standard_normal(int(0.15*SR)), silence(1.9)]).astype(np.float32)
+    quiet = np.concatenate([silence(1.5), 0.0095*rng.standard_normal(SR//2), silence(1.5)]).astype(np.float32)
+
+    speech = voice_activity(
+        [loud, short, quiet, silence(4.0).astype(np.float32)],
+        SR,
+        data_config['segment_frame_length'],
+        data_config['vad_threshold_db'],
+        data_config['vad_floor_db'],
+        data_config['vad_min_speech'])
+
+    assert speech == [True, True, True, False]
@@ -0,0 +1,19 @@
+import pytest
+from helpers import BATCHES, assert_close_melspecs, convert, melspecs
+
+
+# Besides the shared batches, segments shorter than the history of the causal layers,
+# where the folded speaker embedding only reaches part of the taps
+@pytest.mark.parametrize("lengths", BATCHES + [[3, 5, 8]])
+@pytest.mark.parametrize("attention_mode", ['raw', 'forward', 'diagonal'])
+def test_specialized_mapper_matches(mapper, lengths, attention_mode):
+
+    x = melspecs(lengths)
+
+    reference = convert(mapper, x, lengths, attention_mode=attention_mode, lean=False)
+
+    mapper.specialize(0, 2)
+
+    assert mapper.specialized
+
+    assert_close_melspecs(reference, convert(mapper, x, lengths, attention_mode=attention_mode, lean=False), atol=1e-5)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+pytest.importorskip("nemo")
+
+from service import vocoder
+from service.silence import SilentSegment
+
+NUM_MELS, HOP, SR = 8, 16, 22050
+
+
+class StubHifiGan:
+
+    # Stands in for HifiGanModel: a convolution over 2 frames on each side, every frame upsampled to HOP samples
+    def __init__(self):
+
+        self.weight = torch.randn((1, NUM_MELS, 5), generator=torch.Generator().manual_seed(0))
+
+    @classmethod
+    def restore_from(cls, path):
+        return cls()
+
+    def to(self, device):
+        return self
+
+    def convert_spectrogram_to_audio(self, spec):
+
+        x = torch.tanh(F.conv1d(spec, self.weight, padding=2)/10.0)
+
+        return x.repeat_interleave(HOP, dim=2)[:, 0]
+
+
+@pytest.fixture
+def create_vocoder(monkeypatch, tmp_path):
+
+    monkeypatch.setattr(vocoder, 'HifiGanModel', StubHifiGan)
+    (tmp_path / 'config.yaml').write_text(f"sample_rate: {SR}\n")
+
+    def create(**options):
+        model = vocoder.SpectrogramVocoder(str(tmp_path), 'model.nemo', 'config.yaml', torch.device('cpu'), **options)
+        model.load()
+        return model
+
+    return create
+
+
+def melspecs(lengths):
+
+    rng = np.random.default_rng(0)
+
+    return [(rng.standard_normal((NUM_MELS, length)) - 5.0).astype(np.float32) for length in lengths]
+
+
+@pytest.mark.parametrize("max_batch_frames", [0, 60])
+def test_padded_batch_matches_each_segment_alone(create_vocoder, max_batch_frames):
+
+    # The context frames cover the stub's receptive field, so padding must not change any sample
+    segments = melspecs([30, 7, 22, 41, 3])
+
+    model = create_vocoder(max_batch_frames=max_batch_frames, context_frames=4)
+
+    output = model.synthesize(segments)
+    reference = [model.synthesize([segment])[0] for segment in segments]
+
+    for segment, ref, out in zip(segments, reference, output):
+        assert out.shape == ref.shape == (segment.shape[-1]*HOP,)
+        np.testing.assert_allclose(out, ref, rtol=0, atol=1e-6)
+
+
+def test_silent_segments_keep_their_place(create_vocoder):
+
+    segments = melspecs([30, 22])
+    model = create_vocoder(context_frames=4)
+
+    output = model.synthesize([segments[0], SilentSegment(0.5), segments[1]])
+
+    assert [out.shape[0] for out in output] == [30*HOP, round(0.5*SR), 22*HOP]
+    assert not output[1].any()
+    np.testing.assert_allclose(output[2], model.synthesize([segments[1]])[0], rtol=0, atol=1e-6)
+
+
+def test_chunked_stream_matches_whole_segments(create_vocoder):
+
+    segments = melspecs([30, 22])
+
+    whole, _ = create_vocoder(context_frames=4).vocode(segments)
+    chunked, _ = create_vocoder(context_frames=4, chunk_frames=7).vocode(segments)
+
+    assert chunked.shape == whole.shape
+    np.testing.assert_allclose(chunked, whole, rtol=0, atol=1e-5)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from convs2s import dtw
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+
+    help = "Times the vectorized banded DTW against the reference loop, their equivalence is covered by tests/test_dtw.py."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--frames', type=int, default=83, help="source frames N, the attention matrix is N x 2N")
+        parser.add_argument('--band', type=int, default=100)
+        parser.add_argument('--repeats', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+
+    def handle(self, *args, **options):
+
+        rng = np.random.default_rng(options['seed'])
+
+        N = options['frames']
+        w = options['band']
+
+        loop_time = 0.0
+        vectorized_time = 0.0
+
+        for _ in range(options['repeats']):
+
+            # Same distance as the one computed from the attention matrix in ConvS2S.inference
+            A = rng.random((N, 2*N)).astype(np.float32)
+            D0 = 1.0 - A**0.3
+
+            start = time.perf_counter()
+            dtw.banded_dtw_loop(D0, w=w, p=0.1)
+            loop_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            dtw.banded_dtw(D0, w=w, p=0.1)
+            vectorized_time += time.perf_counter() - start
+
+        repeats = options['repeats']
+
+        self.stdout.write(f"{N} x {2*N} matrix, band {w}, {repeats} runs")
+        self.stdout.write(f"reference loop: {1000*loop_time/repeats:.2f} ms per matrix")
+        self.stdout.write(f"vectorized:     {1000*vectorized_time/repeats:.2f} ms per matrix")
+        self.stdout.write(f"speed-up:       {loop_time/vectorized_time:.1f}x")
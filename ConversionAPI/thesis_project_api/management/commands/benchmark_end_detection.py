@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from service.profiling import timed, deviation
+from service.silence import is_silent
+import soundfile as sf
+import numpy as np
+
+
+class Command(BaseCommand):
+
+    help = "Reports decode time, output length and mel deviation of online end detection against the DTW trim on a test clip."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('clip', type=str, help="WAV file converted by every configured mapper")
+        parser.add_argument('--tail', type=int, default=None, help="end_tail to try instead of the configured one")
+        parser.add_argument('--threshold', type=float, default=None, help="end_threshold to try instead of the configured one")
+        parser.add_argument('--patience', type=int, default=None, help="end_patience to try instead of the configured one")
+        parser.add_argument('--repeats', type=int, default=3)
+
+
+    def handle(self, *args, **options):
+
+        # Loads the configured models, the dtw/online pairs are built from the same configuration
+        import service
+
+        waveform, sr = sf.read(options['clip'])
+        melspec_list = service.preprocessor.preprocess_waveform(waveform, sr)
+
+        speech = [not is_silent(melspec) for melspec in melspec_list]
+        repeats = options['repeats']
+
+        self.stdout.write(f"{options['clip']}: {sum(speech)} speech segments, {repeats} runs per mapper")
+
+        overrides = {
+            name: options[option]
+            for name, option in (("end_tail", 'tail'), ("end_threshold", 'threshold'), ("end_patience", 'patience'))
+            if options[option] is not None}
+
+        for mapper_json in service.api_config["conversion"]["mappers"]["files"]:
+
+            target = mapper_json.get("trg_spk") or service.api_config["conversion"]["vocoders"]["files"][0]["trg_spk"]
+            results = dict()
+
+            for end_detection in ('dtw', 'online'):
+
+                converter = service.create_converter({**mapper_json, **overrides, "end_detection": end_detection})
+                converter.load()
+
+                results[end_detection] = timed(lambda: converter.convert(melspec_list, target), repeats)
+
+                converter.unload()
+
+            (reference, dtw_time), (output, online_time) = results['dtw'], results['online']
+
+            # Frames the online end adds (+) or cuts (-) per segment, compared to the DTW trim
+            frames = np.array([out.shape[-1] - ref.shape[-1] for ref, out in zip(reference, output) if not is_silent(ref)])
+            max_diff, mean_diff = deviation(reference, output)
+
+            settings = {**mapper_json, **overrides}
+
+            self.stdout.write(
+                f"mapper {target} (tail {settings['end_tail']}, threshold {settings['end_threshold']}, patience {settings['end_patience']}): "
+                f"{1000*dtw_time:.0f} ms -> {1000*online_time:.0f} ms ({dtw_time/online_time:.2f}x), "
+                f"length {frames.mean() if len(frames) > 0 else 0.0:+.1f} frames on average, "
+                f"{np.abs(frames).max() if len(frames) > 0 else 0} at most, "
+                f"max |diff| {max_diff:.4f}, mean |diff| {mean_diff:.4f} over the common frames")
@@ -0,0 +1,117 @@
+from django.core.management.base import BaseCommand
+from service.profiling import timed, deviation, snr_db
+from service.silence import is_silent
+import soundfile as sf
+import torch
+
+
+class Command(BaseCommand):
+
+    help = "Reports speed-up and mel/waveform deviation of bf16 stages against fp32 on a test clip."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('clip', type=str, help="WAV file converted by every stage")
+        parser.add_argument('--target', type=str, default=None, help="target speaker, the first configured vocoder's by default")
+        parser.add_argument('--repeats', type=int, default=3)
+
+
+    def handle(self, *args, **options):
+
+        # Loads the configured models, the fp32/bf16 pairs are built from the same configuration
+        # as PyTorch models, bf16 does not combine with int8 weights or the ONNX backend
+        import service
+
+        conversion_config = service.api_config["conversion"]
+
+        vocoder_files = conversion_config["vocoders"]["files"]
+        target = options['target'] or vocoder_files[0]["trg_spk"]
+
+        # An any-to-many mapper has no target speaker of its own
+        mapper_json = next(m for m in conversion_config["mappers"]["files"] if m.get("trg_spk") in (target, None))
+        vocoder_json = next(v for v in vocoder_files if v["trg_spk"] == target)
+        enhancer_json = conversion_config["enhancer"]
+
+        torch_only = {"quantize": False, "backend": "torch"}
+
+        waveform, sr = sf.read(options['clip'])
+
+        self.__repeats = options['repeats']
+
+        self.stdout.write(f"{options['clip']}: target {target}, {self.__repeats} runs per model")
+
+        # Every stage is compared on the fp32 output of the previous one, and also fed the bf16
+        # output of the previous one for the deviation of an all-bf16 pipeline
+        melspec_list, bf16_list = self.__compare(
+            "features",
+            lambda precision: service.create_preprocessor({**conversion_config["preprocessor"], "precision": precision}),
+            lambda preprocessor, waveform: preprocessor.preprocess_waveform(waveform, sr),
+            (waveform, waveform))
+
+        self.stdout.write(f"{len(melspec_list)} segments")
+
+        melspec_list, bf16_list = self.__compare(
+            "mapper",
+            lambda precision: service.create_converter({**mapper_json, **torch_only, "precision": precision}),
+            lambda converter, melspec_list: converter.convert(melspec_list, target),
+            (melspec_list, bf16_list))
+
+        if enhancer_json != None:
+            melspec_list, bf16_list = self.__compare(
+                "enhancer",
+                lambda precision: service.create_enhancer({**enhancer_json, **torch_only, "precision": precision}),
+                lambda enhancer, melspec_list: enhancer.enhance(melspec_list),
+                (melspec_list, bf16_list))
+
+        audio, bf16_audio = self.__compare(
+            "vocoder",
+            lambda precision: service.create_vocoder({**vocoder_json, **torch_only, "precision": precision}),
+            lambda vocoder, melspec_list: vocoder.vocode(melspec_list)[0],
+            (melspec_list, bf16_list))
+
+        max_diff, mean_diff = deviation([audio], [bf16_audio])
+
+        self.stdout.write(
+            f"{'all bf16':>8}: max |diff| {max_diff:.4f}, mean |diff| {mean_diff:.5f}, SNR {snr_db(audio, bf16_audio):.1f} dB"
+            + ("" if audio.shape == bf16_audio.shape else f", {bf16_audio.shape[-1] - audio.shape[-1]:+d} samples"))
+
+
+    def __compare(self, stage, create, run, inputs):
+
+        # Runs the fp32 and bf16 model of a stage, returns the fp32 output on the fp32 input
+        # and the bf16 output on the bf16 input
+        reference_input, bf16_input = inputs
+
+        fp32_model, bf16_model = create('fp32'), create('bf16')
+
+        # The preprocessor has no weights to load
+        for model in (fp32_model, bf16_model):
+            if hasattr(model, 'load'):
+                model.load()
+
+        reference, fp32_time = timed(lambda: run(fp32_model, reference_input), self.__repeats)
+        output, bf16_time = timed(lambda: run(bf16_model, reference_input), self.__repeats)
+        bf16_output = run(bf16_model, bf16_input)
+
+        for model in (fp32_model, bf16_model):
+            if hasattr(model, 'unload'):
+                model.unload()
+
+        if isinstance(reference, list):
+            # The preprocessor returns its melspecs as tensors on the model device
+            reference_frames = [ref if is_silent(ref) else torch.as_tensor(ref).cpu().numpy() for ref in reference]
+            output_frames = [out if is_silent(out) else torch.as_tensor(out).cpu().numpy() for out in output]
+
+            max_diff, mean_diff = deviation(reference_frames, output_frames)
+            quality = f"max |diff| {max_diff:.4f}, mean |diff| {mean_diff:.4f}"
+            lengths_match = all(is_silent(ref) or ref.shape == out.shape for ref, out in zip(reference, output))
+        else:
+            max_diff, mean_diff = deviation([reference], [output])
+            quality = f"max |diff| {max_diff:.4f}, mean |diff| {mean_diff:.5f}, SNR {snr_db(reference, output):.1f} dB"
+            lengths_match = reference.shape == output.shape
+
+        self.stdout.write(
+            f"{stage:>8}: {1000*fp32_time:.0f} ms -> {1000*bf16_time:.0f} ms ({fp32_time/bf16_time:.2f}x), "
+            f"{quality}" + ("" if lengths_match else ", output lengths differ"))
+
+        return reference, bf16_output
@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from service.profiling import timed, deviation
+import soundfile as sf
+
+
+class Command(BaseCommand):
+
+    help = "Reports speed-up, memory saved and output deviation of the int8 quantized mapper and enhancer against fp32 on a test clip."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('clip', type=str, help="WAV file converted by the mapper and enhancer")
+        parser.add_argument('--target', type=str, default=None, help="target speaker, the first configured vocoder's by default")
+        parser.add_argument('--repeats', type=int, default=3)
+
+
+    def handle(self, *args, **options):
+
+        # Loads the configured models, the fp32/int8 pairs are built from the same configuration
+        import service
+
+        conversion_config = service.api_config["conversion"]
+
+        target = options['target'] or conversion_config["vocoders"]["files"][0]["trg_spk"]
+
+        # An any-to-many mapper has no target speaker of its own
+        mapper_json = next(m for m in conversion_config["mappers"]["files"] if m.get("trg_spk") in (target, None))
+        enhancer_json = conversion_config["enhancer"]
+
+        waveform, sr = sf.read(options['clip'])
+        melspec_list = service.preprocessor.preprocess_waveform(waveform, sr)
+
+        repeats = options['repeats']
+
+        self.stdout.write(f"{options['clip']}: {len(melspec_list)} segments, target {target}, {repeats} runs per model")
+
+        conv_melspec_list = self.__compare(
+            "mapper",
+            lambda quantize: service.create_converter({**mapper_json, "quantize": quantize}),
+            lambda converter: converter.convert(melspec_list, target),
+            repeats)
+
+        # The vocoder is not quantized, unfolding the taps of the generator's long, wide convolutions costs
+        # far more memory than int8 weights save
+        if enhancer_json != None:
+            self.__compare(
+                "enhancer",
+                lambda quantize: service.create_enhancer({**enhancer_json, "quantize": quantize}),
+                lambda enhancer: enhancer.enhance(conv_melspec_list),
+                repeats)
+
+
+    def __compare(self, stage, create, run, repeats):
+
+        # Runs the fp32 and int8 model of a stage on the same input, returns the fp32 output for the next stage
+        results = dict()
+
+        for quantize in (False, True):
+
+            model = create(quantize)
+            model.load()
+
+            output, seconds = timed(lambda: run(model), repeats)
+            results[quantize] = (output, seconds, model.footprint)
+
+            model.unload()
+
+        (reference, fp32_time, fp32_bytes), (output, int8_time, int8_bytes) = results[False], results[True]
+
+        max_diff, mean_diff = deviation(reference, output)
+
+        self.stdout.write(
+            f"{stage:>8}: {1000*fp32_time:.0f} ms -> {1000*int8_time:.0f} ms ({fp32_time/int8_time:.2f}x), "
+            f"{fp32_bytes/2**20:.1f} MB -> {int8_bytes/2**20:.1f} MB ({100*(1-int8_bytes/fp32_bytes):.0f}% saved), "
+            f"max |diff| {max_diff:.4f}, mean |diff| {mean_diff:.4f}")
+
+        return reference
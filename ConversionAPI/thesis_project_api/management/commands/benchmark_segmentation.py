@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from service.segmentation import split_waveform, split_waveform_loop, bucket_counts, speech_like
+import numpy as np
+import json
+import time
+import os
+
+
+class Command(BaseCommand):
+
+    help = "Times the vectorized segmenter against the reference sample loop on a long synthetic recording and compares their cuts, with and without length buckets (the configured ones, or 125 ms steps when bucketing is off), the segment bounds are covered by tests/test_segmentation.py."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--seconds', type=float, default=300.0, help="length of the synthetic recording")
+        parser.add_argument('--sr', type=int, default=32000)
+        parser.add_argument('--repeats', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+
+    def handle(self, *args, **options):
+
+        # Segment lengths as the preprocessor reads them, without loading the models
+        with open('./thesis_project_api/api_config.json') as f:
+            files_config = json.load(f)["files"]
+
+        with open(os.path.join(files_config["path"], files_config["data_config"])) as f:
+            data_config = json.load(f)
+
+        min_length = data_config['segment_min_length']
+        max_length = data_config['segment_max_length']
+        frame_length = data_config['segment_frame_length']
+        # Bucketing is off unless the config lists bucket lengths, the benchmark then times steps of 125 ms
+        buckets = data_config['segment_buckets'] or [min_length + 0.125*i for i in range(int((max_length - min_length)/0.125) + 1)]
+
+        sr = options['sr']
+        waveform = speech_like(options['seconds'], sr, options['seed'])
+
+        repeats = options['repeats']
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            loop_segments = split_waveform_loop(waveform, sr, max_length)
+        loop_time = (time.perf_counter() - start)/repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            segments = split_waveform(waveform, sr, min_length, max_length, frame_length)
+        vectorized_time = (time.perf_counter() - start)/repeats
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            bucketed_segments = split_waveform(waveform, sr, min_length, max_length, frame_length, buckets)
+        bucketed_time = (time.perf_counter() - start)/repeats
+
+        counts = bucket_counts(bucketed_segments, sr, buckets)
+
+        self.stdout.write(f"{options['seconds']:.0f} s at {sr} Hz, segments of {min_length}-{max_length} s, {frame_length*1000:.0f} ms frames, {repeats} runs")
+        self.stdout.write(f"reference loop: {1000*loop_time:.1f} ms, {len(loop_segments)} segments, {self.__cut_level(loop_segments, sr, frame_length)}")
+        self.stdout.write(f"vectorized:     {1000*vectorized_time:.1f} ms, {len(segments)} segments, {self.__cut_level(segments, sr, frame_length)}")
+        self.stdout.write(f"speed-up:       {loop_time/vectorized_time:.1f}x")
+        self.stdout.write(f"bucketed:       {1000*bucketed_time:.1f} ms, {len(bucketed_segments)} segments, {self.__cut_level(bucketed_segments, sr, frame_length)}")
+        self.stdout.write(f"segment shapes: {self.__shapes(segments)} vectorized, {self.__shapes(bucketed_segments)} bucketed")
+        self.stdout.write("segments per bucket: " + ", ".join(f"{bucket}: {count}" for bucket, count in counts.items()))
+
+
+    @staticmethod
+    def __cut_level(segments, sr, frame_length):
+
+        # RMS of the frame_length around every cut, lower means quieter cuts
+        half = max(1, int(sr*frame_length)//2)
+        waveform = np.concatenate(segments)
+        cuts = np.cumsum([segment.shape[0] for segment in segments])[:-1]
+
+        rms = [np.sqrt(np.mean(np.square(waveform[max(cut-half, 0):cut+half]))) for cut in cuts]
+
+        return f"mean RMS at cuts {np.mean(rms) if len(rms) > 0 else 0.0:.4f}"
+
+
+    @staticmethod
+    def __shapes(segments):
+
+        # Distinct segment lengths, each a separate input shape for the models
+        return len({segment.shape[0] for segment in segments})
@@ -0,0 +1,130 @@
+from django.core.management.base import BaseCommand, CommandError
+from service.profiling import deviation, snr_db
+from service.silence import is_silent
+import soundfile as sf
+import numpy as np
+
+
+class Command(BaseCommand):
+
+    help = "Exports the ONNX graphs of the configured mappers, vocoders and enhancer and checks them against the PyTorch outputs."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument('--clip', type=str, default=None, help="WAV file to check on, a few seconds of noise by default")
+        parser.add_argument('--target', type=str, default=None, help="only export the models of this target speaker")
+        parser.add_argument('--tolerance', type=float, default=1e-3, help="max |diff| allowed on spectrogram frames")
+        parser.add_argument('--min-snr', type=float, default=40.0, help="min SNR in dB of the exported vocoder's audio")
+        parser.add_argument('--seed', type=int, default=0)
+
+
+    def handle(self, *args, **options):
+
+        import service
+
+        conversion_config = service.api_config["conversion"]
+
+        if options['clip'] != None:
+            waveform, sr = sf.read(options['clip'])
+        else:
+            sr = 32000
+            waveform = 0.1*np.random.default_rng(options['seed']).standard_normal(3*sr)
+
+        melspec_list = service.preprocessor.preprocess_waveform(waveform, sr)
+
+        self.__tolerance = options['tolerance']
+        self.__failed = list()
+
+        # An any-to-many mapper has no target speaker of its own
+        mapper_files = [m for m in conversion_config["mappers"]["files"] if options['target'] in (None, m.get("trg_spk")) or m.get("trg_spk") == None]
+        vocoder_files = [v for v in conversion_config["vocoders"]["files"] if options['target'] in (None, v["trg_spk"])]
+        enhancer_json = conversion_config["enhancer"]
+
+        conv_melspec_lists = dict()
+
+        for mapper_json in mapper_files:
+
+            target = mapper_json.get("trg_spk") or options['target'] or vocoder_files[0]["trg_spk"]
+
+            conv_melspec_lists[target] = self.__check_melspec(
+                f"mapper {target}",
+                lambda backend: service.create_converter({**mapper_json, "backend": backend}),
+                lambda converter: converter.convert(melspec_list, target))
+
+        if enhancer_json != None:
+
+            # The same enhancer serves every target, it is checked on the first one
+            enhancer_input = next(iter(conv_melspec_lists.values()), melspec_list)
+
+            self.__check_melspec(
+                "enhancer",
+                lambda backend: service.create_enhancer({**enhancer_json, "backend": backend}),
+                lambda enhancer: enhancer.enhance(enhancer_input),
+                stochastic=True)
+
+        for vocoder_json in vocoder_files:
+
+            target = vocoder_json["trg_spk"]
+            vocoder_input = conv_melspec_lists.get(target, melspec_list)
+
+            reference, output = self.__run_both(
+                lambda backend: service.create_vocoder({**vocoder_json, "backend": backend}),
+                lambda vocoder: vocoder.vocode(vocoder_input)[0])
+
+            snr = snr_db(reference, output)
+
+            self.__report(f"vocoder {target}", snr >= options['min_snr'], f"SNR {snr:.1f} dB")
+
+        if len(self.__failed) > 0:
+            raise CommandError(f"ONNX outputs differ from PyTorch for: {', '.join(self.__failed)}")
+
+
+    def __run_both(self, create, run, repeat_reference=False):
+
+        # Loading the ONNX backend exports its graphs, unless they are already cached
+        outputs = list()
+
+        for backend in ('torch', 'onnx'):
+
+            model = create(backend)
+            model.load()
+
+            outputs.append(run(model))
+
+            if backend == 'torch' and repeat_reference:
+                outputs.append(run(model))
+
+            model.unload()
+
+        return outputs
+
+
+    def __check_melspec(self, stage, create, run, stochastic=False):
+
+        # A stochastic model is compared against its own run-to-run variation
+        if stochastic:
+            reference, repeated, output = self.__run_both(create, run, repeat_reference=True)
+            tolerance = max(self.__tolerance, 2.0*deviation(reference, repeated)[0])
+        else:
+            reference, output = self.__run_both(create, run)
+            tolerance = self.__tolerance
+
+        max_diff, mean_diff = deviation(reference, output)
+
+        lengths_match = all(is_silent(ref) or ref.shape == out.shape for ref, out in zip(reference, output))
+
+        self.__report(
+            stage,
+            lengths_match and max_diff <= tolerance,
+            f"max |diff| {max_diff:.2e}, mean |diff| {mean_diff:.2e}, tolerance {tolerance:.2e}"
+            + ("" if lengths_match else ", output lengths differ"))
+
+        return reference
+
+
+    def __report(self, stage, passed, details):
+
+        if not passed:
+            self.__failed.append(stage)
+
+        self.stdout.write(f"{stage:>12}: {'ok' if passed else 'FAILED'}, {details}")